@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 import os, re
 
 from .routes import route_bp
+from . import metrics, matrix_store
 from flask_sse import sse
 
 def create_app():
@@ -26,4 +27,6 @@ def create_app():
 
     app.register_blueprint(route_bp, url_prefix="/api")
     app.register_blueprint(sse, url_prefix="/api/realtime_feed")
+    metrics.init_app(app)   # Server-Timing + /api/metrics counters
+    matrix_store.load_all()  # mmap precomputed location matrices (python -m Flaskr.matrix_store build)
     return app
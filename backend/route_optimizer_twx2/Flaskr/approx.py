@@ -0,0 +1,178 @@
+import os, time, threading
+import numpy as np
+
+from .cache import matrix_cache
+from .geometry import haversine_m
+from .matrix_store import get_store
+from .metrics import Counter
+
+# Great-circle estimates of the road matrix.
+#   approx_matrix: haversine x a per-profile circuity factor; duration = distance / speed.
+#     Both factors are calibrated from real ORS pairs (the matrix cache and the
+#     precomputed location store) and refreshed every APPROX_CALIBRATE_S seconds.
+#   sparse_matrix: for jobs of at least APPROX_SPARSE_MIN_STOPS points only the
+#     origin's row/column and each stop's APPROX_KNN nearest neighbours come from
+#     ORS; the remaining pairs, which no sensible trip uses, are estimates unless the
+#     store or the matrix cache already had them. Matrix-only summaries whose legs use
+#     an estimated pair are flagged estimated.
+#   utils falls back to approx_matrix when the ORS matrix is unavailable (connection
+#     error, timeout, 429, 5xx or an open breaker; APPROX_FALLBACK=0 to turn off). Other
+#     4xx are the request's fault and are returned as errors. Such routes carry engine
+#     "approx" and estimated summaries. When only directions fail, the route keeps the
+#     real matrix: no geometry, not estimated.
+
+APPROX_FALLBACK = os.getenv("APPROX_FALLBACK", "1").lower() not in ("0", "false", "no")
+APPROX_SPARSE_MIN_STOPS = int(os.getenv("APPROX_SPARSE_MIN_STOPS", "300"))   # 0 = always full matrix
+APPROX_KNN = int(os.getenv("APPROX_KNN", "15"))
+APPROX_CALIBRATE_S = float(os.getenv("APPROX_CALIBRATE_S", "600"))
+APPROX_CALIBRATION_SAMPLES = int(os.getenv("APPROX_CALIBRATION_SAMPLES", "5000"))
+APPROX_MIN_SAMPLES = 30
+_MIN_HAVERSINE_M = 200.0   # very short hops are dominated by snapping noise
+
+# profile -> (circuity, speed m/s) until enough samples have been seen
+DEFAULTS = {
+    "driving-car": (1.35, 8.5),
+    "driving-hgv": (1.4, 7.0),
+    "cycling-regular": (1.3, 4.2),
+    "cycling-road": (1.3, 5.5),
+    "foot-walking": (1.25, 1.3),
+}
+
+APPROX_MATRICES = Counter("routest_approx_matrices_total", "Matrices built with estimated pairs, by use.", ("use",))
+
+_factors = {}   # profile -> (circuity, speed, samples, calibrated_at)
+_factors_lock = threading.Lock()
+
+
+# ---------- calibration ----------
+
+def _samples(profile):
+    """(origins, destinations, distances, durations) of real ORS pairs for `profile`."""
+    a, b, dist, dur = [], [], [], []
+    prefix = f"{profile}|"
+    for key, value in matrix_cache.local.items(limit=APPROX_CALIBRATION_SAMPLES * 4):
+        if not key.startswith(prefix):
+            continue
+        _, o, d = key.split("|")
+        a.append([float(x) for x in o.split(",")])
+        b.append([float(x) for x in d.split(",")])
+        dist.append(value[0])
+        dur.append(value[1])
+        if len(a) >= APPROX_CALIBRATION_SAMPLES:
+            break
+
+    store = get_store(profile)
+    if store is not None and store.n > 1:
+        rng = np.random.default_rng(0)
+        i = rng.integers(0, store.n, APPROX_CALIBRATION_SAMPLES)
+        j = rng.integers(0, store.n, APPROX_CALIBRATION_SAMPLES)
+        coords = np.asarray(store.coords)
+        a += coords[i].tolist()
+        b += coords[j].tolist()
+        dist += store.distances[i, j].astype(float).tolist()
+        dur += store.durations[i, j].astype(float).tolist()
+    return (np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2),
+            np.asarray(dist, dtype=float), np.asarray(dur, dtype=float))
+
+
+def calibrate(profile):
+    """(circuity, speed m/s, samples used): medians over real pairs, defaults when too few."""
+    circuity, speed = DEFAULTS.get(profile, DEFAULTS["driving-car"])
+    a, b, dist, dur = _samples(profile)
+    straight = haversine_m(a, b)
+    ok = (straight > _MIN_HAVERSINE_M) & np.isfinite(dist) & np.isfinite(dur) & (dist > 0) & (dur > 0)
+    n = int(ok.sum())
+    if n >= APPROX_MIN_SAMPLES:
+        circuity = float(np.clip(np.median(dist[ok] / straight[ok]), 1.0, 3.0))
+        speed = float(np.clip(np.median(dist[ok] / dur[ok]), 0.5, 40.0))
+    return circuity, speed, n
+
+
+def factors(profile):
+    """Calibrated (circuity, speed) for `profile`, recomputed at most every APPROX_CALIBRATE_S."""
+    now = time.monotonic()
+    with _factors_lock:
+        f = _factors.get(profile)
+        if f is not None and now - f[3] < APPROX_CALIBRATE_S:
+            return f[0], f[1]
+    circuity, speed, n = calibrate(profile)
+    with _factors_lock:
+        _factors[profile] = (circuity, speed, n, now)
+    return circuity, speed
+
+
+# ---------- matrices ----------
+
+def approx_matrix(points_coords, profile_type):
+    """Estimated (distances, durations) n x n arrays for [[lon, lat], ...]."""
+    a = np.asarray(points_coords, dtype=float).reshape(-1, 2)
+    circuity, speed = factors(profile_type)
+    distances = haversine_m(a[:, None, :], a[None, :, :]) * circuity
+    return distances, distances / speed
+
+
+def _spread_bits(x):
+    """16-bit ints -> their bits interleaved with zeros (for Morton codes)."""
+    x = x.astype(np.uint64)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x00FF00FF)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x0F0F0F0F)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x33333333)
+    x = (x | (x << np.uint64(1))) & np.uint64(0x55555555)
+    return x
+
+
+def spatial_order(points_coords):
+    """Morton (Z-order) permutation: nearby points get nearby indexes."""
+    a = np.asarray(points_coords, dtype=float).reshape(-1, 2)
+    lo, span = a.min(axis=0), np.maximum(np.ptp(a, axis=0), 1e-12)
+    q = ((a - lo) / span * 65535).astype(np.uint64)
+    return np.argsort(_spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << np.uint64(1)), kind="stable")
+
+
+def knn_mask(distances, k):
+    """n x n bool: each point's k nearest neighbours (both directions) plus row/column 0."""
+    n = distances.shape[0]
+    mask = np.zeros((n, n), dtype=bool)
+    k = min(k, n - 1)
+    if k > 0:
+        ranked = distances.copy()
+        np.fill_diagonal(ranked, np.inf)
+        nearest = np.argpartition(ranked, k - 1, axis=1)[:, :k]
+        mask[np.arange(n)[:, None], nearest] = True
+        mask |= mask.T
+    mask[0, :] = mask[:, 0] = True   # every trip starts and ends at the origin
+    np.fill_diagonal(mask, False)
+    return mask
+
+
+def sparse_matrix(points_coords, profile_type, fetch):
+    """
+    (distances, durations, info, estimated): fetch(points, profile, needed=mask) for the
+    k-NN pairs only. Whatever else fetch returned (store rows, cached pairs) is kept; the
+    pairs it left at 0 are estimates and are True in the estimated mask. Points are
+    fetched in Morton order so the needed pairs sit near the diagonal and fill few tiles.
+    """
+    est_d, est_t = approx_matrix(points_coords, profile_type)
+    needed = knn_mask(est_d, APPROX_KNN)
+
+    order = spatial_order(points_coords)
+    back = np.argsort(order)
+    d, t = fetch([points_coords[i] for i in order], profile_type, needed=needed[np.ix_(order, order)])
+    d, t = d[np.ix_(back, back)], t[np.ix_(back, back)]
+
+    # unroutable needed pairs stay NaN; unfetched pairs are 0
+    estimated = ~needed & ~(np.isfinite(d) & (d > 0))
+    np.fill_diagonal(estimated, False)
+
+    APPROX_MATRICES.inc(("sparse",))
+    info = {
+        "pairs_fetched": int(needed.sum()),
+        "pairs_estimated": int(estimated.sum()),
+        "pairs_total": int(needed.shape[0] * (needed.shape[0] - 1)),
+    }
+    return np.where(estimated, est_d, d), np.where(estimated, est_t, t), info, estimated
+
+
+def fallback_matrix(points_coords, profile_type):
+    APPROX_MATRICES.inc(("fallback",))
+    return approx_matrix(points_coords, profile_type)
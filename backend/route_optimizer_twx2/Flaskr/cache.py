@@ -0,0 +1,265 @@
+import os, json, time, hashlib, threading
+from collections import OrderedDict
+
+# Shared in-process caches with an optional Redis tier (reuses REDIS_URL).
+# Set CACHE_REDIS=0 to keep everything in-process even when REDIS_URL is set.
+
+_redis_client = None
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Lazily build one shared Redis client from REDIS_URL.
+    Returns None when Redis is not configured or the client cannot be built.
+    """
+    global _redis_client
+    url = os.getenv("REDIS_URL")
+    if not url:
+        return None
+    with _redis_lock:
+        if _redis_client is None:
+            try:
+                import redis
+                # NOTE: TLS is inferred from rediss:// — do not pass ssl= for redis-py 6.x
+                _redis_client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+            except Exception as e:
+                print("redis client init failed:", e)
+                _redis_client = False
+    return _redis_client or None
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after being written."""
+
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def get_many(self, keys):
+        """Return {key: value} for the keys that are present and fresh."""
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is None or item[0] < now:
+                    if item is not None:
+                        del self._data[key]
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(key)
+                self.hits += 1
+                found[key] = item[1]
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def items(self, limit=None):
+        """Up to `limit` fresh (key, value) pairs, most recently used first (no hit/miss counting)."""
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            for key in reversed(self._data):
+                expires, value = self._data[key]
+                if expires >= now:
+                    out.append((key, value))
+                    if limit is not None and len(out) >= limit:
+                        break
+        return out
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class TieredCache:
+    """
+    In-process TTLCache in front of an optional shared Redis tier.
+    Values must be JSON-serialisable; Redis keys are namespaced with `prefix`.
+    """
+
+    def __init__(self, prefix, maxsize=10000, ttl=3600):
+        self.prefix = prefix
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis_hits = 0
+        self.redis_errors = 0
+        self._generation = 0   # fallback for generation() when there is no Redis tier
+        self._generation_lock = threading.Lock()
+
+    def _redis(self):
+        if os.getenv("CACHE_REDIS", "1") == "0":
+            return None
+        return get_redis()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = self.local.get_many(keys)
+        missing = [k for k in keys if k not in found]
+        r = self._redis() if missing else None
+        if r is not None:
+            try:
+                promoted = {}
+                for i in range(0, len(missing), 1000):  # keep each MGET reasonably small
+                    chunk = missing[i:i + 1000]
+                    raw = r.mget([f"{self.prefix}:{k}" for k in chunk])
+                    promoted.update({k: json.loads(v) for k, v in zip(chunk, raw) if v is not None})
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"{self.prefix} cache redis read failed:", e)
+                promoted = {}
+            if promoted:
+                self.redis_hits += len(promoted)
+                self.local.set_many(promoted)
+                found.update(promoted)
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        self.local.set_many(mapping)
+        r = self._redis()
+        if r is None:
+            return
+        try:
+            pipe = r.pipeline(transaction=False)
+            ttl = max(1, int(self.local.ttl))
+            for k, v in mapping.items():
+                pipe.setex(f"{self.prefix}:{k}", ttl, json.dumps(v))
+            pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"{self.prefix} cache redis write failed:", e)
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def generation(self):
+        """
+        Counter to build keys from. bump() makes every key built on the old value
+        unreachable in every worker sharing the Redis tier, instead of clearing caches.
+        """
+        r = self._redis()
+        if r is not None:
+            try:
+                return int(r.get(f"{self.prefix}:generation") or 0)
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"{self.prefix} cache redis generation read failed:", e)
+        return self._generation
+
+    def bump(self):
+        with self._generation_lock:
+            self._generation += 1
+        r = self._redis()
+        if r is not None:
+            try:
+                r.incr(f"{self.prefix}:generation")
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"{self.prefix} cache redis generation bump failed:", e)
+
+    def delete(self, key):
+        self.local.pop(key)
+        r = self._redis()
+        if r is not None:
+            try:
+                r.delete(f"{self.prefix}:{key}")
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"{self.prefix} cache redis delete failed:", e)
+
+    def stats(self):
+        s = self.local.stats()
+        s["redis"] = self._redis() is not None
+        s["redis_hits"] = self.redis_hits
+        s["redis_errors"] = self.redis_errors
+        return s
+
+
+# ---------- distance-matrix pair cache ----------
+
+# ~1.1 m at 5 decimals; coarse enough that re-geocoded addresses still hit
+MATRIX_CACHE_PRECISION = int(os.getenv("MATRIX_CACHE_PRECISION", "5"))
+
+matrix_cache = TieredCache(
+    "ors:matrix",
+    maxsize=int(os.getenv("MATRIX_CACHE_SIZE", "200000")),
+    ttl=float(os.getenv("MATRIX_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+
+def coord_key(lon, lat, precision=None):
+    p = MATRIX_CACHE_PRECISION if precision is None else precision
+    return f"{float(lon):.{p}f},{float(lat):.{p}f}"
+
+
+def pair_key(profile, origin_key, dest_key):
+    return f"{profile}|{origin_key}|{dest_key}"
+
+
+# ---------- directions cache ----------
+
+# content-addressed: sha256(profile + ordered rounded coordinates) -> ORS feature
+directions_cache = TieredCache(
+    "ors:directions",
+    maxsize=int(os.getenv("DIRECTIONS_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("DIRECTIONS_CACHE_TTL", str(24 * 3600))),
+)
+
+
+def directions_key(profile, coords):
+    raw = profile + ";" + ";".join(coord_key(lon, lat) for lon, lat in coords)
+    return hashlib.sha256(raw.encode()).hexdigest()
@@ -0,0 +1,124 @@
+import os, json, time, uuid, hashlib, threading
+
+from .cache import get_redis
+from .metrics import Counter
+
+# Singleflight for identical optimize requests.
+# Requests with the same canonical body (profile, source, destinations + payloads,
+# capacity, max distance and every option) that arrive while one is being computed
+# wait for it and get the same (body, status) instead of re-running ORS and the
+# solver and persisting a duplicate row. The shared body must be treated as read-only.
+# COALESCE_REDIS=1 (with REDIS_URL) extends this across workers: the first worker
+# takes a SET NX PX lock, the others poll for its result. Only a worker that found the
+# lock taken reads a result, and the result only lives for COALESCE_RESULT_TTL_MS
+# (a few poll intervals), so a re-submit after the leader finished is computed
+# afresh instead of being served a stale plan. COALESCE_ENABLED=0 turns it all off.
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1").lower() not in ("0", "false", "no")
+COALESCE_REDIS = os.getenv("COALESCE_REDIS", "0").lower() in ("1", "true", "yes")
+COALESCE_WAIT_S = float(os.getenv("COALESCE_WAIT_S", "120"))
+COALESCE_LOCK_MS = int(os.getenv("COALESCE_LOCK_MS", "60000"))
+COALESCE_POLL_MS = int(os.getenv("COALESCE_POLL_MS", "50"))
+# long enough for every waiting follower's next poll, too short to act as a cache
+COALESCE_RESULT_TTL_MS = int(os.getenv("COALESCE_RESULT_TTL_MS", str(4 * COALESCE_POLL_MS)))
+
+COALESCED = Counter("routest_coalesced_requests_total", "Optimize requests by singleflight role.", ("role",))
+
+# release the lock only if we still own it
+_UNLOCK = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+def request_key(scope, payload):
+    """Stable hash of an endpoint + its JSON body (key order and whitespace don't matter)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{scope}\n{canonical}".encode()).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        Run fn() once per key at a time. Returns (value, shared) where shared is True
+        when the value came from another caller's computation.
+        """
+        if not COALESCE_ENABLED:
+            return fn(), False
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            COALESCED.inc(("follower",))
+            if not call.done.wait(COALESCE_WAIT_S):
+                return fn(), False   # leader is stuck; don't hold this request hostage
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        COALESCED.inc(("leader",))
+        try:
+            call.value, shared = self._cross_worker(key, fn)
+            return call.value, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _cross_worker(self, key, fn):
+        r = get_redis() if COALESCE_REDIS else None
+        if r is None:
+            return fn(), False
+
+        lock_key, result_key, token = f"coalesce:lock:{key}", f"coalesce:result:{key}", uuid.uuid4().hex
+        deadline = time.monotonic() + COALESCE_WAIT_S
+        waiting = False
+        try:
+            while True:
+                # a result left by an earlier, finished leader is not ours to reuse
+                if waiting:
+                    raw = r.get(result_key)
+                    if raw:
+                        COALESCED.inc(("redis_follower",))
+                        return tuple(json.loads(raw)), True
+                if r.set(lock_key, token, nx=True, px=COALESCE_LOCK_MS):
+                    break
+                waiting = True   # another worker is computing it right now
+                if time.monotonic() > deadline:
+                    return fn(), False
+                time.sleep(COALESCE_POLL_MS / 1000.0)
+        except Exception as e:
+            print("coalesce redis error:", e)
+            return fn(), False
+
+        try:
+            value = fn()
+            try:
+                r.set(result_key, json.dumps(value, default=str), px=COALESCE_RESULT_TTL_MS)
+            except Exception as e:
+                print("coalesce redis store failed:", e)
+            return value, False
+        finally:
+            try:
+                r.eval(_UNLOCK, 1, lock_key, token)
+            except Exception as e:
+                print("coalesce redis unlock failed:", e)
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,358 @@
+import os, threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from .solver import solve
+from .utils import _multi_stop, _annotate_common_props, profile_for
+from .geometry import haversine_m
+from .metrics import stage, observe_route
+
+# Multi-vehicle ("fleet") optimization: the request carries vehicles: [...] instead
+# of a single driver_details. Each vehicle:
+#   {vehicle_id, driver_name, vehicle_type (or profile), vehicle_capacity,
+#    maximum_distance, start_point: {lat, lon} (defaults to source_point), driver_age}
+# Stops are partitioned with a capacity-aware k-means (one cluster per vehicle), then
+# every cluster is routed like a single-driver request, all vehicles at once: matrix
+# and directions calls on threads (FLEET_THREADS), the solver on a process pool
+# (FLEET_PROCESSES workers, spawn start method) once some cluster has at least
+# FLEET_PROCESS_MIN_STOPS stops; smaller plans are solved inline.
+# A vehicle only makes extra trips when the whole fleet lacks capacity for its area.
+# Stops are only offered to vehicles that can carry them and whose maximum_distance
+# covers at least the great-circle out-and-back; a stop the road matrix then still
+# puts out of reach is moved to the next vehicle that can take it, and stops no vehicle
+# can serve come back in properties.fleet.unassigned instead of failing the request.
+
+FLEET_MAX_VEHICLES = int(os.getenv("FLEET_MAX_VEHICLES", "200"))
+FLEET_THREADS = int(os.getenv("FLEET_THREADS", "8"))
+FLEET_PROCESSES = int(os.getenv("FLEET_PROCESSES", "0")) or (os.cpu_count() or 1)
+FLEET_PROCESS_MIN_STOPS = int(os.getenv("FLEET_PROCESS_MIN_STOPS", "40"))
+FLEET_KMEANS_ITERS = int(os.getenv("FLEET_KMEANS_ITERS", "20"))
+FLEET_MP_START = os.getenv("FLEET_MP_START", "spawn")   # fork is unsafe with our background threads
+
+
+# ---------- clustering ----------
+
+def _plane(points, lat0):
+    """[[lon, lat], ...] -> local equirectangular x/y in degrees of latitude (good enough to cluster)."""
+    a = np.asarray(points, dtype=float).reshape(-1, 2)
+    return np.column_stack((a[:, 0] * np.cos(np.radians(lat0)), a[:, 1]))
+
+
+def _kmeanspp(X, k, rng):
+    C = np.empty((k, 2))
+    C[0] = X[rng.integers(len(X))]
+    d2 = ((X - C[0]) ** 2).sum(axis=1)
+    for j in range(1, k):
+        total = d2.sum()
+        i = rng.choice(len(X), p=d2 / total) if total > 0 else rng.integers(len(X))
+        C[j] = X[i]
+        d2 = np.minimum(d2, ((X - C[j]) ** 2).sum(axis=1))
+    return C
+
+
+def _assign(X, q, C, cap, allowed):
+    n, k = len(X), len(C)
+    D = np.sqrt(((X[:, None, :] - C[None, :, :]) ** 2).sum(axis=-1))   # n x k
+    D = np.where(allowed, D, np.inf)
+    prefs = np.argsort(D, axis=1)
+    rows = np.arange(n)
+    with np.errstate(invalid="ignore"):   # inf - inf: a stop no vehicle may take
+        regret = D[rows, prefs[:, 1]] - D[rows, prefs[:, 0]] if k > 1 else np.zeros(n)
+    regret = np.nan_to_num(regret, nan=0.0, posinf=np.inf)   # one candidate: it chooses first
+
+    room = cap.astype(float).copy()
+    labels = np.full(n, -1, dtype=int)
+    # stops that lose the most by not getting their nearest cluster choose first
+    for i in np.argsort(-regret, kind="stable"):
+        choices = [j for j in prefs[i] if allowed[i, j]]
+        if not choices:
+            continue   # no vehicle can serve it
+        for j in choices:
+            if q[i] <= room[j] + 1e-9:
+                break
+        else:
+            j = choices[0]   # nobody has room: nearest vehicle takes it as an extra trip
+        labels[i] = j
+        room[j] -= q[i]
+    return labels
+
+
+def partition(stops, demands, capacities, depots=None, iterations=FLEET_KMEANS_ITERS, seed=0, allowed=None):
+    """
+    Capacity-aware k-means. stops is [[lon, lat], ...]; cluster j belongs to vehicle j.
+    Centroids start at the vehicles' depots when those are all distinct, else k-means++.
+    allowed (n x k bool) restricts which vehicles may take which stops.
+    Returns (labels, overflow): a cluster index per stop (-1 when no vehicle is
+    allowed to take it) and the vehicles whose cluster still exceeds their capacity
+    (they will need more than one trip).
+    """
+    X0 = np.asarray(stops, dtype=float).reshape(-1, 2)
+    q = np.asarray(demands, dtype=float)
+    cap = np.asarray(capacities, dtype=float)
+    n, k = len(X0), len(cap)
+    if n == 0:
+        return np.zeros(0, dtype=int), []
+    allowed = np.ones((n, k), dtype=bool) if allowed is None else np.asarray(allowed, dtype=bool)
+
+    lat0 = float(X0[:, 1].mean())
+    X = _plane(X0, lat0)
+    if depots is not None and len({tuple(d) for d in depots}) == k > 1:
+        C = _plane(depots, lat0)
+    else:
+        C = _kmeanspp(X, k, np.random.default_rng(seed))
+
+    labels = None
+    for _ in range(max(1, iterations)):
+        new = _assign(X, q, C, cap, allowed)
+        if labels is not None and np.array_equal(new, labels):
+            break
+        labels = new
+        for j in range(k):
+            members = X[labels == j]
+            if len(members):
+                C[j] = members.mean(axis=0)
+
+    return labels, _overflow(labels, q, cap)
+
+
+def _overflow(labels, q, cap):
+    served = labels >= 0
+    load = np.bincount(labels[served], weights=q[served], minlength=len(cap))
+    return [int(j) for j in np.flatnonzero(load > cap + 1e-9)]
+
+
+def _reachable(stops, demands, fleet):
+    """n x k bool: vehicle j can carry stop i and its great-circle out-and-back fits maximum_distance."""
+    X = np.asarray(stops, dtype=float).reshape(-1, 2)
+    starts = np.array([[v["start"]["lon"], v["start"]["lat"]] for v in fleet], dtype=float)
+    crow = haversine_m(X[:, None, :], starts[None, :, :])   # roads are never shorter
+    q = np.asarray(demands, dtype=float)[:, None]
+    cap = np.array([v["capacity"] for v in fleet])[None, :]
+    max_dist = np.array([v["max_distance"] for v in fleet])[None, :]
+    return (q <= cap) & (2 * crow <= max_dist)
+
+
+# ---------- solver process pool ----------
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=FLEET_PROCESSES,
+                                                mp_context=mp.get_context(FLEET_MP_START))
+        return _process_pool
+
+
+def _solve_in_process(*args, **kwargs):
+    """solve() on the worker pool; same signature and exceptions (ValueError) as solve."""
+    global _process_pool
+    try:
+        return _get_process_pool().submit(solve, *args, **kwargs).result()
+    except BrokenProcessPool as e:
+        print("fleet process pool broken, solving inline:", e)
+        with _process_pool_lock:
+            _process_pool = None
+        return solve(*args, **kwargs)
+
+
+# ---------- optimize ----------
+
+def optimize_fleet(input_data: dict):
+    """
+    Pure function like utils.optimize_route. Returns a GeoJSON FeatureCollection with
+    one Feature per vehicle (same properties as a single-driver route, plus vehicle_id
+    and destination_indexes into the request's destination_points) and fleet totals
+    in properties.fleet, or {"error": "..."}.
+    """
+    vehicles = input_data.get("vehicles")
+    if not isinstance(vehicles, list) or not vehicles:
+        return {"error": "vehicles must be a non-empty list."}
+    if len(vehicles) > FLEET_MAX_VEHICLES:
+        return {"error": f"at most {FLEET_MAX_VEHICLES} vehicles per request."}
+    destinations = input_data.get("destination_points")
+    if not destinations:
+        return {"error": "no destination points specified."}
+
+    source = input_data.get("source_point")
+    fleet = []
+    for i, v in enumerate(vehicles):
+        if not isinstance(v, dict):
+            return {"error": f"vehicles[{i}] must be an object."}
+        start = v.get("start_point") or source
+        if not start:
+            return {"error": f"vehicles[{i}] has no start_point and no source_point was given."}
+        try:
+            capacity = float(v.get("vehicle_capacity", 9e12))
+            max_distance = float(v.get("maximum_distance", 9e12))
+        except (TypeError, ValueError):
+            return {"error": f"vehicles[{i}]: vehicle_capacity and maximum_distance must be numbers."}
+        vehicle_type = (v.get("vehicle_type") or "car").lower().strip()
+        fleet.append({
+            "id": v.get("vehicle_id") or v.get("driver_name") or f"vehicle-{i + 1}",
+            "start": start,
+            "capacity": capacity,
+            "max_distance": max_distance,
+            "vehicle_type": vehicle_type,
+            "profile": v.get("profile") or profile_for(vehicle_type),
+            "driver_details": v,
+        })
+
+    try:
+        time_budget_ms = float(input_data["time_budget_ms"]) if input_data.get("time_budget_ms") is not None else None
+        demands = [float(p.get("payload", 0)) for p in destinations]
+    except (TypeError, ValueError):
+        return {"error": "time_budget_ms and payloads must be numbers."}
+    matrix_only = input_data.get("geometry") is False or input_data.get("mode") == "matrix"
+
+    points = [[p["lon"], p["lat"]] for p in destinations]
+    with stage("cluster"):
+        allowed = _reachable(points, demands, fleet)
+        labels, _ = partition(
+            points, demands, [v["capacity"] for v in fleet],
+            depots=[[v["start"]["lon"], v["start"]["lat"]] for v in fleet], allowed=allowed,
+        )
+    members = [np.flatnonzero(labels == j).tolist() for j in range(len(fleet))]
+    unassigned = np.flatnonzero(labels < 0).tolist()
+    busy = [m for m in members if m]
+    parallel_solve = FLEET_PROCESSES > 1 and len(busy) > 1 and max(map(len, busy)) >= FLEET_PROCESS_MIN_STOPS
+    solve_fn = _solve_in_process if parallel_solve else solve
+
+    def route(j):
+        v, idx = fleet[j], members[j]
+        if not idx:
+            return _idle_feature(v["start"])
+        return _multi_stop(
+            v["start"], [destinations[i] for i in idx], v["profile"], v["driver_details"],
+            solver=input_data.get("solver"), time_budget_ms=time_budget_ms,
+            matrix_only=matrix_only, solve_fn=solve_fn,
+        )
+
+    def move(i, j):
+        """Stop i is out of vehicle j's reach by road: next vehicle that can take it, or unassigned."""
+        allowed[i, j] = False
+        members[j].remove(i)
+        choices = np.flatnonzero(allowed[i]).tolist()
+        if not choices:
+            unassigned.append(i)
+            return None
+        # nearest start among the vehicles with room left, else the nearest (an extra trip)
+        starts = np.array([[fleet[c]["start"]["lon"], fleet[c]["start"]["lat"]] for c in choices])
+        dist = haversine_m(np.asarray(points[i], dtype=float), starts)
+        full = [sum(demands[s] for s in members[c]) + demands[i] > fleet[c]["capacity"] + 1e-9 for c in choices]
+        to = choices[min(range(len(choices)), key=lambda o: (full[o], dist[o]))]
+        members[to] = sorted(members[to] + [i])
+        return to
+
+    features = [None] * len(fleet)
+    todo = list(range(len(fleet)))
+    with ThreadPoolExecutor(max_workers=max(1, min(FLEET_THREADS, len(fleet))),
+                            thread_name_prefix="fleet") as pool:
+        while todo:   # every pass forbids at least one (stop, vehicle) pair, so this ends
+            routed = list(pool.map(route, todo))
+            # unservable indexes point into the members each vehicle was routed with
+            moves = [(members[j][o], j) for j, f in zip(todo, routed) for o in f.get("unservable") or []]
+            for j, feature in zip(todo, routed):
+                features[j] = feature
+            again = {j for _, j in moves} | {move(i, j) for i, j in moves}
+            todo = sorted(j for j in again if j is not None)
+    unassigned.sort()
+    loads = [sum(demands[i] for i in m) for m in members]
+    overflow = [j for j, v in enumerate(fleet) if loads[j] > v["capacity"] + 1e-9]
+
+    for j, (v, idx, feature) in enumerate(zip(fleet, members, features)):
+        if "error" in feature:
+            return {"error": f"vehicle {v['id']}: {feature['error']}"}
+        p = feature["properties"]
+        _annotate_common_props(feature, v["driver_details"], v["vehicle_type"], engine=p.get("engine") or "backend:ors")
+        p.update({
+            "vehicle_id": v["id"],
+            "vehicle_index": j,
+            "destination_indexes": idx,
+            "optimized_order_global": [idx[o] for o in p.get("optimized_order") or []],
+            "over_capacity": j in overflow,
+        })
+        if idx:
+            observe_route(feature)
+
+    summaries = [f["properties"]["summary"] for f in features]
+    boxes = [f["bbox"] for f in features if f.get("bbox")]
+    return {
+        "type": "FeatureCollection",
+        "bbox": [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                 max(b[2] for b in boxes), max(b[3] for b in boxes)] if boxes else None,
+        "features": features,
+        "properties": {
+            "engine": "approx" if any(f["properties"]["engine"] == "approx" for f in features) else "backend:ors",
+            "fleet": {
+                "vehicles": len(fleet),
+                "vehicles_used": sum(1 for m in members if m),
+                "stops": len(destinations),
+                "distance": sum(float(s["distance"]) for s in summaries),
+                "duration": sum(float(s["duration"]) for s in summaries),
+                "makespan": max(float(s["duration"]) for s in summaries),   # longest vehicle day
+                "trips": sum(int(s["trips"]) for s in summaries),
+                "over_capacity": [fleet[j]["id"] for j in overflow],
+                "unassigned": unassigned,   # destination indexes no vehicle can serve
+                "parallel_solve": parallel_solve,
+            },
+        },
+    }
+
+
+def _idle_feature(start):
+    return {
+        "bbox": None,
+        "type": "Feature",
+        "geometry": None,
+        "properties": {
+            "segments": [],
+            "trips": [],
+            "summary": {"distance": 0.0, "duration": 0.0, "trips": 0},
+            "source": start,
+            "destinations": [],
+            "optimized_order": [],
+            "idle": True,
+        },
+    }
+
+
+# ---------- response helpers ----------
+
+def route_features(result: dict):
+    """The route Features of a single-driver Feature or a fleet FeatureCollection."""
+    if result.get("type") == "FeatureCollection":
+        return result.get("features") or []
+    return [result]
+
+
+def vehicle_payloads(payload: dict, result: dict):
+    """
+    (per-vehicle request, Feature) pairs, so ML ETA and persistence treat each vehicle
+    of a fleet plan like a single-driver route. Single-driver results pass through.
+    """
+    if result.get("type") != "FeatureCollection":
+        return [(payload, result)]
+    vehicles = payload.get("vehicles") or []
+    ids = (payload.get("meta") or {}).get("destination_ids") or []
+    pairs = []
+    for feature in result.get("features") or []:
+        p = feature["properties"]
+        if p.get("idle"):
+            continue
+        idx = p.get("destination_indexes") or []
+        sub = {k: v for k, v in payload.items() if k != "vehicles"}
+        sub.update({
+            "source_point": p.get("source"),
+            "destination_points": p.get("destinations") or [],
+            "driver_details": vehicles[p["vehicle_index"]],
+            "meta": {**(payload.get("meta") or {}), "destination_ids": [ids[i] for i in idx if i < len(ids)]},
+        })
+        pairs.append((sub, feature))
+    return pairs
@@ -0,0 +1,210 @@
+import math
+import numpy as np
+
+# Compact route geometry helpers: Google encoded polylines and Douglas-Peucker
+# simplification. Coordinates are [lon, lat] like everywhere else in this service;
+# the polyline format itself stores lat/lon pairs (Google's convention).
+
+POLYLINE_FORMATS = {"polyline": 5, "polyline5": 5, "polyline6": 6}
+_M_PER_DEG = 111_320.0
+_EARTH_RADIUS_M = 6_371_008.8
+
+
+# ---------- array helpers ----------
+# Route geometry travels through the optimizer as one contiguous (n, 2) float array;
+# it only becomes nested lists (or a polyline string) at the response boundary.
+
+def as_coords(coords):
+    """[[lon, lat], ...] or an array -> (n, 2) float64 array (no copy if already one)."""
+    return np.asarray(coords, dtype=float).reshape(-1, 2)
+
+
+def concat_coords(parts):
+    """Join several coordinate runs into one (n, 2) array with a single allocation."""
+    parts = [as_coords(p) for p in parts]
+    return np.concatenate(parts) if parts else np.empty((0, 2))
+
+
+def bbox_of(coords):
+    """[min_lon, min_lat, max_lon, max_lat] or None for an empty geometry."""
+    pts = as_coords(coords)
+    if not len(pts):
+        return None
+    return np.concatenate((pts.min(axis=0), pts.max(axis=0))).tolist()
+
+
+def haversine_m(a, b):
+    """Great-circle metres between broadcastable [..., 2] (lon, lat) arrays."""
+    a = np.radians(np.asarray(a, dtype=float))
+    b = np.radians(np.asarray(b, dtype=float))
+    dlon = b[..., 0] - a[..., 0]
+    dlat = b[..., 1] - a[..., 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[..., 1]) * np.cos(b[..., 1]) * np.sin(dlon / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def path_length_m(coords):
+    """Length of a polyline in metres (sum of great-circle hops)."""
+    pts = as_coords(coords)
+    if len(pts) < 2:
+        return 0.0
+    return float(haversine_m(pts[:-1], pts[1:]).sum())
+
+
+def geojson_geometry(geometry):
+    """Copy of a LineString whose coordinates are plain lists (JSON-safe)."""
+    if not geometry or not isinstance(geometry.get("coordinates"), np.ndarray):
+        return geometry
+    return {**geometry, "coordinates": geometry["coordinates"].tolist()}
+
+
+def encode_polyline(coords, precision=5):
+    """[[lon, lat], ...] -> encoded polyline string (lat/lon order, integer deltas)."""
+    pts = as_coords(coords)
+    if not len(pts):
+        return ""
+    q = np.round(pts[:, ::-1] * (10 ** precision)).astype(np.int64)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    out = []
+    for v in deltas.tolist():
+        v = ~(v << 1) if v < 0 else (v << 1)
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+
+def decode_polyline(encoded, precision=5):
+    """Encoded polyline -> [[lon, lat], ...]."""
+    values, shift, result = [], 0, 0
+    for ch in encoded:
+        b = ord(ch) - 63
+        result |= (b & 0x1F) << shift
+        shift += 5
+        if b < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            shift, result = 0, 0
+    latlon = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / (10 ** precision)
+    return latlon[:, ::-1].tolist()
+
+
+def zoom_tolerance_m(zoom, lat=0.0, pixels=1.0):
+    """Ground size of `pixels` screen pixels at a web-mercator zoom level."""
+    return pixels * 156_543.03392 * math.cos(math.radians(lat)) / (2 ** float(zoom))
+
+
+def simplify(coords, tolerance_m):
+    """
+    Douglas-Peucker on [[lon, lat], ...] with a tolerance in metres (local
+    equirectangular projection, fine at city scale). Endpoints are always kept.
+    Returns an (m, 2) array.
+    """
+    pts = as_coords(coords)
+    n = len(pts)
+    if n < 3 or tolerance_m <= 0:
+        return pts
+
+    xy = pts * _M_PER_DEG
+    xy[:, 0] *= math.cos(math.radians(float(pts[:, 1].mean())))
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        seg = xy[b] - xy[a]
+        rel = xy[a + 1:b] - xy[a]
+        seg_len = math.hypot(*seg)
+        if seg_len == 0.0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / seg_len
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance_m:
+            mid = a + 1 + k
+            keep[mid] = True
+            stack.append((a, mid))
+            stack.append((mid, b))
+    return pts[keep]
+
+
+def geometry_options(options: dict, bbox=None):
+    """
+    Parse the caller's geometry options -> (format, tolerance_m or None, error or None).
+      geometry_format: "geojson" | "polyline" (1e-5) | "polyline6" (1e-6)
+      simplify_tolerance: metres, or simplify_zoom: web-mercator zoom level
+    """
+    fmt = (options.get("geometry_format") or "geojson").lower()
+    if fmt != "geojson" and fmt not in POLYLINE_FORMATS:
+        return fmt, None, f"unknown geometry_format '{fmt}'"
+
+    tolerance = options.get("simplify_tolerance")
+    zoom = options.get("simplify_zoom")
+    try:
+        if tolerance is None and zoom is not None:
+            bbox = bbox or [0, 0, 0, 0]
+            tolerance = zoom_tolerance_m(float(zoom), lat=(bbox[1] + bbox[3]) / 2.0)
+        tolerance = float(tolerance) if tolerance is not None else None
+    except (TypeError, ValueError):
+        return fmt, None, "simplify_tolerance/simplify_zoom must be numbers"
+    return fmt, tolerance, None
+
+
+def shape_geometry(feature: dict, options: dict):
+    """
+    Apply the caller's geometry options (see geometry_options) to a route Feature,
+    in place, at the response boundary. Full-resolution GeoJSON stays the default.
+    Returns an error string for bad options, else None.
+    """
+    fmt, tolerance, err = geometry_options(options, feature.get("bbox"))
+    if err:
+        return err
+
+    geom = feature.get("geometry") or {}
+    coords = geom.get("coordinates")
+    if not isinstance(coords, (list, np.ndarray)) or len(coords) == 0:
+        return None
+
+    if fmt == "geojson" and not tolerance and isinstance(coords, list):
+        return None   # default: untouched full-resolution GeoJSON
+
+    props = feature.setdefault("properties", {})
+    if tolerance:
+        before = len(coords)
+        coords = simplify(coords, tolerance)
+        props["geometry_simplification"] = {
+            "tolerance_m": tolerance, "vertices_in": before, "vertices_out": len(coords),
+        }
+
+    if fmt == "geojson":
+        feature["geometry"] = {"type": "LineString", "coordinates": np.asarray(coords).tolist()}
+    else:
+        feature["geometry"] = {
+            "type": "LineString",
+            "encoding": fmt,
+            "coordinates": encode_polyline(coords, POLYLINE_FORMATS[fmt]),
+        }
+    return None
+
+
+def encode_geometry_for_storage(geometry, fmt="geojson"):
+    """Full-resolution LineString -> stored form: GeoJSON, or encoded when fmt is a polyline format."""
+    if not geometry or fmt not in POLYLINE_FORMATS or isinstance(geometry.get("coordinates"), str):
+        return geojson_geometry(geometry)
+    return {
+        "type": geometry.get("type", "LineString"),
+        "encoding": fmt,
+        "coordinates": encode_polyline(geometry["coordinates"], POLYLINE_FORMATS[fmt]),
+    }
+
+
+def decode_geometry(geometry):
+    """Inverse of encode_geometry_for_storage; plain GeoJSON passes through."""
+    if not geometry or not isinstance(geometry.get("coordinates"), str):
+        return geometry
+    precision = POLYLINE_FORMATS.get(geometry.get("encoding"), 5)
+    return {"type": geometry.get("type", "LineString"),
+            "coordinates": decode_polyline(geometry["coordinates"], precision)}
@@ -0,0 +1,142 @@
+import os, time, threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import get_redis
+from .ors import ORS_API_KEY, ORS_BASE
+from .upstream import upstream
+
+# Dependency health for GET /api/health.
+# A background thread probes Redis, ORS and Supabase every HEALTH_PROBE_INTERVAL
+# seconds, all three in parallel, and /health serves the last result instantly
+# (with checked_at / age_s so callers can see how old it is). ?fresh=1 forces a
+# synchronous parallel probe, at most once per HEALTH_FRESH_MIN_INTERVAL seconds.
+# Probes share the pooled upstream clients but bypass their circuit breakers, so a
+# failing probe cannot open the breaker for real traffic and an open breaker cannot
+# hide a recovery from the probe.
+
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "30"))
+HEALTH_FRESH_MIN_INTERVAL = float(os.getenv("HEALTH_FRESH_MIN_INTERVAL", "2"))
+
+
+# ---------- checks ----------
+
+def _ms(t0):
+    return int((time.time() - t0) * 1000)
+
+
+def check_redis():
+    if not os.getenv("REDIS_URL"):
+        return {"status": "skipped", "latency_ms": 0, "reason": "REDIS_URL not set"}
+    t0 = time.time()
+    try:
+        r = get_redis()   # shared client; no new connection pool per probe
+        if r is None:
+            raise RuntimeError("redis client unavailable")
+        r.ping()
+        return {"status": "ok", "latency_ms": _ms(t0)}
+    except Exception as e:
+        return {"status": "error", "latency_ms": _ms(t0), "error": str(e)[:200]}
+
+
+def check_routing_engine():
+    """Treat any HTTP response from ORS as reachable; only network errors are 'error'."""
+    t0 = time.time()
+    try:
+        head = upstream("ors").head(ORS_BASE, timeout=2, retry=False, breaker=False)
+        code = head.status_code
+        status = "ok" if 200 <= code < 400 else "degraded"
+        if ORS_API_KEY:
+            # with a key, also confirm the authenticated path is reachable
+            try:
+                r = upstream("ors").get(f"{ORS_BASE}/health", headers={"Authorization": ORS_API_KEY},
+                                        timeout=2, retry=False, breaker=False)
+                # 2xx => ok; 401/403/404 => degraded but reachable
+                status = "ok" if 200 <= r.status_code < 300 else "degraded"
+                code = r.status_code
+            except Exception:
+                pass   # keep prior reachability result
+        return {"status": status, "latency_ms": _ms(t0), "engine": "ors", "code": code}
+    except Exception as e:
+        return {"status": "error", "latency_ms": _ms(t0), "engine": "ors", "error": str(e)[:200]}
+
+
+def check_supabase_rest(rest, headers):
+    if not (rest and headers.get("apikey")):
+        return {"status": "skipped", "latency_ms": 0, "reason": "SUPABASE not configured"}
+    t0 = time.time()
+    try:
+        r = upstream("supabase").get(f"{rest}/route_requests", headers=headers,
+                                     params={"select": "id", "limit": "1"}, timeout=3, retry=False,
+                                     breaker=False)
+        return {"status": "ok" if 200 <= r.status_code < 300 else "degraded",
+                "latency_ms": _ms(t0), "code": r.status_code}
+    except Exception as e:
+        return {"status": "error", "latency_ms": _ms(t0), "error": str(e)[:200]}
+
+
+# ---------- prober ----------
+
+class HealthProber:
+    def __init__(self, checks, interval=HEALTH_PROBE_INTERVAL):
+        self.checks = checks            # name -> zero-arg callable returning a result dict
+        self.interval = interval
+        self._pool = ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix="health")
+        self._lock = threading.Lock()   # one probe at a time
+        self._start_lock = threading.Lock()
+        self._snapshot = (None, None)   # (results, checked_at), replaced as one value
+        self._thread = None
+
+    def probe(self):
+        """Run every check in parallel now and store the results."""
+        with self._lock:
+            futures = {name: self._pool.submit(fn) for name, fn in self.checks.items()}
+            results = {}
+            for name, f in futures.items():
+                try:
+                    results[name] = f.result()
+                except Exception as e:
+                    results[name] = {"status": "error", "latency_ms": 0, "error": str(e)[:200]}
+                results[name]["checked_at"] = dt.datetime.now(dt.timezone.utc).isoformat()
+            self._snapshot = (results, time.time())
+            return results
+
+    def results(self, fresh=False):
+        """(results, checked_at epoch) from the cache; probes synchronously on first use or fresh=True."""
+        self.start()
+        results, checked_at = self._snapshot
+        too_soon = checked_at is not None and time.time() - checked_at < HEALTH_FRESH_MIN_INTERVAL
+        if results is None or (fresh and not too_soon):
+            self.probe()
+            results, checked_at = self._snapshot
+        return results, checked_at
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="health-prober", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe()
+            except Exception as e:
+                print("health probe failed:", e)
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def get_prober(rest, headers):
+    global _prober
+    with _prober_lock:
+        if _prober is None:
+            _prober = HealthProber({
+                "engine": check_routing_engine,
+                "redis": check_redis,
+                "supabase": lambda: check_supabase_rest(rest, headers),
+            })
+    return _prober
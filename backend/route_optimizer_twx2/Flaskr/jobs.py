@@ -0,0 +1,179 @@
+import os, json, time, uuid, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_sse import sse
+
+from .cache import TTLCache, get_redis
+
+# Asynchronous optimization jobs.
+# POST /api/jobs enqueues, a bounded worker pool runs the optimizer, GET /api/jobs/<id>
+# returns the record; state changes are also pushed on SSE channel "job:<id>".
+# JOB_QUEUE_BACKEND=memory (default) keeps everything in this process;
+# JOB_QUEUE_BACKEND=redis shares the queue/records between workers via REDIS_URL.
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))  # seconds a finished job stays readable
+
+
+class QueueFull(Exception):
+    pass
+
+
+def _now():
+    return time.time()
+
+
+class JobQueue:
+    """
+    Interface: submit(payload) -> job id, get(job id) -> record dict or None.
+    `runner(payload) -> (result_dict, http_status)` is executed inside the app context.
+    """
+
+    def __init__(self, app, runner):
+        self.app = app
+        self.runner = runner
+
+    def submit(self, payload):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        raise NotImplementedError
+
+    def _save(self, job):
+        raise NotImplementedError
+
+    def _run(self, job):
+        with self.app.app_context():
+            job.update(status="running", started_at=_now())
+            self._save(job)
+            self._publish(job)
+            try:
+                result, status = self.runner(job["payload"])
+                job.update(
+                    status="completed" if status < 400 else "failed",
+                    http_status=status,
+                    result=result,
+                    error=result.get("error") if isinstance(result, dict) else None,
+                )
+            except Exception as e:
+                print("job failed:", job["id"], e)
+                job.update(status="failed", http_status=500, error=str(e)[:500])
+            job["finished_at"] = _now()
+            self._save(job)
+            self._publish(job)
+
+    def _publish(self, job):
+        # progress only; the (possibly large) result is fetched via GET /api/jobs/<id>
+        if not (self.app.config.get("SSE_REDIS_URL") or self.app.config.get("REDIS_URL")):
+            return
+        try:
+            sse.publish(public_view(job, include_result=False), type="job", channel=f"job:{job['id']}")
+        except Exception as e:
+            print("job sse publish failed:", e)
+
+    def _new_job(self, payload):
+        return {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "http_status": None,
+            "error": None,
+            "result": None,
+            "payload": payload,
+        }
+
+
+class InProcessJobQueue(JobQueue):
+    """Thread pool + in-memory records (expire JOB_TTL after the last write)."""
+
+    def __init__(self, app, runner, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        super().__init__(app, runner)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="opt-job")
+        self._jobs = TTLCache(maxsize=10000, ttl=JOB_TTL)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, payload):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull("too many pending jobs")
+        job = self._new_job(payload)
+        self._save(job)
+        self._publish(job)
+        future = self._pool.submit(self._run, job)
+        future.add_done_callback(lambda _: self._slots.release())
+        return job["id"]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _save(self, job):
+        self._jobs.set(job["id"], job)
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Records in Redis (`jobs:<id>`, JSON, TTL), ids on list `jobs:pending`.
+    Every process that creates the queue runs `workers` consumer threads.
+    """
+
+    PENDING = "jobs:pending"
+
+    def __init__(self, app, runner, redis_client, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        super().__init__(app, runner)
+        self.r = redis_client
+        self.max_pending = max_pending
+        for i in range(workers):
+            threading.Thread(target=self._consume, name=f"opt-job-{i}", daemon=True).start()
+
+    def submit(self, payload):
+        if self.r.llen(self.PENDING) >= self.max_pending:
+            raise QueueFull("too many pending jobs")
+        job = self._new_job(payload)
+        self._save(job)
+        self.r.rpush(self.PENDING, job["id"])
+        self._publish(job)
+        return job["id"]
+
+    def get(self, job_id):
+        raw = self.r.get(f"jobs:{job_id}")
+        return json.loads(raw) if raw else None
+
+    def _save(self, job):
+        self.r.setex(f"jobs:{job['id']}", JOB_TTL, json.dumps(job))
+
+    def _consume(self):
+        while True:
+            try:
+                item = self.r.blpop(self.PENDING, timeout=1)  # stay under the client socket_timeout
+                if not item:
+                    continue
+                job = self.get(item[1].decode() if isinstance(item[1], bytes) else item[1])
+                if job and job["status"] == "queued":
+                    self._run(job)
+            except Exception as e:
+                print("job consumer error:", e)
+                time.sleep(1)
+
+
+def public_view(job, include_result=True):
+    out = {k: v for k, v in job.items() if k != "payload"}
+    if not include_result:
+        out.pop("result", None)
+    return out
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue(app, runner):
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if os.getenv("JOB_QUEUE_BACKEND", "memory") == "redis" and get_redis() is not None:
+                _queue = RedisJobQueue(app, runner, get_redis())
+            else:
+                _queue = InProcessJobQueue(app, runner)
+    return _queue
@@ -0,0 +1,264 @@
+import os, sys, json, time, struct, argparse, threading
+import numpy as np
+
+from .cache import coord_key, MATRIX_CACHE_PRECISION
+from .upstream import upstream
+
+# Precomputed all-pairs matrices for the fixed Supabase `locations` table
+# (depots and recurring customers), one file per ORS profile:
+#
+#     python -m Flaskr.matrix_store build                    # driving-car, incremental
+#     python -m Flaskr.matrix_store build --profile driving-hgv --full
+#     python -m Flaskr.matrix_store info
+#
+# A build appends locations that are not in the file yet and fetches only their
+# rows/columns; --full recomputes everything (and drops deleted or moved locations).
+# The service memory-maps MATRIX_STORE_DIR/<profile>.rmx (read-only, shared by all
+# workers through the page cache) and fetch_matrix/fetch_pairs answer pairs between
+# known locations from it with no upstream call. Files are replaced atomically and
+# re-checked every MATRIX_STORE_RECHECK_S seconds, so a rebuild needs no restart.
+#
+# File layout (little-endian): header <4sIIQdI> = magic "RMX1", format version, n,
+# build number, built_at (epoch), meta length; meta JSON (profile, coordinate
+# precision, location ids); zero padding to 8 bytes; coordinates float64[n, 2]
+# (lon, lat); distances float32[n, n] (metres); durations float32[n, n] (seconds).
+# NaN marks pairs ORS could not route.
+
+MATRIX_STORE_DIR = os.getenv("MATRIX_STORE_DIR") or os.path.join(os.path.dirname(__file__), "..", "matrix_store")
+MATRIX_STORE_RECHECK_S = float(os.getenv("MATRIX_STORE_RECHECK_S", "60"))
+
+MAGIC = b"RMX1"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sIIQdI")
+
+
+def store_path(profile, directory=None):
+    return os.path.join(directory or MATRIX_STORE_DIR, f"{profile}.rmx")
+
+
+def _layout(n, meta_len):
+    coords_at = _HEADER.size + meta_len
+    coords_at += -coords_at % 8
+    dist_at = coords_at + n * 2 * 8
+    dur_at = dist_at + n * n * 4
+    return coords_at, dist_at, dur_at, dur_at + n * n * 4
+
+
+class MatrixStore:
+    """Read-only view of one .rmx file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, n, build, built_at, meta_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{path}: not a v{FORMAT_VERSION} matrix store")
+            meta = json.loads(f.read(meta_len))
+        coords_at, dist_at, dur_at, size = _layout(n, meta_len)
+        if os.path.getsize(path) != size:
+            raise ValueError(f"{path}: truncated ({os.path.getsize(path)} bytes, expected {size})")
+
+        self.path, self.n, self.build, self.built_at, self.meta = path, n, build, built_at, meta
+        self.profile = meta["profile"]
+        self.precision = int(meta["precision"])
+        self.ids = meta.get("ids") or [None] * n
+        self.mtime = os.path.getmtime(path)
+        self.coords = np.memmap(path, dtype="<f8", mode="r", offset=coords_at, shape=(n, 2)) if n else np.empty((0, 2))
+        self.distances = np.memmap(path, dtype="<f4", mode="r", offset=dist_at, shape=(n, n)) if n else np.empty((0, 0))
+        self.durations = np.memmap(path, dtype="<f4", mode="r", offset=dur_at, shape=(n, n)) if n else np.empty((0, 0))
+        self.index = {coord_key(lon, lat, self.precision): i for i, (lon, lat) in enumerate(np.asarray(self.coords))}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "size": n * n}
+        self._lock = threading.Lock()
+
+    def indexes(self, points_coords):
+        """Store row per [lon, lat] point, -1 for points that are not known locations."""
+        return np.array([self.index.get(coord_key(lon, lat, self.precision), -1) for lon, lat in points_coords],
+                        dtype=int)
+
+    def count(self, hits, misses):
+        with self._lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += misses
+
+    def block(self, rows, cols):
+        """(distances, durations) float64 sub-matrices for store rows x store cols."""
+        ix = np.ix_(np.asarray(rows, dtype=int), np.asarray(cols, dtype=int))
+        return self.distances[ix].astype(float), self.durations[ix].astype(float)
+
+    def describe(self):
+        return {"profile": self.profile, "locations": self.n, "build": self.build,
+                "built_at": self.built_at, "path": self.path, **self.stats}
+
+
+# ---------- service side ----------
+
+_stores = {}   # profile -> (MatrixStore | None, checked_at)
+_stores_lock = threading.Lock()
+
+
+def get_store(profile):
+    """The memory-mapped store for `profile`, or None. Picks up rebuilt files on its own."""
+    now = time.monotonic()
+    with _stores_lock:
+        store, checked = _stores.get(profile, (None, None))
+        if checked is not None and now - checked < MATRIX_STORE_RECHECK_S:
+            return store
+        path = store_path(profile)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            store = None
+        else:
+            if store is None or store.mtime != mtime:
+                try:
+                    store = MatrixStore(path)
+                    print(f"matrix store: {profile} build {store.build}, {store.n} locations")
+                except (OSError, ValueError, KeyError) as e:
+                    print("matrix store load failed:", e)
+                    store = None
+        _stores[profile] = (store, now)
+        return store
+
+
+def load_all():
+    """Map every store in MATRIX_STORE_DIR now (called at app start)."""
+    try:
+        names = os.listdir(MATRIX_STORE_DIR)
+    except OSError:
+        return []
+    return [get_store(name[:-4]) for name in sorted(names) if name.endswith(".rmx")]
+
+
+def store_stats():
+    with _stores_lock:
+        return {f"matrix_store:{p}": s.stats for p, (s, _) in _stores.items() if s is not None}
+
+
+# ---------- build ----------
+
+def write_store(path, profile, precision, coords, ids, distances, durations, build):
+    """Write a complete store to path.tmp and atomically move it into place."""
+    coords = np.asarray(coords, dtype="<f8").reshape(-1, 2)
+    n = len(coords)
+    meta = json.dumps({"profile": profile, "precision": precision, "ids": list(ids)}).encode()
+    coords_at, dist_at, dur_at, size = _layout(n, len(meta))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, n, build, time.time(), len(meta)))
+        f.write(meta)
+        f.write(b"\0" * (coords_at - _HEADER.size - len(meta)))
+        f.write(coords.tobytes())
+        f.write(np.asarray(distances, dtype="<f4").reshape(n, n).tobytes())
+        f.write(np.asarray(durations, dtype="<f4").reshape(n, n).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)   # readers keep their old mapping until they re-check
+    return size
+
+
+def fetch_locations():
+    """[{id, lon, lat}] from the Supabase `locations` table, oldest first."""
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not (url and key):
+        raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set")
+    headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+    rows, page = [], 1000
+    while True:
+        r = upstream("supabase").get(
+            f"{url}/rest/v1/locations", headers=headers,
+            params={"select": "id,latitude,longitude", "order": "created_at.asc,id.asc",
+                    "limit": str(page), "offset": str(len(rows))},
+        )
+        r.raise_for_status()
+        batch = r.json()
+        rows += batch
+        if len(batch) < page:
+            break
+    return [{"id": r["id"], "lon": float(r["longitude"]), "lat": float(r["latitude"])}
+            for r in rows if r.get("latitude") is not None and r.get("longitude") is not None]
+
+
+def build(profile, locations, directory=None, full=False, precision=None):
+    """
+    Bring <profile>.rmx up to date with `locations`. Only locations whose coordinates
+    are not in the file yet are fetched (their rows and columns), unless full=True.
+    Returns a summary dict.
+    """
+    from .ors import _matrix_tiles, _fetch_tiles   # ors imports this module
+
+    path = store_path(profile, directory)
+    old = None
+    if not full and os.path.exists(path):
+        old = MatrixStore(path)
+    precision = old.precision if old is not None else (precision or MATRIX_CACHE_PRECISION)
+
+    coords, ids, seen = [], [], set()
+    if old is not None:
+        coords, ids = np.asarray(old.coords).tolist(), list(old.ids)
+        seen = set(old.index)
+    first_new = len(coords)
+    for loc in locations:
+        key = coord_key(loc["lon"], loc["lat"], precision)
+        if key not in seen:   # duplicates (same place, several rows) share one entry
+            seen.add(key)
+            coords.append([loc["lon"], loc["lat"]])
+            ids.append(loc.get("id"))
+
+    n = len(coords)
+    added = n - first_new
+    if old is not None and not added:
+        return {"profile": profile, "path": path, "locations": n, "added": 0, "build": old.build, "calls": 0}
+
+    distances = np.zeros((n, n))
+    durations = np.zeros((n, n))
+    if old is not None:
+        distances[:first_new, :first_new] = old.distances
+        durations[:first_new, :first_new] = old.durations
+    missing = np.zeros((n, n), dtype=bool)
+    missing[first_new:, :] = True
+    missing[:, first_new:] = True
+    np.fill_diagonal(missing, False)
+
+    tiles = _matrix_tiles(missing)
+    for (sources, destinations), (dist, dur) in zip(tiles, _fetch_tiles(coords, tiles, profile)):
+        distances[np.ix_(sources, destinations)] = dist
+        durations[np.ix_(sources, destinations)] = dur
+
+    next_build = (old.build if old is not None else 0) + 1
+    size = write_store(path, profile, precision, coords, ids, distances, durations, next_build)
+    return {"profile": profile, "path": path, "locations": n, "added": added, "build": next_build,
+            "calls": len(tiles), "bytes": size}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m Flaskr.matrix_store",
+                                 description="Build/inspect precomputed matrices for the locations table.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="fetch missing pairs from ORS and write <profile>.rmx")
+    b.add_argument("--profile", action="append", help="ORS profile (repeatable; default driving-car)")
+    b.add_argument("--full", action="store_true", help="recompute everything instead of appending")
+    b.add_argument("--dir", help=f"output directory (default {MATRIX_STORE_DIR})")
+    i = sub.add_parser("info", help="describe the stores in a directory")
+    i.add_argument("--dir", help=f"store directory (default {MATRIX_STORE_DIR})")
+    args = ap.parse_args(argv)
+
+    directory = args.dir or MATRIX_STORE_DIR
+    if args.command == "info":
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".rmx")) if os.path.isdir(directory) else []
+        for name in names:
+            print(json.dumps(MatrixStore(os.path.join(directory, name)).describe()))
+        return 0
+
+    locations = fetch_locations()
+    print(f"{len(locations)} locations")
+    for profile in args.profile or ["driving-car"]:
+        print(json.dumps(build(profile, locations, directory=directory, full=args.full)))
+    return 0
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    sys.exit(main())
@@ -0,0 +1,206 @@
+import os, re, time, bisect, threading
+from urllib.parse import urlparse
+
+from flask import g, request, has_app_context
+
+# Lightweight instrumentation: stage timers on the optimize hot path, a
+# Server-Timing response header, and Prometheus text-format histograms/counters
+# served at GET /api/metrics. Plain-Python (no prometheus_client dependency).
+# METRICS_ENABLED=0 turns every timer/observation into a no-op and hides /metrics.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_registry = []
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, label_values, value):
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(label_values)
+            if s is None:
+                s = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for values, s in sorted(series.items()):
+            base = _labels(self.labels, values)
+            cumulative = 0
+            for bound, n in zip(self.buckets, s):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le=bound)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labels, values, le="+Inf")} {s[-1]}')
+            lines.append(f"{self.name}_sum{base} {s[-2]}")
+            lines.append(f"{self.name}_count{base} {s[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label_values, n=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for values, n in sorted(series.items()):
+            lines.append(f"{self.name}{_labels(self.labels, values)} {n}")
+        return lines
+
+
+def _labels(names, values, le=None):
+    pairs = [f'{k}="{str(v)}"' for k, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+STAGE_SECONDS = Histogram("routest_stage_seconds", "Time spent per optimize stage.", ("stage",))
+UPSTREAM_SECONDS = Histogram("routest_upstream_request_seconds", "Upstream HTTP latency.", ("upstream", "endpoint"))
+UPSTREAM_RESPONSES = Counter("routest_upstream_responses_total", "Upstream HTTP responses by status.",
+                             ("upstream", "code"))
+HTTP_SECONDS = Histogram("routest_http_request_seconds", "API request latency.", ("endpoint",))
+HTTP_RESPONSES = Counter("routest_http_responses_total", "API responses by status code.",
+                         ("endpoint", "method", "code"))
+ROUTE_STOPS = Histogram("routest_optimize_stops", "Destinations per optimized route.", (), COUNT_BUCKETS)
+ROUTE_TRIPS = Histogram("routest_optimize_trips", "Trips per optimized route.", (), COUNT_BUCKETS)
+
+
+# ---------- hot-path helpers ----------
+
+class _Stage:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        STAGE_SECONDS.observe((self.name,), elapsed)
+        if has_app_context():
+            g.setdefault("stage_timings", []).append((self.name, elapsed))
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name):
+    """`with stage("matrix"): ...` -> histogram + Server-Timing entry (no-op when disabled)."""
+    return _Stage(name) if METRICS_ENABLED else _NO_STAGE
+
+
+# upstream paths -> a fixed set of endpoint labels; anything else (a simulator's
+# caller-supplied target, a path with an id in it) is counted as "other"
+UPSTREAM_ENDPOINTS = [
+    (re.compile(r"/v2/matrix/[\w-]+$"), "/v2/matrix/{profile}"),
+    (re.compile(r"/v2/directions/[\w-]+/geojson$"), "/v2/directions/{profile}/geojson"),
+    (re.compile(r"/rest/v1/(route_requests|route_results|locations)$"), r"/rest/v1/\1"),
+    (re.compile(r"/api/update_tracker(/batch)?$"), r"/api/update_tracker\1"),
+    (re.compile(r"^/health$"), "/health"),
+    (re.compile(r"^/?$"), "/"),
+]
+
+
+def upstream_endpoint(url):
+    path = urlparse(url).path
+    for pattern, template in UPSTREAM_ENDPOINTS:
+        m = pattern.search(path)
+        if m:
+            return m.expand(template)
+    return "other"
+
+
+def observe_upstream(upstream, url, seconds, code):
+    if not METRICS_ENABLED:
+        return
+    UPSTREAM_SECONDS.observe((upstream, upstream_endpoint(url)), seconds)
+    UPSTREAM_RESPONSES.inc((upstream, code))
+
+
+def observe_route(feature):
+    if not METRICS_ENABLED or not isinstance(feature, dict):
+        return
+    props = feature.get("properties") or {}
+    ROUTE_STOPS.observe((), len(props.get("destinations") or []))
+    ROUTE_TRIPS.observe((), int((props.get("summary") or {}).get("trips") or 1))
+
+
+# ---------- Flask wiring ----------
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        g.request_t0 = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        t0 = g.get("request_t0")
+        if t0 is None:
+            return response
+        elapsed = time.perf_counter() - t0
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_SECONDS.observe((endpoint,), elapsed)
+        HTTP_RESPONSES.inc((endpoint, request.method, response.status_code))
+
+        timings = g.get("stage_timings") or []
+        parts = [f"{name};dur={secs * 1000:.1f}" for name, secs in timings]
+        parts.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(parts)
+        return response
+
+
+def render(caches=None):
+    """Prometheus text exposition of every metric, plus cache counters from cache_stats()."""
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        name = f"routest_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {name} Cache {field} per cache.", f"# TYPE {name} {kind}"]
+        for cache, s in sorted((caches or {}).items()):
+            lines.append(f'{name}{{cache="{cache}"}} {s.get(field, 0)}')
+    return "\n".join(lines) + "\n"
@@ -1,8 +1,18 @@
 import os, pickle, datetime as dt
-import pandas as pd
+import numpy as np
 
 _model = None
 
+# one-hot + numeric columns, in the order the model was trained on
+WEATHERS = ("Cloudy", "Stormy", "Sunny", "Windy")
+TRAFFIC = ("High", "Jam", "Low", "Medium")
+FEATURE_COLUMNS = (
+    [f"weather_{w}" for w in WEATHERS]
+    + [f"traffic_{t}" for t in TRAFFIC]
+    + ["weekday_ordered", "hour_ordered", "distance_km", "driver_age"]
+)
+_COL = {c: i for i, c in enumerate(FEATURE_COLUMNS)}
+
 def _model_path():
     return os.getenv("ETA_MODEL_PATH") or os.path.join(
         os.path.dirname(__file__), "..", "xgb_eta_model.pkl"
@@ -20,39 +30,115 @@ def _load_model():
         _model = f"ERROR:{e}"
     return _model
 
-def predict_eta_minutes(*, weather: str, traffic: str, distance_m: float, pickup_time, driver_age: float = 30.0):
+def _pickup_dt(pickup_time):
+    if isinstance(pickup_time, str):
+        return dt.datetime.fromisoformat(pickup_time)
+    if isinstance(pickup_time, dt.datetime):
+        return pickup_time
+    return dt.datetime.now()
+
+def build_features(records):
+    """
+    One pass over records of {weather, traffic, distance_m, pickup_time, driver_age}.
+    Returns the (n, len(FEATURE_COLUMNS)) float matrix and the parsed pickup datetimes.
+    """
+    X = np.zeros((len(records), len(FEATURE_COLUMNS)))
+    pickups = []
+    for row, rec in enumerate(records):
+        pickup_dt = _pickup_dt(rec.get("pickup_time"))
+        pickups.append(pickup_dt)
+        w = rec.get("weather", "Sunny")
+        t = rec.get("traffic", "Low")
+        if w in WEATHERS:
+            X[row, _COL[f"weather_{w}"]] = 1.0
+        if t in TRAFFIC:
+            X[row, _COL[f"traffic_{t}"]] = 1.0
+        X[row, _COL["weekday_ordered"]] = pickup_dt.weekday()
+        X[row, _COL["hour_ordered"]] = pickup_dt.hour
+        X[row, _COL["distance_km"]] = float(rec.get("distance_m") or 0) / 1000.0
+        X[row, _COL["driver_age"]] = float(rec.get("driver_age") or 30.0)
+    return X, pickups
+
+def _predict(model, X):
+    # XGBoost models remember the training column names; feed the array to the
+    # booster directly (reordered to match) instead of wrapping it in a DataFrame.
+    get_booster = getattr(model, "get_booster", None)
+    if get_booster is not None:
+        booster = get_booster()
+        names = booster.feature_names
+        if names and set(names) <= set(FEATURE_COLUMNS):
+            X = X[:, [FEATURE_COLUMNS.index(n) for n in names]]
+        return np.asarray(booster.inplace_predict(X, validate_features=False), dtype=float).ravel()
+    return np.asarray(model.predict(X), dtype=float).ravel()
+
+def predict_eta_batch(records):
+    """
+    Score many records with a single model.predict.
+    Returns a list of (eta_minutes, eta_completion_iso) in input order,
+    or None when the model is unavailable or prediction fails.
+    """
     model = _load_model()
     if not hasattr(model, "predict"):
-        return None, None
+        return None
+    records = list(records)
+    if not records:
+        return []
 
-    if isinstance(pickup_time, str):
-        pickup_dt = dt.datetime.fromisoformat(pickup_time)
-    elif isinstance(pickup_time, dt.datetime):
-        pickup_dt = pickup_time
-    else:
-        pickup_dt = dt.datetime.now()
-
-    feats = {
-        "weather_Cloudy": (weather == "Cloudy"),
-        "weather_Stormy": (weather == "Stormy"),
-        "weather_Sunny":  (weather == "Sunny"),
-        "weather_Windy":  (weather == "Windy"),
-        "traffic_High":   (traffic == "High"),
-        "traffic_Jam":    (traffic == "Jam"),
-        "traffic_Low":    (traffic == "Low"),
-        "traffic_Medium": (traffic == "Medium"),
-        "weekday_ordered": pickup_dt.weekday(),
-        "hour_ordered":    pickup_dt.hour,
-        "distance_km":     float(distance_m or 0) / 1000.0,
-        "driver_age":      float(driver_age or 30.0),
-    }
-
-    import pandas as pd  # ensure import even if optimized
-    df = pd.DataFrame([feats])
+    X, pickups = build_features(records)
     try:
-        eta_minutes = float(model.predict(df)[0])
+        etas = _predict(model, X)
     except Exception:
+        return None
+
+    return [
+        (float(m), (p + dt.timedelta(minutes=float(m))).isoformat())
+        for m, p in zip(etas, pickups)
+    ]
+
+def predict_eta_minutes(*, weather: str, traffic: str, distance_m: float, pickup_time, driver_age: float = 30.0):
+    out = predict_eta_batch([{
+        "weather": weather,
+        "traffic": traffic,
+        "distance_m": distance_m,
+        "pickup_time": pickup_time,
+        "driver_age": driver_age,
+    }])
+    if not out:
+        return None, None
+    return out[0]
+
+def predict_leg_etas(segments, *, weather: str, traffic: str, start_time, driver_age: float = 30.0,
+                     total_distance_m=None):
+    """
+    ETA per route segment in one batched model call.
+    Each leg is scored with the pickup time at which it starts (start + ORS durations
+    of the legs before it); arrivals accumulate the predicted minutes from start_time.
+    With total_distance_m the whole-route ETA rides along in the same batch.
+    Returns (legs, total) where legs is a list of (eta_minutes, arrival_iso) and total
+    is (eta_minutes, completion_iso) or None; (None, None) if the model is unavailable.
+    """
+    start = _pickup_dt(start_time)
+    offsets = np.concatenate(([0.0], np.cumsum([float(s.get("duration") or 0) for s in segments])))
+    records = [{
+        "weather": weather,
+        "traffic": traffic,
+        "distance_m": s.get("distance") or 0,
+        "pickup_time": start + dt.timedelta(seconds=float(off)),
+        "driver_age": driver_age,
+    } for s, off in zip(segments, offsets)]
+    if total_distance_m is not None:
+        records.append({"weather": weather, "traffic": traffic, "distance_m": total_distance_m,
+                        "pickup_time": start, "driver_age": driver_age})
+
+    preds = predict_eta_batch(records)
+    if preds is None:
         return None, None
+    total = preds.pop() if total_distance_m is not None else None
 
-    eta_ts = (pickup_dt + dt.timedelta(minutes=eta_minutes)).isoformat()
-    return eta_minutes, eta_ts
\ No newline at end of file
+    minutes = np.array([m for m, _ in preds], dtype=float)
+    arrivals = np.cumsum(minutes)
+    legs = [
+        (float(m), (start + dt.timedelta(minutes=float(a))).isoformat())
+        for m, a in zip(minutes, arrivals)
+    ]
+    return legs, total
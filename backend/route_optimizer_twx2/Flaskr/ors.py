@@ -0,0 +1,281 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from .cache import matrix_cache, directions_cache, coord_key, pair_key, directions_key
+from .upstream import upstream
+from .matrix_store import get_store, store_stats
+
+# Read your ORS key from env (safer than hard-coding)
+ORS_API_KEY = os.getenv("ORS_API_KEY") or os.getenv("OPENROUTESERVICE_API_KEY")
+# point at a self-hosted ORS (or a test double) with ORS_BASE_URL
+ORS_BASE = (os.getenv("ORS_BASE_URL") or "https://api.openrouteservice.org").rstrip("/")
+
+# max in-flight directions calls per optimization request
+DIRECTIONS_CONCURRENCY = int(os.getenv("ORS_DIRECTIONS_CONCURRENCY", "4"))
+
+
+def _headers():
+    return {"Authorization": ORS_API_KEY, "Content-Type": "application/json"}
+
+
+# ---------- matrix ----------
+
+# ORS caps sources x destinations per matrix call; 50 x 50 tiles stay well inside it
+MATRIX_TILE = int(os.getenv("ORS_MATRIX_TILE", "50"))
+MATRIX_CONCURRENCY = int(os.getenv("ORS_MATRIX_CONCURRENCY", "4"))
+
+
+def fetch_matrix(points_coords, profile_type, needed=None):
+    """
+    Distance/duration matrix for [[lon, lat], ...] as two n x n NumPy arrays
+    (metres, seconds; NaN where ORS could not route a pair). With a boolean n x n
+    `needed` mask only those pairs are looked up; the others are left at 0.
+    Pairs between known locations come from the precomputed store (matrix_store.py)
+    and pairs already in the matrix cache are served locally. The remaining pairs are
+    fetched as MATRIX_TILE-sized sources x destinations tiles, in parallel, each
+    tile retried on its own (ORS_RETRIES, see upstream.py).
+    Raises requests.RequestException on upstream errors.
+    """
+    n = len(points_coords)
+    keys = [coord_key(lon, lat) for lon, lat in points_coords]
+    distances = np.zeros((n, n))
+    durations = np.zeros((n, n))
+    missing = np.zeros((n, n), dtype=bool)
+
+    # pairs between known locations come straight from the precomputed store
+    stored = np.zeros((n, n), dtype=bool)
+    store = get_store(profile_type)
+    if store is not None:
+        rows = store.indexes(points_coords)
+        hit = np.flatnonzero(rows >= 0)
+        if len(hit):
+            block = np.ix_(hit, hit)
+            distances[block], durations[block] = store.block(rows[hit], rows[hit])
+            stored[block] = True
+        store.count(len(hit) * (len(hit) - 1), n * (n - 1) - len(hit) * (len(hit) - 1))
+
+    # only visit pairs that still need a lookup (sparse requests touch a few % of n x n)
+    _, key_ids = np.unique(keys, return_inverse=True)
+    candidates = (key_ids[:, None] != key_ids[None, :]) & ~stored
+    if needed is not None:
+        candidates &= needed
+    wanted = {}
+    for i, j in zip(*np.nonzero(candidates)):
+        i, j = int(i), int(j)
+        wanted[(i, j)] = pair_key(profile_type, keys[i], keys[j])
+    cached = matrix_cache.get_many(set(wanted.values()))
+
+    for (i, j), k in wanted.items():
+        hit = cached.get(k)
+        if hit is None:
+            missing[i, j] = True
+        else:
+            distances[i, j], durations[i, j] = hit
+
+    tiles = _matrix_tiles(missing)
+    if tiles:
+        for (sources, destinations), (dist, dur) in zip(tiles, _fetch_tiles(points_coords, tiles, profile_type)):
+            distances[np.ix_(sources, destinations)] = dist
+            durations[np.ix_(sources, destinations)] = dur
+
+        fresh = {}
+        for i, j in zip(*np.nonzero(missing)):
+            d, t = distances[i, j], durations[i, j]
+            if np.isfinite(d) and np.isfinite(t):
+                fresh[wanted[(i, j)]] = [float(d), float(t)]
+        matrix_cache.set_many(fresh)
+
+    return distances, durations
+
+
+def fetch_pairs(points_coords, pairs, profile_type):
+    """
+    {(i, j): (metres, seconds)} for just the given index pairs, e.g. a new stop's row
+    and column (two ORS calls) instead of a full n x n matrix. Cached pairs are served
+    locally; the rest go out as single-source / single-destination calls. NaN where
+    ORS could not route a pair. Raises requests.RequestException on upstream errors.
+    """
+    keys = [coord_key(lon, lat) for lon, lat in points_coords]
+    store = get_store(profile_type)
+    rows = store.indexes(points_coords) if store is not None else None
+    out, wanted = {}, {}
+    for i, j in set(pairs):
+        if keys[i] == keys[j]:
+            out[(i, j)] = (0.0, 0.0)
+        elif rows is not None and rows[i] >= 0 and rows[j] >= 0:
+            out[(i, j)] = (float(store.distances[rows[i], rows[j]]), float(store.durations[rows[i], rows[j]]))
+        else:
+            wanted[(i, j)] = pair_key(profile_type, keys[i], keys[j])
+    if store is not None:
+        store.count(len(out), len(wanted))
+    cached = matrix_cache.get_many(set(wanted.values()))
+
+    missing = set()
+    for p, k in wanted.items():
+        hit = cached.get(k)
+        if hit is None:
+            missing.add(p)
+        else:
+            out[p] = (float(hit[0]), float(hit[1]))
+
+    tiles = _pair_tiles(missing)
+    if tiles:
+        fresh = {}
+        for (sources, destinations), (dist, dur) in zip(tiles, _fetch_tiles(points_coords, tiles, profile_type)):
+            for a, i in enumerate(sources):
+                for b, j in enumerate(destinations):
+                    if (i, j) not in missing:
+                        continue   # a dense tile also covers pairs we already had
+                    d, t = float(dist[a, b]), float(dur[a, b])
+                    out[(i, j)] = (d, t)
+                    if np.isfinite(d) and np.isfinite(t):
+                        fresh[wanted[(i, j)]] = [d, t]
+        matrix_cache.set_many(fresh)
+    return out
+
+
+def _pair_tiles(missing):
+    """
+    Cover a set of (i, j) pairs with ORS calls: one rectangle when the pairs fill at
+    least half of it (e.g. a single trip's sub-matrix), else 1 x k / k x 1 calls,
+    largest row or column first (e.g. a new stop's row and column).
+    """
+    missing = set(missing)
+    limit = MATRIX_TILE * MATRIX_TILE
+    rows, cols = {i for i, _ in missing}, {j for _, j in missing}
+    if missing and len(rows) * len(cols) <= min(limit, 2 * len(missing)):
+        return [(sorted(rows), sorted(cols))]
+    tiles = []
+    while missing:
+        rows, cols = {}, {}
+        for i, j in missing:
+            rows.setdefault(i, []).append(j)
+            cols.setdefault(j, []).append(i)
+        i, row = max(rows.items(), key=lambda kv: len(kv[1]))
+        j, col = max(cols.items(), key=lambda kv: len(kv[1]))
+        if len(row) >= len(col):
+            row = sorted(row)
+            tiles += [([i], row[c:c + limit]) for c in range(0, len(row), limit)]
+            missing.difference_update((i, x) for x in row)
+        else:
+            col = sorted(col)
+            tiles += [(col[c:c + limit], [j]) for c in range(0, len(col), limit)]
+            missing.difference_update((x, j) for x in col)
+    return tiles
+
+
+def _matrix_tiles(missing):
+    """Split the missing-pair mask into (sources, destinations) index lists, one per ORS call."""
+    n = missing.shape[0]
+    tiles = []
+    for r0 in range(0, n, MATRIX_TILE):
+        for c0 in range(0, n, MATRIX_TILE):
+            block = missing[r0:r0 + MATRIX_TILE, c0:c0 + MATRIX_TILE]
+            if not block.any():
+                continue
+            rows = (np.flatnonzero(block.any(axis=1)) + r0).tolist()
+            cols = (np.flatnonzero(block.any(axis=0)) + c0).tolist()
+            tiles.append((rows, cols))
+    return tiles
+
+
+def _fetch_tiles(points_coords, tiles, profile_type):
+    """Fetch tiles concurrently; results in tile order. The first hard failure cancels the rest."""
+    if len(tiles) == 1:
+        return [_post_matrix(points_coords, *tiles[0], profile_type)]
+
+    workers = max(1, min(MATRIX_CONCURRENCY, len(tiles)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ors-matrix")
+    try:
+        futures = [pool.submit(_post_matrix, points_coords, s, d, profile_type) for s, d in tiles]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for f in futures:
+            if f in done and f.exception() is not None:
+                for p in pending:
+                    p.cancel()
+                raise f.exception()
+        return [f.result() for f in futures]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _post_matrix(points_coords, sources, destinations, profile_type):
+    """One ORS matrix call restricted to the given source/destination indexes."""
+    # only ship the locations this sub-matrix actually references
+    used = sorted(set(sources) | set(destinations))
+    pos = {idx: k for k, idx in enumerate(used)}
+    body = {
+        "locations": [points_coords[i] for i in used],
+        "sources": [pos[i] for i in sources],
+        "destinations": [pos[j] for j in destinations],
+        "metrics": ["distance", "duration"],
+        "units": "m",
+    }
+    # read-only despite the POST, so 429/5xx/connection errors are retried (with jitter)
+    resp = upstream("ors").post(f"{ORS_BASE}/v2/matrix/{profile_type}", json=body, headers=_headers(), retry=True)
+    resp.raise_for_status()
+    data = resp.json()
+    if not data.get("distances"):
+        raise ValueError("ORS matrix returned no distances")
+    # None (unroutable) becomes NaN
+    dist = np.array(data["distances"], dtype=float)
+    dur = np.array(data["durations"], dtype=float) if data.get("durations") else np.full(dist.shape, np.nan)
+    return dist, dur
+
+
+# ---------- directions ----------
+
+def fetch_directions(coordinates, profile_type):
+    """
+    ORS directions/geojson Feature for an ordered [[lon, lat], ...] list.
+    Identical (profile, coordinate list) requests are answered from the directions
+    cache; callers get their own properties/segments so they can annotate freely.
+    Raises requests.RequestException on upstream errors.
+    """
+    key = directions_key(profile_type, coordinates)
+    feature = directions_cache.get(key)
+    if feature is None:
+        resp = upstream("ors").post(
+            f"{ORS_BASE}/v2/directions/{profile_type}/geojson",
+            json={"coordinates": coordinates}, headers=_headers(), retry=True,
+        )
+        resp.raise_for_status()
+        feature = resp.json()['features'][0]
+        directions_cache.set(key, feature)
+    return _copy_feature(feature)
+
+
+def fetch_directions_many(coordinate_lists, profile_type, max_workers=None):
+    """
+    fetch_directions for several coordinate lists concurrently (bounded pool).
+    Features come back in input order. The first failure cancels whatever has not
+    started yet and is re-raised immediately instead of waiting for the stragglers.
+    """
+    if len(coordinate_lists) <= 1:
+        return [fetch_directions(c, profile_type) for c in coordinate_lists]
+
+    workers = max(1, min(max_workers or DIRECTIONS_CONCURRENCY, len(coordinate_lists)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ors-directions")
+    try:
+        futures = [pool.submit(fetch_directions, c, profile_type) for c in coordinate_lists]
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for f in futures:
+            if f in done and f.exception() is not None:
+                for p in pending:
+                    p.cancel()
+                raise f.exception()
+        return [f.result() for f in futures]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _copy_feature(feature):
+    props = dict(feature.get("properties") or {})
+    props["segments"] = [dict(s) for s in props.get("segments", [])]
+    props["summary"] = dict(props.get("summary") or {})
+    return {**feature, "properties": props}
+
+
+def cache_stats():
+    return {"matrix": matrix_cache.stats(), "directions": directions_cache.stats(), **store_stats()}
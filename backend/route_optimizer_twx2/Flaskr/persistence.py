@@ -0,0 +1,159 @@
+import os, json, time, queue, atexit, threading
+import requests
+
+from .upstream import upstream
+
+# Write-behind persistence for route_requests / route_results.
+# Rows are queued in memory (bounded) and a single background thread bulk-inserts
+# them as JSON arrays over the pooled Supabase client (upstream.py). Failed batches are retried, then
+# appended to a dead-letter file; a batch PostgREST rejects (4xx) is re-sent row by row so
+# only the bad rows are dead-lettered. The queue is drained on interpreter shutdown.
+
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+PERSIST_FLUSH_MS = int(os.getenv("PERSIST_FLUSH_MS", "200"))
+PERSIST_ENQUEUE_TIMEOUT = float(os.getenv("PERSIST_ENQUEUE_TIMEOUT", "0.5"))
+PERSIST_RETRIES = int(os.getenv("PERSIST_RETRIES", "3"))
+PERSIST_DEADLETTER_PATH = os.getenv("PERSIST_DEADLETTER_PATH", "persist_deadletter.jsonl")
+
+_STOP = object()
+
+
+class WriteBehindWriter:
+    def __init__(self, rest, headers):
+        self.rest = rest
+        self.headers = dict(headers)
+        self.headers["Prefer"] = "return=minimal"  # we already know the ids
+        self.q = queue.Queue(maxsize=PERSIST_QUEUE_SIZE)
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "retries": 0,
+                      "dead_lettered": 0, "sync_fallbacks": 0, "row_fallbacks": 0}
+        self._stats_lock = threading.Lock()   # bumped from request threads and the writer
+        self._thread = threading.Thread(target=self._loop, name="persist-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, req_row, result_row):
+        """
+        Queue one (route_requests, route_results) pair and return "queued". When the
+        queue stays full for PERSIST_ENQUEUE_TIMEOUT the caller writes it synchronously
+        instead, which is the backpressure: memory stays bounded and requests slow
+        down; then the return value is True/False for whether the pair was written.
+        """
+        try:
+            self.q.put((req_row, result_row), timeout=PERSIST_ENQUEUE_TIMEOUT)
+            self._count(enqueued=1)
+            return "queued"
+        except queue.Full:
+            self._count(sync_fallbacks=1)
+            return self._write_batch([(req_row, result_row)]) == 1
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self.stats[k] += v
+
+    def close(self, timeout=10):
+        """Flush whatever is queued and stop the writer thread."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _loop(self):
+        while True:
+            item = self.q.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + PERSIST_FLUSH_MS / 1000.0
+            stop = False
+            while len(batch) < PERSIST_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self.q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        """Insert the pairs, parents first; returns how many pairs were fully written."""
+        # route_results references route_requests, so a result is only sent once its
+        # request row is in; whatever fails for good goes to the dead-letter file
+        pairs = self._insert("route_requests", batch, lambda pair: pair[0])
+        stored = {id(req_row) for req_row, _ in pairs}
+        orphans = [result_row for req_row, result_row in batch if id(req_row) not in stored]
+        if orphans:
+            self._dead_letter("route_results", orphans)
+        pairs = self._insert("route_results", pairs, lambda pair: pair[1])
+        if pairs:
+            self._count(written=len(pairs), batches=1)
+        return len(pairs)
+
+    def _insert(self, table, items, row_of):
+        """Bulk-insert row_of(item) for every item; returns the items whose row is stored."""
+        if not items:
+            return []
+        outcome = self._post_with_retry(table, [row_of(it) for it in items])
+        if outcome == "ok":
+            return items
+        if outcome == "rejected" and len(items) > 1:
+            # one bad row (e.g. a NULL origin_id) fails the whole insert: find it
+            self._count(row_fallbacks=1)
+            stored = []
+            for it in items:
+                if self._post_with_retry(table, [row_of(it)]) == "ok":
+                    stored.append(it)
+                else:
+                    self._dead_letter(table, [row_of(it)])
+            return stored
+        self._dead_letter(table, [row_of(it) for it in items])
+        return []
+
+    def _post_with_retry(self, table, rows):
+        """Returns "ok", "rejected" (4xx: the rows are bad, retrying will not help) or "failed"."""
+        for attempt in range(PERSIST_RETRIES):
+            try:
+                # inserts are not idempotent: the retry decision stays here, not in upstream()
+                r = upstream("supabase").post(f"{self.rest}/{table}", headers=self.headers, json=rows, retry=False)
+                if r.ok:
+                    return "ok"
+                print(f"{table} insert of {len(rows)} row(s) failed:", r.status_code, r.text[:300])
+                if 400 <= r.status_code < 500 and r.status_code != 429:
+                    return "rejected"
+            except requests.RequestException as e:
+                print(f"{table} insert error:", e)
+            self._count(retries=1)
+            time.sleep(0.5 * (2 ** attempt))
+        return "failed"
+
+    def _dead_letter(self, table, rows):
+        try:
+            with open(PERSIST_DEADLETTER_PATH, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"table": table, "row": row, "failed_at": time.time()}) + "\n")
+            self._count(dead_lettered=len(rows))
+        except OSError as e:
+            print("dead-letter write failed:", e, "rows lost:", len(rows))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(rest, headers):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehindWriter(rest, headers)
+            atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,331 @@
+import os, time
+import numpy as np
+import requests
+
+from .ors import fetch_pairs, fetch_directions_many
+from .solver import improve, UNREACHABLE
+from .utils import profile_for, _annotate_common_props
+from .geometry import decode_geometry, concat_coords, bbox_of
+from .metrics import stage
+
+# Incremental re-optimization of a saved route (POST /api/routes/<id>/reoptimize).
+# The saved plan (stops jsonb: source_point, driver_details, destination_points,
+# trips; route_results: legs, geometry) is patched instead of re-solved:
+#   remove -> the stop is dropped from its trip; only the new neighbour pair is looked up
+#   add    -> the stop's matrix row and column (fetch_pairs: 2 ORS calls), then the
+#             cheapest feasible insertion across all trips (or a new trip)
+# Changed trips get a 2-opt / Or-opt repair when they have at most
+# REOPT_REPAIR_MAX_STOPS stops (their pairs mostly come from the matrix cache;
+# 0 disables it). A trip that ends up longer than maximum_distance (dropping a stop can
+# do that on a non-metric road matrix) is split at the limit. Directions are re-fetched
+# for changed trips only; untouched trips reuse their stored segments and geometry.
+
+REOPT_REPAIR_MAX_STOPS = int(os.getenv("REOPT_REPAIR_MAX_STOPS", "30"))
+REOPT_REPAIR_BUDGET_MS = float(os.getenv("REOPT_REPAIR_BUDGET_MS", "100"))
+
+
+def _point(p):
+    return [float(p["lon"]), float(p["lat"])]
+
+
+def can_reoptimize(saved_stops):
+    """True when a saved stops row has what reoptimize() needs (older rows lack source/trips)."""
+    old = saved_stops.get("destination_points") or []
+    if not saved_stops.get("source_point") or not old:
+        return False
+    trips = saved_stops.get("trips") or ([{"stops": [0]}] if len(old) == 1 else [])
+    served = sorted(s for t in trips for s in t.get("stops") or [])
+    return served == list(range(len(old)))
+
+
+def _split_saved(trips, legs, geometry):
+    """Per saved trip: (segments or None, coordinates or None), cut from the stored route."""
+    n = len(trips)
+    segs, coords = [None] * n, [None] * n
+
+    counts = [len(t.get("stops") or []) + 1 for t in trips]   # every trip returns to the origin
+    if legs and len(legs) == sum(counts):
+        pos = 0
+        for t, c in enumerate(counts):
+            segs[t], pos = legs[pos:pos + c], pos + c
+
+    line = (decode_geometry(geometry) or {}).get("coordinates") if geometry else None
+    vertices = [t.get("vertices") for t in trips]
+    if line is not None and all(isinstance(v, int) for v in vertices) and sum(vertices) == len(line):
+        pos = 0
+        for t, v in enumerate(vertices):
+            coords[t], pos = line[pos:pos + v], pos + v
+    return segs, coords
+
+
+def reoptimize(saved_stops, legs, geometry, changes):
+    """
+    Apply changes {"add": [points], "remove": [destination indexes]} to a saved plan.
+    Returns (feature, payload): the new route Feature and the equivalent
+    /optimize_route request for it; or ({"error": ...}, None).
+    """
+    source = saved_stops["source_point"]
+    old = saved_stops.get("destination_points") or []
+    driver = saved_stops.get("driver_details") or {}
+    trips = saved_stops.get("trips") or ([{"stops": [0]}] if len(old) == 1 else [])
+
+    add = changes.get("add") or []
+    try:
+        remove = {int(i) for i in changes.get("remove") or []}
+        add_points = [_point(p) for p in add]
+        payloads = [float(p.get("payload", 0)) for p in old + add]
+        cap = float(driver.get("vehicle_capacity", 9e12))
+        max_dist = float(driver.get("maximum_distance", 9e12))
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return {"error": "add needs points with numeric lat/lon/payload; remove needs destination indexes."}, None
+    if any(i < 0 or i >= len(old) for i in remove):
+        return {"error": f"remove indexes must be between 0 and {len(old) - 1}."}, None
+    if not add and not remove:
+        return {"error": "nothing to change: pass add and/or remove."}, None
+
+    keep = [i for i in range(len(old)) if i not in remove]
+    if not keep and not add:
+        return {"error": "the route would have no stops left."}, None
+    new_index = {o: k for k, o in enumerate(keep)}
+    destinations = [old[i] for i in keep] + list(add)
+    q = [0.0] + [payloads[i] for i in keep] + payloads[len(old):]
+    added = list(range(len(keep), len(destinations)))
+    points = [_point(source)] + [_point(old[i]) for i in keep] + add_points   # node = destination + 1
+    profile = driver.get("profile") or profile_for(driver.get("vehicle_type"))
+    matrix_only = changes.get("geometry") is False or changes.get("mode") == "matrix"
+
+    # ---------- carry the saved trips over ----------
+    saved_segs, saved_coords = _split_saved(trips, legs, geometry)
+    known = {}   # (node, node) -> (metres, seconds)
+    plan = []
+    for t, trip in enumerate(trips):
+        stops = trip.get("stops") or []
+        if saved_segs[t] is not None:
+            path = [0] + [s + 1 for s in stops] + [0]
+            for a, b, seg in zip(path, path[1:], saved_segs[t]):
+                if (a == 0 or a - 1 in new_index) and (b == 0 or b - 1 in new_index):
+                    na = 0 if a == 0 else new_index[a - 1] + 1
+                    nb = 0 if b == 0 else new_index[b - 1] + 1
+                    known[(na, nb)] = (float(seg.get("distance") or 0), float(seg.get("duration") or 0))
+        kept = [new_index[s] for s in stops if s in new_index]
+        if kept:
+            plan.append({"stops": kept, "from": t, "changed": len(kept) != len(stops)})
+
+    # ---------- only the pairs we do not know yet ----------
+    nodes = range(len(points))
+    needed = set()
+    for trip in plan:
+        path = [0] + [s + 1 for s in trip["stops"]] + [0]
+        needed.update(p for p in zip(path, path[1:]) if p not in known)
+    for k in added:
+        needed.update((k + 1, j) for j in nodes if j != k + 1)
+        needed.update((j, k + 1) for j in nodes if j != k + 1)
+    try:
+        with stage("matrix"):
+            known.update(fetch_pairs(points, needed - set(known), profile))
+    except requests.RequestException as e:
+        status = getattr(e.response, "status_code", "n/a")
+        text = getattr(e.response, "text", str(e))
+        return {"error": f"ORS matrix error (status {status}): {text}"}, None
+    except ValueError as e:
+        return {"error": str(e)}, None
+
+    def dist(a, b):
+        d = known[(a, b)][0] if a != b else 0.0
+        return d if np.isfinite(d) else UNREACHABLE
+
+    def length(stops):
+        path = [0] + [s + 1 for s in stops] + [0]
+        return sum(dist(a, b) for a, b in zip(path, path[1:]))
+
+    # ---------- cheapest insertion ----------
+    with stage("solve"):
+        loads = [sum(q[s + 1] for s in t["stops"]) for t in plan]
+        lengths = [length(t["stops"]) for t in plan]
+        for k in sorted(added, key=lambda d: -q[d + 1]):
+            node = k + 1
+            if q[node] > cap or dist(0, node) + dist(node, 0) > max_dist:
+                return {"error": f"destination(s) {k} cannot be served within vehicle_capacity/maximum_distance"}, None
+            best = None
+            for t, trip in enumerate(plan):
+                if loads[t] + q[node] > cap:
+                    continue
+                path = [0] + [s + 1 for s in trip["stops"]] + [0]
+                for g in range(len(path) - 1):
+                    delta = dist(path[g], node) + dist(node, path[g + 1]) - dist(path[g], path[g + 1])
+                    if lengths[t] + delta <= max_dist and (best is None or delta < best[0]):
+                        best = (delta, t, g)
+            if best is None:
+                plan.append({"stops": [k], "from": None, "changed": True})
+                loads.append(q[node])
+                lengths.append(dist(0, node) + dist(node, 0))
+                continue
+            delta, t, g = best
+            plan[t]["stops"].insert(g, k)
+            plan[t]["changed"] = True
+            loads[t] += q[node]
+            lengths[t] += delta
+
+        _repair(plan, points, known, profile)
+
+        # ---------- max_distance, again ----------
+        # insertion kept every trip it touched within max_dist, but on a non-metric road
+        # matrix dropping a stop can lengthen its trip: split those at the limit
+        too_long = [t for t in plan if length(t["stops"]) > max_dist]
+        if too_long:
+            nodes_out = {s + 1 for t in too_long for s in t["stops"]}
+            depot = {(0, n) for n in nodes_out} | {(n, 0) for n in nodes_out}
+            try:
+                known.update(fetch_pairs(points, depot - set(known), profile))
+            except requests.RequestException as e:
+                status = getattr(e.response, "status_code", "n/a")
+                text = getattr(e.response, "text", str(e))
+                return {"error": f"ORS matrix error (status {status}): {text}"}, None
+            except ValueError as e:
+                return {"error": str(e)}, None
+            for trip in too_long:
+                far = [s for s in trip["stops"] if length([s]) > max_dist]
+                if far:
+                    listed = ", ".join(str(s) for s in far[:10])
+                    return {"error": f"destination(s) {listed} cannot be served within vehicle_capacity/maximum_distance"}, None
+                chunks = [[]]
+                for s in trip["stops"]:
+                    if chunks[-1] and length(chunks[-1] + [s]) > max_dist:
+                        chunks.append([])
+                    chunks[-1].append(s)
+                trip.update(stops=chunks[0], changed=True)
+                plan += [{"stops": c, "from": None, "changed": True} for c in chunks[1:]]
+
+    # ---------- directions for changed trips only ----------
+    if matrix_only:
+        feature = _matrix_feature(plan, points, known)
+    else:
+        feature = _directions_feature(plan, points, profile, saved_segs, saved_coords)
+        if "error" in feature:
+            return feature, None
+
+    p = feature["properties"]
+    p.update({
+        "source": source,
+        "destinations": destinations,
+        "optimized_order": [s for trip in plan for s in trip["stops"]],
+        "solver": "insertion",
+        "changes": {
+            "removed": sorted(remove),
+            "added": added,
+            "changed_trips": [t for t, trip in enumerate(plan) if trip["changed"]],
+            "matrix_pairs": len(needed),
+            "directions_fetched": p.pop("directions_fetched", 0),
+        },
+    })
+    vehicle_type = (driver.get("vehicle_type") or "car").lower().strip()
+    _annotate_common_props(feature, driver, vehicle_type, engine="backend:ors")
+
+    ids = saved_stops.get("destination_ids") or []
+    payload = {
+        "source_point": source,
+        "destination_points": destinations,
+        "driver_details": driver,
+        "meta": {"destination_ids": [ids[i] for i in keep if i < len(ids)] + [a.get("id") for a in add]
+                 if ids else []},
+    }
+    return feature, payload
+
+
+def _repair(plan, points, known, profile):
+    """2-opt + Or-opt inside each changed trip (bounded by size and REOPT_REPAIR_BUDGET_MS)."""
+    targets = [t for t in plan if t["changed"] and 3 <= len(t["stops"]) <= REOPT_REPAIR_MAX_STOPS]
+    if not targets:
+        return
+    try:
+        for trip in targets:   # one trip at a time, so each is a single dense ORS call
+            local = [0] + [s + 1 for s in trip["stops"]]
+            pairs = {(a, b) for a in local for b in local if a != b and (a, b) not in known}
+            known.update(fetch_pairs(points, pairs, profile))
+    except (requests.RequestException, ValueError) as e:
+        print("reoptimize repair skipped:", e)
+        return
+
+    deadline = time.perf_counter() + REOPT_REPAIR_BUDGET_MS / 1000.0
+    for trip in targets:
+        local = [0] + [s + 1 for s in trip["stops"]]
+        Dl = [[0.0 if a == b else (known[(a, b)][0] if np.isfinite(known[(a, b)][0]) else UNREACHABLE)
+               for b in local] for a in local]
+        trip["stops"] = [local[i] - 1 for i in improve(range(1, len(local)), Dl, deadline)]
+
+
+def _trip_entry(stops, segments):
+    return {
+        "stops": stops,
+        "distance": sum(float(s.get("distance") or 0) for s in segments),
+        "duration": sum(float(s.get("duration") or 0) for s in segments),
+    }
+
+
+def _matrix_feature(plan, points, known):
+    segments, trips = [], []
+    for trip in plan:
+        path = [0] + [s + 1 for s in trip["stops"]] + [0]
+        legs = [{"distance": known[(a, b)][0], "duration": known[(a, b)][1]} for a, b in zip(path, path[1:])]
+        segments += legs
+        trips.append(_trip_entry(trip["stops"], legs))
+    return {
+        "bbox": bbox_of(points),
+        "type": "Feature",
+        "geometry": None,
+        "properties": {
+            "segments": segments,
+            "trips": trips,
+            "summary": {
+                "distance": sum(t["distance"] for t in trips),
+                "duration": sum(t["duration"] for t in trips),
+                "trips": len(trips),
+            },
+        },
+    }
+
+
+def _directions_feature(plan, points, profile, saved_segs, saved_coords):
+    reuse = {}
+    for t, trip in enumerate(plan):
+        src = trip["from"]
+        if not trip["changed"] and saved_segs[src] is not None and saved_coords[src] is not None:
+            reuse[t] = (saved_segs[src], saved_coords[src])
+    fetch = [t for t in range(len(plan)) if t not in reuse]
+
+    try:
+        with stage("directions"):
+            fetched = fetch_directions_many(
+                [[points[i] for i in [0] + [s + 1 for s in plan[t]["stops"]] + [0]] for t in fetch], profile)
+    except requests.RequestException as e:
+        status = getattr(e.response, "status_code", "n/a")
+        text = getattr(e.response, "text", str(e))
+        return {"error": f"ORS directions error (status {status}): {text}"}
+    for t, f in zip(fetch, fetched):
+        reuse[t] = (f["properties"].get("segments", []), f["geometry"]["coordinates"])
+
+    segments, trips, lines = [], [], []
+    for t, trip in enumerate(plan):
+        segs, coords = reuse[t]
+        segments += segs
+        lines.append(coords)
+        entry = _trip_entry(trip["stops"], segs)
+        entry["vertices"] = len(coords)
+        trips.append(entry)
+
+    line = concat_coords(lines)
+    return {
+        "bbox": bbox_of(line),
+        "type": "Feature",
+        "geometry": {"type": "LineString", "coordinates": line},
+        "properties": {
+            "segments": segments,
+            "trips": trips,
+            "summary": {
+                "distance": sum(t["distance"] for t in trips),
+                "duration": sum(t["duration"] for t in trips),
+                "trips": len(trips),
+            },
+            "directions_fetched": len(fetch),
+        },
+    }
@@ -1,15 +1,30 @@
-from flask import Blueprint, request, jsonify
-from flask_sse import sse
-from .utils import optimize_route, simulate_route, format_sse_data
-import threading
+from flask import Blueprint, request, jsonify, current_app, make_response
+from .utils import optimize_route
+from .fleet import optimize_fleet, route_features, vehicle_payloads
+from .reoptimize import reoptimize, can_reoptimize
+from . import tracker
 import time
-import redis
-import os, requests
+import os, requests, uuid
+import json, base64, hashlib
 import datetime as dt
-from .ml import predict_eta_minutes
-
-ORS_API_KEY = os.getenv("ORS_API_KEY")
-REDIS_URL = os.getenv("REDIS_URL")
+from .ml import predict_eta_minutes, predict_eta_batch, predict_leg_etas
+from .ors import cache_stats
+from .jobs import get_job_queue, public_view, QueueFull
+from .simulator import get_simulator, TooManySimulations
+from .persistence import get_writer
+from .health import get_prober, HEALTH_PROBE_INTERVAL
+from .upstream import upstream
+from . import metrics
+from .coalesce import singleflight, request_key
+from .metrics import stage
+from .cache import TieredCache
+from .geometry import (shape_geometry, geometry_options, encode_geometry_for_storage, decode_geometry,
+                       POLYLINE_FORMATS)
+
+# route_results.geometry stays GeoJSON by default (the Laravel RouteResult model reads
+# it as such); PERSIST_GEOMETRY_FORMAT=polyline6 stores an encoded polyline instead,
+# lossless at ORS's 1e-6 and several times smaller
+PERSIST_GEOMETRY_FORMAT = os.getenv("PERSIST_GEOMETRY_FORMAT", "geojson")
 
 # --- imports & Supabase REST config ---
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -39,15 +54,51 @@ def request_route():
     #       vehicle_capacity: <int capacity value>,
     #       maximum_distance: <float distance in meters> 
     #   }
+    #   or, for a fleet: vehicles: [{vehicle_id, driver_name, vehicle_type, vehicle_capacity,
+    #       maximum_distance, start_point: {"lat", "lon"}}, ...] -> FeatureCollection, one
+    #       Feature per vehicle + properties.fleet totals (see fleet.py)
+    #   optional:
+    #   solver: "savings" | "greedy", time_budget_ms: <int ms spent improving trips>
+    #   mode: "matrix" (or geometry: false) -> order + summaries only, no polyline
+    #   (/optimize_route) use_ml_eta: true, ml_eta_per_stop: true -> ML ETA per segment/stop
+    #   geometry_format: "geojson" (default) | "polyline" | "polyline6"
+    #   simplify_tolerance: <metres> or simplify_zoom: <map zoom> -> Douglas-Peucker
     #}
+    # identical concurrent requests share one computation (see coalesce.py)
 
     data = request.get_json()
-    response = optimize_route(data)
+    return _coalesced("request_route", data, _request_route)
+
+def _optimize(payload: dict):
+    return optimize_fleet(payload) if payload.get("vehicles") else optimize_route(payload)
+
+def _shape_all(result: dict, payload: dict):
+    for feature in route_features(result):
+        err = shape_geometry(feature, payload)
+        if err:
+            return err
+    return None
+
+def _request_route(data):
+    response = _optimize(data)
 
     if not response:
-        return jsonify({"error": "no response acquired from the optimizer."}), 400
+        return {"error": "no response acquired from the optimizer."}, 400
+
+    if not response.get("error"):
+        with stage("shape"):
+            err = _shape_all(response, data)
+        if err:
+            return {"error": err}, 400
 
-    return jsonify(response), 200
+    return response, 200
+
+def _coalesced(scope, payload, fn):
+    (body, status), shared = singleflight.do(request_key(scope, payload), lambda: fn(payload))
+    resp = jsonify(body)
+    if shared:
+        resp.headers["X-Coalesced"] = "1"
+    return resp, status
 
 #this route is for simulation purposes only, remove once a gps tracking system has been properly set up
 @route_bp.route('/confirm_route', methods=['POST'])
@@ -61,15 +112,52 @@ def confirm_route():
     #       vehicle_capacity: <int capacity value>,
     #       maximum_distance: <float distance in meters> 
     #   }
+    #   or, for a fleet: vehicles: [{vehicle_id, driver_name, vehicle_type, vehicle_capacity,
+    #       maximum_distance, start_point: {"lat", "lon"}}, ...] -> FeatureCollection, one
+    #       Feature per vehicle + properties.fleet totals (see fleet.py)
     #   route_details: <the combined feature object provided by the request_route api>
+    #   optional: mode: "sse" (default, publish in-process) | "http", target: <update_tracker url>
     #}
 
-    data = request.get_json()
-    thread = threading.Thread(target=simulate_route, args=(data,))  # note the trailing comma
-    thread.daemon = True
-    thread.start()
-
-    return jsonify({"status": "route simulation initialized."}), 200
+    data = request.get_json(silent=True) or {}
+    body, status = _start_simulation(data)
+    if status >= 400:
+        return jsonify(body), status
+    return jsonify({"status": "route simulation initialized.", **body}), 200
+
+# --- simulations (one scheduler thread drives every simulated vehicle) ---
+@route_bp.route('/simulations', methods=['POST'])
+def create_simulation():
+    body, status = _start_simulation(request.get_json(silent=True) or {})
+    return jsonify(body), (201 if status == 200 else status)
+
+@route_bp.route('/simulations', methods=['GET'])
+def list_simulations():
+    sims = get_simulator(current_app._get_current_object()).list()
+    return jsonify({"count": len(sims), "items": sims}), 200
+
+@route_bp.route('/simulations/<sim_id>', methods=['GET'])
+def get_simulation(sim_id):
+    sim = get_simulator(current_app._get_current_object()).get(sim_id)
+    if not sim:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(sim), 200
+
+@route_bp.route('/simulations/<sim_id>', methods=['DELETE'])
+def stop_simulation(sim_id):
+    if not get_simulator(current_app._get_current_object()).stop(sim_id):
+        return jsonify({"error": "not found"}), 404
+    return jsonify({"status": "stopped", "simulation_id": sim_id}), 200
+
+def _start_simulation(data: dict):
+    mode = data.get("mode") or ("http" if data.get("target") else "sse")
+    try:
+        sim_id = get_simulator(current_app._get_current_object()).start(data, mode=mode, target=data.get("target"))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except TooManySimulations as e:
+        return {"error": str(e)}, 503
+    return {"simulation_id": sim_id, "mode": mode}, 200
 
 #this route is where the real-time reading of the driver's location will be published to the sse channel of the route
 @route_bp.route('/update_tracker', methods=['POST'])
@@ -80,72 +168,253 @@ def update_tracker():
     if not data:
         return jsonify({"error": "no data provided in the publish request."}), 400
 
-    route_id = data.get("route_id")
-    response = format_sse_data(data)
+    # body: the old full update (route = remaining coordinates), or a compact
+    # {route_id, index, position} once the route is known; see tracker.py
+    try:
+        events = tracker.publish_update(data)
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"bad tracker update: {e}"}), 400
+
+    return jsonify({"status": "published", "seq": events[-1][1].get("seq")}), 200
+
+# many positions for many route_ids in one request: [{...}, ...] or {"updates": [...]}.
+# Updates for the same route are coalesced to the latest and everything is
+# published over a single Redis pipeline.
+@route_bp.route('/update_tracker/batch', methods=['POST'])
+def update_tracker_batch():
+    data = request.get_json(silent=True)
+    updates = data.get("updates") if isinstance(data, dict) else data
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"error": "expected a non-empty list of tracker updates."}), 400
+    if len(updates) > tracker.TRACKER_BATCH_MAX:
+        return jsonify({"error": f"at most {tracker.TRACKER_BATCH_MAX} updates per batch."}), 413
+
+    try:
+        counts = tracker.publish_batch(updates)
+    except Exception as e:
+        return jsonify({"error": f"tracker publish failed: {e}"}), 503
+    return jsonify({"status": "published", **counts}), 200
 
-    sse.publish(response, channel=f'{route_id}')
-    return jsonify({"status": "published"}), 200
+@route_bp.route('/tracker/<route_id>/snapshot', methods=['GET'])
+def tracker_snapshot(route_id):
+    snap = tracker.snapshot(route_id)
+    if snap is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(snap), 200
 
 @route_bp.route('/optimize_route', methods=['POST'])
 def optimize_route_alias():
     payload = request.get_json(silent=True) or {}
-    result = optimize_route(payload)
+    return _coalesced("optimize_route", payload, run_optimize)
+
+def run_optimize(payload: dict):
+    """optimize -> optional ML ETA -> persist; returns (body, http status). Also used by jobs."""
+    _, _, err = geometry_options(payload)
+    if err:
+        return {"error": err}, 400
+    result = _optimize(payload)
     if isinstance(result, dict) and result.get("error"):
-        return jsonify(result), 400
+        return result, 400
+    return _finish_optimize(payload, result)
+
+def _finish_optimize(payload: dict, result: dict):
+    """Optional ML ETA -> persist -> shape for a fresh plan; returns (body, http status)."""
+    # a fleet plan is handled as one single-driver route per vehicle
+    routes = vehicle_payloads(payload, result)
 
     # --- Optional ML ETA when requested (compute BEFORE persisting) ---
     if payload.get("use_ml_eta"):
-        props = result.setdefault("properties", {}) or {}
-        summary = props.get("summary", {}) or {}
-        distance_m = float(summary.get("distance") or 0)
+        with stage("ml_eta"):
+            for sub, feature in routes:
+                _apply_ml_eta(sub, feature)
 
-        ctx = payload.get("context") or {}
-        weather = ctx.get("weather", "Sunny")
-        traffic = ctx.get("traffic", "Low")
-        driver_age = float((payload.get("driver_details") or {}).get("driver_age", 30))
+    # --- best-effort persistence (queued; request_id is known up front) ---
+    # saved is "queued" until the write-behind has stored it, True/False when written inline
+    try:
+        with stage("persist"):
+            for sub, feature in routes:
+                req_id, saved = persist_request_and_result(sub, feature)
+                if req_id:
+                    feature.setdefault("properties", {})["request_id"] = req_id
+                    feature["properties"]["saved"] = saved
+    except Exception as e:
+        print("Persist failed:", e)
 
+    # encoding/simplification only affects the response; storage keeps full resolution
+    with stage("shape"):
+        err = _shape_all(result, payload)
+    if err:
+        return {"error": err}, 400
+    return result, 200
+
+# --- incremental re-optimization of a saved route ---
+# body: {"add": [{"lat", "lon", "payload", "id"?}], "remove": [<destination index>], ...}
+# plus the usual options (mode, geometry_format, use_ml_eta, ...). The result is saved
+# as a new route (properties.reoptimized_from = the old id); see reoptimize.py.
+@route_bp.route("/routes/<req_id>/reoptimize", methods=["POST"])
+def reoptimize_route(req_id):
+    if not (REST and SUPABASE_SERVICE_KEY):
+        return jsonify({"error": "reoptimize disabled: SUPABASE not configured"}), 503
+    body = request.get_json(silent=True) or {}
+    _, _, err = geometry_options(body)
+    if err:
+        return jsonify({"error": err}), 400
+
+    try:
+        r = upstream("supabase").get(
+            f"{REST}/route_requests",
+            headers=HEADERS,
+            params={"select": "id,origin_id,stops,route_results(legs,geometry)", "id": f"eq.{req_id}", "limit": "1"},
+            timeout=20,
+        )
+        r.raise_for_status()
+        rows = r.json()
+    except requests.RequestException as e:
+        status = getattr(e.response, "status_code", "n/a")
+        text = getattr(e.response, "text", str(e))
+        return jsonify({"error": f"supabase fetch failed (status {status}): {text}"}), 500
+    if not rows:
+        return jsonify({"error": "not found"}), 404
+
+    saved = rows[0]
+    stops = saved.get("stops") or {}
+    if not can_reoptimize(stops):
+        return jsonify({"error": "route was saved without its source/trips; re-submit it to /optimize_route"}), 409
+    res = (saved.get("route_results") or [None])[0] or {}   # may still be queued in the write-behind
+
+    with stage("reoptimize"):
+        result, new_payload = reoptimize(stops, res.get("legs"), res.get("geometry"), body)
+    if result.get("error"):
+        return jsonify(result), 400
+    result["properties"]["reoptimized_from"] = req_id
+
+    options = {k: v for k, v in body.items() if k not in ("add", "remove")}
+    new_payload["meta"]["origin_id"] = saved.get("origin_id")
+    out, status = _finish_optimize({**options, **new_payload}, result)
+    return jsonify(out), status
+
+# --- async optimization jobs ---------------------------------------------------
+# POST /jobs takes the same body as /optimize_route and returns 202 + job id at once;
+# progress is pushed on /api/realtime_feed?channel=job:<id> (event type "job").
+@route_bp.route("/jobs", methods=["POST"])
+def create_job():
+    payload = request.get_json(silent=True)
+    if not payload or not payload.get("destination_points"):
+        return jsonify({"error": "no destination points specified."}), 400
+    try:
+        job_id = get_job_queue(current_app._get_current_object(), run_optimize).submit(payload)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"job_id": job_id, "status": "queued", "url": f"/api/jobs/{job_id}"}), 202
+
+@route_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = get_job_queue(current_app._get_current_object(), run_optimize).get(job_id)
+    if not job:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(public_view(job)), 200
+
+def _apply_ml_eta(payload: dict, result: dict):
+    """
+    Whole-route ML ETA; with ml_eta_per_stop also one ETA per segment (same model call),
+    written onto the segments (persisted as route_results.legs) and properties.stop_etas.
+    """
+    props = result.setdefault("properties", {}) or {}
+    summary = props.get("summary", {}) or {}
+    distance_m = float(summary.get("distance") or 0)
+
+    ctx = payload.get("context") or {}
+    weather = ctx.get("weather", "Sunny")
+    traffic = ctx.get("traffic", "Low")
+    driver_age = float((payload.get("driver_details") or {}).get("driver_age", 30))
+    pickup_time = dt.datetime.now()
+
+    segments = props.get("segments") or []
+    if not (payload.get("ml_eta_per_stop") and segments):
         eta_min, eta_iso = predict_eta_minutes(
             weather=weather,
             traffic=traffic,
             distance_m=distance_m,
-            pickup_time=dt.datetime.now(),
+            pickup_time=pickup_time,
             driver_age=driver_age,
         )
         if eta_min is not None:
             props["eta_minutes_ml"] = eta_min
             props["eta_completion_time_ml"] = eta_iso
+        return
 
-    # --- best-effort persistence (now includes engine + ML fields) ---
-    try:
-        req_id = persist_request_and_result(payload, result)
-        if req_id:
-            result.setdefault("properties", {})["request_id"] = req_id
-            result["properties"]["saved"] = True
-    except Exception as e:
-        print("Persist failed:", e)
-
-    return jsonify(result), 200
+    legs, total = predict_leg_etas(
+        segments, weather=weather, traffic=traffic, start_time=pickup_time,
+        driver_age=driver_age, total_distance_m=distance_m,
+    )
+    if legs is None:
+        return
+    props["eta_minutes_ml"], props["eta_completion_time_ml"] = total
+    for seg, (eta_min, arrival) in zip(segments, legs):
+        seg["eta_minutes_ml"] = eta_min
+        seg["arrival_time_ml"] = arrival
+
+    # map legs to stops: a trip over k stops has k+1 legs (the last one returns to origin)
+    trips = props.get("trips") or [{"stops": props.get("optimized_order") or [0], "returns": False}]
+    stop_etas, leg = [], 0
+    for t, trip in enumerate(trips):
+        for dest in trip["stops"]:
+            if leg >= len(legs):
+                break
+            stop_etas.append({
+                "destination_index": dest,
+                "trip": t,
+                "eta_minutes_ml": legs[leg][0],
+                "arrival_time_ml": legs[leg][1],
+            })
+            leg += 1
+        if trip.get("returns", True):
+            leg += 1
+    props["stop_etas"] = stop_etas
 
 @route_bp.route("/ping", methods=["GET"])
 def ping():
     return jsonify({"ok": True, "service": "route-optimizer"}), 200
 
+# hit/miss counters for the upstream caches (use these to size MATRIX_CACHE_SIZE etc.)
+# Prometheus scrape target (METRICS_ENABLED=0 disables collection and this endpoint)
+@route_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "metrics disabled"}), 404
+    resp = make_response(metrics.render(cache_stats()), 200)
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+@route_bp.route("/cache_stats", methods=["GET"])
+def cache_stats_endpoint():
+    return jsonify(cache_stats()), 200
+
 # --- helper to persist to Supabase via PostgREST ---
 def persist_request_and_result(payload: dict, feature: dict):
+    """(request_id, saved) with saved = "queued" or, when written inline, True/False; (None, False) if disabled."""
     if not (SUPABASE_URL and SUPABASE_SERVICE_KEY):
-        return None
+        return None, False
 
     meta = payload.get("meta") or {}
     driver = payload.get("driver_details") or {}
     engine = "ml" if payload.get("use_ml_eta") else "default"
 
+    # source, driver and trip split are kept so /routes/<id>/reoptimize can rebuild the plan
     stops = {
         "destination_ids": meta.get("destination_ids") or [],
         "destination_points": payload.get("destination_points") or [],
+        "source_point": payload.get("source_point"),
+        "driver_details": driver,
+        "trips": ((feature or {}).get("properties") or {}).get("trips") or [],
     }
 
+    # ids are generated here so the response does not wait for the insert round trip
+    request_id = str(uuid.uuid4())
+
     # --- route_requests row ---
     req_row = {
+        "id": request_id,
         "origin_id": meta.get("origin_id"),
         "stops": stops,                        # jsonb NOT NULL
         "status": "completed",
@@ -153,11 +422,6 @@ def persist_request_and_result(payload: dict, feature: dict):
         "vehicle_id": driver.get("driver_name"),
         "driver_age": driver.get("driver_age"),
     }
-    r = requests.post(f"{REST}/route_requests", headers=HEADERS, json=req_row, timeout=20)
-    if not r.ok:
-        print("route_requests insert failed:", r.status_code, r.text)
-        r.raise_for_status()
-    request_id = r.json()[0]["id"]
 
     props   = (feature or {}).get("properties", {}) or {}
     summary = props.get("summary", {}) or {}
@@ -170,18 +434,61 @@ def persist_request_and_result(payload: dict, feature: dict):
         "total_duration": float(summary.get("duration") or 0),
         "optimized_order": props.get("optimized_order") or [],
         "legs": legs,
-        "geometry": feature.get("geometry") or None,
+        "geometry": encode_geometry_for_storage(feature.get("geometry") or None, PERSIST_GEOMETRY_FORMAT),
         "eta_minutes_ml": props.get("eta_minutes_ml"),
         "eta_completion_time_ml": props.get("eta_completion_time_ml"),
     }
-    r2 = requests.post(f"{REST}/route_results", headers=HEADERS, json=result_row, timeout=20)
-    if not r2.ok:
-        print("route_results insert failed:", r2.status_code, r2.text)
-        r2.raise_for_status()
 
-    return request_id
+    # write-behind: batched bulk inserts on a background thread (see persistence.py)
+    saved = get_writer(REST, HEADERS).submit(req_row, result_row)
+    _history_pages.bump()
+    return request_id, saved
 
 # --- route history ---
+# Keyset pagination over (request_time desc, id desc): pass ?cursor=<next_cursor>.
+# ?fields=a,b,c trims each item (and the PostgREST select) to those keys.
+# Both endpoints send an ETag and answer If-None-Match with 304.
+
+HISTORY_ITEM_SOURCES = {   # item key -> (route_requests column | None, route_results column | None)
+    "request_id": ("id", None),
+    "created_at": ("request_time", None),
+    "origin_id": ("origin_id", None),
+    "dest_count": ("stops", None),
+    "total_distance": (None, "total_distance"),
+    "total_duration": (None, "total_duration"),
+    "optimized": (None, "optimized_order"),
+    "engine": ("engine", None),
+    "vehicle_id": ("vehicle_id", None),
+    "eta_minutes_ml": (None, "eta_minutes_ml"),
+    "eta_completion_time_ml": (None, "eta_completion_time_ml"),
+}
+
+# list pages are polled, so a short TTL is enough; details never change until deleted.
+# Page keys carry the cache's shared generation: a save or delete in any worker bumps it
+_history_pages = TieredCache("history:page", maxsize=256, ttl=float(os.getenv("HISTORY_LIST_TTL", "5")))
+_history_details = TieredCache("history:detail", maxsize=int(os.getenv("HISTORY_CACHE_SIZE", "500")),
+                               ttl=float(os.getenv("HISTORY_CACHE_TTL", "600")))
+
+def _etag_response(body: dict, etag: str):
+    if request.if_none_match.contains(etag):
+        resp = make_response("", 304)
+    else:
+        resp = make_response(jsonify(body), 200)
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"   # always revalidate, cheap with the ETag
+    return resp
+
+def _body_etag(body: dict):
+    return hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+def _encode_cursor(request_time, rid):
+    return base64.urlsafe_b64encode(json.dumps([request_time, rid]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    request_time, rid = json.loads(raw)
+    return str(request_time), str(rid)
+
 @route_bp.route("/history", methods=["GET"])
 def history():
     try:
@@ -190,17 +497,38 @@ def history():
         limit = 20
     limit = max(1, min(limit, 100))
 
+    fields = [f for f in (request.args.get("fields") or "").split(",") if f]
+    unknown = [f for f in fields if f not in HISTORY_ITEM_SOURCES]
+    if unknown:
+        return jsonify({"error": f"unknown fields: {', '.join(unknown)}"}), 400
+    fields = fields or list(HISTORY_ITEM_SOURCES)
+
+    cursor = request.args.get("cursor")
+    page_key = f"{_history_pages.generation()}|{limit}|{','.join(fields)}|{cursor or ''}"
+    cached = _history_pages.get(page_key)
+    if cached is not None:
+        return _etag_response(cached["body"], cached["etag"])
+
+    req_cols = {"id", "request_time"} | {HISTORY_ITEM_SOURCES[f][0] for f in fields if HISTORY_ITEM_SOURCES[f][0]}
+    res_cols = [HISTORY_ITEM_SOURCES[f][1] for f in fields if HISTORY_ITEM_SOURCES[f][1]]
+    select = ",".join(sorted(req_cols))
+    if res_cols:   # only pay for the embedded join when a result field was asked for
+        select += f",route_results({','.join(sorted(set(res_cols)))})"
+
     params = {
-        "select": (
-            "id,request_time,origin_id,stops,engine,vehicle_id,driver_age,"
-            "route_results(id,total_distance,total_duration,optimized_order,created_at,eta_minutes_ml,eta_completion_time_ml)"
-        ),
-        "order": "request_time.desc",
-        "limit": str(limit),
+        "select": select,
+        "order": "request_time.desc,id.desc",
+        "limit": str(limit + 1),   # one extra row tells us whether there is a next page
     }
+    if cursor:
+        try:
+            after_time, after_id = _decode_cursor(cursor)
+        except (ValueError, TypeError):
+            return jsonify({"error": "invalid cursor"}), 400
+        params["or"] = f'(request_time.lt."{after_time}",and(request_time.eq."{after_time}",id.lt.{after_id}))'
 
     try:
-        r = requests.get(f"{REST}/route_requests", headers=HEADERS, params=params, timeout=20)
+        r = upstream("supabase").get(f"{REST}/route_requests", headers=HEADERS, params=params, timeout=20)
         r.raise_for_status()
         rows = r.json()
     except requests.RequestException as e:
@@ -208,13 +536,16 @@ def history():
         text = getattr(e.response, "text", str(e))
         return jsonify({"error": f"supabase fetch failed (status {status}): {text}"}), 500
 
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
     items = []
     for rr in rows:
         res = rr.get("route_results") or []
         first = res[0] if res else {}
         stops = rr.get("stops") or {}
         dest_ids = stops.get("destination_ids") or []
-        items.append({
+        item = {
             "request_id": rr["id"],
             "created_at": rr.get("request_time"),
             "origin_id": rr.get("origin_id"),
@@ -226,9 +557,14 @@ def history():
             "vehicle_id": rr.get("vehicle_id"),
             "eta_minutes_ml": first.get("eta_minutes_ml"),
             "eta_completion_time_ml": first.get("eta_completion_time_ml"),
-        })
+        }
+        items.append({k: item[k] for k in fields})
 
-    return jsonify({"items": items}), 200
+    next_cursor = _encode_cursor(rows[-1].get("request_time"), rows[-1]["id"]) if (has_more and rows) else None
+    body = {"items": items, "next_cursor": next_cursor}
+    etag = _body_etag(body)
+    _history_pages.set(page_key, {"body": body, "etag": etag})
+    return _etag_response(body, etag)
 
 # --- History detail ----------------------------------------------------------
 @route_bp.route("/history/<req_id>", methods=["GET"])
@@ -236,8 +572,14 @@ def history_detail(req_id):
     if not (REST and SUPABASE_SERVICE_KEY):
         return jsonify({"error": "history disabled: SUPABASE not configured"}), 503
 
+    # read-through cache: a saved route never changes until it is deleted
+    fmt = (request.args.get("geometry_format") or "geojson").lower()
+    cached = _history_details.get(req_id)
+    if cached is not None:
+        return _detail_response(cached["body"], cached["etag"], fmt)
+
     try:
-        r = requests.get(
+        r = upstream("supabase").get(
             f"{REST}/route_requests",
             headers=HEADERS,
             params={
@@ -259,7 +601,7 @@ def history_detail(req_id):
         results = req.get("route_results") or []
         res = results[0] if results else None
 
-        return jsonify({
+        body = {
             "request": {
                 "id": req["id"],
                 "origin_id": req.get("origin_id"),
@@ -271,76 +613,36 @@ def history_detail(req_id):
                 "driver_age": req.get("driver_age"),
             },
             "result": res
-        }), 200
+        }
 
     except requests.RequestException as e:
         status = getattr(e.response, "status_code", "n/a")
         text = getattr(e.response, "text", str(e))
         return jsonify({"error": f"supabase fetch failed (status {status}): {text}"}), 500
 
-# ── tiny helpers ────────────────────────────────────────────────────────────────
-def _check_redis():
-    if not REDIS_URL:
-        return {"status": "skipped", "latency_ms": 0, "reason": "REDIS_URL not set"}
-    t0 = time.time()
-    try:
-        # NOTE: TLS is inferred from rediss:// — do not pass ssl= for redis-py 6.x
-        r = redis.Redis.from_url(
-            REDIS_URL,
-            socket_timeout=2,
-            socket_connect_timeout=2,
-        )
-        r.ping()
-        return {"status": "ok", "latency_ms": int((time.time() - t0) * 1000)}
-    except Exception as e:
-        return {"status": "error", "latency_ms": int((time.time() - t0) * 1000), "error": str(e)[:200]}
-
-def _check_routing_engine():
-    """Treat any HTTP response from ORS as reachable; only network errors are 'error'."""
-    t0 = time.time()
-    try:
-        head = requests.head("https://api.openrouteservice.org", timeout=2)
-        # If you have a key, make a lightweight GET to confirm authenticated path reachability.
-        code = head.status_code
-        status = "ok" if 200 <= code < 400 else "degraded"
-        if ORS_API_KEY:
-            try:
-                r = requests.get(
-                    "https://api.openrouteservice.org/health",
-                    headers={"Authorization": ORS_API_KEY},
-                    timeout=2,
-                )
-                # 2xx => ok; 401/403/404 => degraded but reachable
-                status = "ok" if 200 <= r.status_code < 300 else "degraded"
-                code = r.status_code
-            except Exception:
-                # keep prior reachability result
-                pass
-        return {
-            "status": status,
-            "latency_ms": int((time.time() - t0) * 1000),
-            "engine": "ors",
-            "code": code,
-        }
-    except Exception as e:
-        return {"status": "error", "latency_ms": int((time.time() - t0) * 1000), "engine": "ors", "error": str(e)[:200]}
-
-def _check_supabase_rest():
-    if not (REST and SUPABASE_SERVICE_KEY):
-        return {"status": "skipped", "latency_ms": 0, "reason": "SUPABASE not configured"}
-    t0 = time.time()
-    try:
-        r = requests.get(f"{REST}/route_requests", headers=HEADERS, params={"select": "id", "limit": "1"}, timeout=3)
-        return {"status": "ok" if 200 <= r.status_code < 300 else "degraded",
-                "latency_ms": int((time.time() - t0) * 1000), "code": r.status_code}
-    except Exception as e:
-        return {"status": "error", "latency_ms": int((time.time() - t0) * 1000), "error": str(e)[:200]}
-
+    etag = _body_etag(body)
+    if res is not None:   # write-behind may not have stored the result yet; don't cache a half row
+        _history_details.set(req_id, {"body": body, "etag": etag})
+    return _detail_response(body, etag, fmt)
+
+def _detail_response(body: dict, etag: str, fmt: str):
+    """Stored geometry may be an encoded polyline; hand it out in the format asked for."""
+    res = body.get("result") or {}
+    geom = res.get("geometry")
+    if geom and (geom.get("encoding") or "geojson") != fmt:
+        full = decode_geometry(geom)
+        if fmt in POLYLINE_FORMATS:
+            full = encode_geometry_for_storage(full, fmt)
+        body = {**body, "result": {**res, "geometry": full}}
+    return _etag_response(body, f"{etag}-{fmt}")
+
+# ── health ──────────────────────────────────────────────────────────────────────
+# Served from the background prober's cache (see health.py); ?fresh=1 re-probes now.
 @route_bp.route("/health", methods=["GET"])
 def health():
-    redis_res = _check_redis()
-    engine_res = _check_routing_engine()
-    db_res = _check_supabase_rest()
+    fresh = request.args.get("fresh", "").lower() in ("1", "true", "yes")
+    checks, checked_at = get_prober(REST, HEADERS).results(fresh=fresh)
+    redis_res, engine_res, db_res = checks["redis"], checks["engine"], checks["supabase"]
 
     parts = (redis_res["status"], engine_res["status"], db_res["status"])
     if any(s == "error" for s in parts):
@@ -350,6 +652,7 @@ def health():
     else:
         overall = "ok"
 
+    age_s = round(time.time() - checked_at, 3)
     payload = {
         "backend": True,
         "checks": {"engine": engine_res, "redis": redis_res, "supabase": db_res},
@@ -358,6 +661,10 @@ def health():
         "redis": redis_res["status"] == "ok",
         "tiles": True,
         "status": overall,
+        "checked_at": dt.datetime.fromtimestamp(checked_at, dt.timezone.utc).isoformat(),
+        "age_s": age_s,
+        "stale": age_s > 2 * HEALTH_PROBE_INTERVAL,
+        "probe_interval_s": HEALTH_PROBE_INTERVAL,
         "version": os.getenv("RENDER_GIT_COMMIT") or os.getenv("GIT_COMMIT_SHA"),
     }
     return jsonify(payload), 200
@@ -382,6 +689,35 @@ def predict_eta_endpoint():
         return jsonify({"error": "model unavailable"}), 503
     return jsonify({"eta_minutes_ml": eta_min, "eta_completion_time_ml": eta_iso}), 200
 
+# POST /predict_eta_batch  {"records": [{weather, traffic, distance_m | summary, pickup_time, driver_age}, ...]}
+# scores every record with a single model call
+@route_bp.route("/predict_eta_batch", methods=["POST"])
+def predict_eta_batch_endpoint():
+    body = request.get_json(silent=True) or {}
+    records = body.get("records")
+    if not isinstance(records, list) or not records:
+        return jsonify({"error": "records must be a non-empty list"}), 400
+
+    now_iso = dt.datetime.now().isoformat()
+    try:
+        rows = [{
+            "weather": r.get("weather", "Sunny"),
+            "traffic": r.get("traffic", "Low"),
+            "distance_m": float(r.get("distance_m") if r.get("distance_m") is not None
+                                else (r.get("summary") or {}).get("distance") or 0),
+            "pickup_time": r.get("pickup_time") or now_iso,
+            "driver_age": float(r.get("driver_age", 30)),
+        } for r in records]
+        preds = predict_eta_batch(rows)
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({"error": f"invalid record: {e}"}), 400
+
+    if preds is None:
+        return jsonify({"error": "model unavailable"}), 503
+    return jsonify({"items": [
+        {"eta_minutes_ml": m, "eta_completion_time_ml": iso} for m, iso in preds
+    ]}), 200
+
 # DELETE /history/<request_id>  — remove one saved route (FK cascade to route_results)
 @route_bp.route("/history/<req_id>", methods=["DELETE"])
 def delete_history(req_id):
@@ -391,7 +727,7 @@ def delete_history(req_id):
     try:
         headers = dict(HEADERS)       # avoid asking PostgREST to return the deleted rows
         headers.pop("Prefer", None)
-        r = requests.delete(
+        r = upstream("supabase").delete(
             f"{REST}/route_requests",
             headers=headers,
             params={"id": f"eq.{req_id}"},
@@ -399,6 +735,8 @@ def delete_history(req_id):
         )
         if r.status_code not in (200, 204):
             return jsonify({"error": f"delete failed: {r.status_code} {r.text}"}), 500
+        _history_details.delete(req_id)
+        _history_pages.bump()
         return ("", 204)
     except requests.RequestException as e:
         status = getattr(e.response, "status_code", "n/a")
@@ -0,0 +1,236 @@
+import os, time, uuid, heapq, queue, random, threading
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+from .geometry import as_coords
+from .utils import _post_update
+from . import tracker
+
+# Vehicle simulator for demos and load tests.
+# One scheduler thread keeps a heap of (next tick time, simulation id) and advances
+# whichever vehicle is due, so thousands of simulated vehicles cost one thread.
+# mode "sse" (default) publishes in-process through tracker.py (one snapshot, then deltas):
+# the scheduler hands every tick that is due to one publisher thread, which sends all
+# it has collected as a single tracker.publish_batch (one Redis pipeline), so a slow
+# Redis round trip delays nobody's schedule and a backlog just makes the next batch bigger.
+# mode "http" POSTs to a remote /api/update_tracker (the old behaviour) from a small
+# worker pool so slow targets never stall the scheduler.
+# Ticks after the first carry only an index, so a vehicle whose update failed to go out
+# or was rejected sends its full route again (plus its current index) on its next tick;
+# those misses show up as failed_updates on the simulation.
+# Simulations live in the process that started them.
+
+SIM_TICK_MIN_S = float(os.getenv("SIM_TICK_MIN_S", "2.0"))
+SIM_TICK_MAX_S = float(os.getenv("SIM_TICK_MAX_S", "5.0"))
+SIM_MAX_ACTIVE = int(os.getenv("SIM_MAX_ACTIVE", "5000"))
+SIM_HTTP_WORKERS = int(os.getenv("SIM_HTTP_WORKERS", "8"))
+
+
+class TooManySimulations(Exception):
+    pass
+
+
+class Simulator:
+    def __init__(self, app):
+        self.app = app
+        self._sims = {}
+        self._heap = []
+        self._seq = 0   # tie-breaker so the heap never compares ids of equal due times
+        self._cv = threading.Condition()
+        self._thread = None
+        self._http = None
+        self._outbox = queue.Queue()   # lists of tracker updates for the sse publisher
+        self._publisher = None
+
+    def start(self, data, mode="sse", target=None):
+        """
+        Schedule a vehicle along data['route_details'] (a route Feature), first tick now.
+        Returns the simulation id. Raises ValueError on a route without geometry or a
+        driver without driver_name (the tracker route_id).
+        """
+        route = data.get("route_details") or {}
+        driver = data.get("driver_details") or {}
+        coords = as_coords((route.get("geometry") or {}).get("coordinates") or [])
+        if not len(coords):
+            raise ValueError("route_details has no geometry to simulate.")
+        if mode not in ("sse", "http"):
+            raise ValueError("mode must be 'sse' or 'http'.")
+        if not driver.get("driver_name"):
+            raise ValueError("driver_details.driver_name is required (it is the tracker route_id).")
+
+        props = route.get("properties") or {}
+        summary = props.get("summary") or {}
+        sim = {
+            "id": str(uuid.uuid4()),
+            "route_id": driver.get("driver_name"),
+            "driver_name": driver.get("driver_name"),
+            "vehicle_type": driver.get("vehicle_type"),
+            "mode": mode,
+            "target": target,
+            "coords": coords,
+            "index": 0,
+            "send_route": True,    # the tracker does not know this route (yet, or any more)
+            "failed_updates": 0,
+            "destinations": props.get("destinations") or [],
+            "duration": summary.get("duration"),
+            "distance": summary.get("distance"),
+            "trips": summary.get("trips", 1),
+            "pickup_time": dt.datetime.now().isoformat(),
+            "started_at": time.time(),
+        }
+        with self._cv:
+            if len(self._sims) >= SIM_MAX_ACTIVE:
+                raise TooManySimulations("too many active simulations")
+            self._sims[sim["id"]] = sim
+            self._push(sim["id"], time.monotonic())
+            self._ensure_thread()
+        return sim["id"]
+
+    def stop(self, sim_id):
+        """Forget a simulation; its pending heap entry is skipped when it comes due."""
+        with self._cv:
+            return self._sims.pop(sim_id, None) is not None
+
+    def list(self):
+        with self._cv:
+            return [self._view(s) for s in self._sims.values()]
+
+    def get(self, sim_id):
+        with self._cv:
+            sim = self._sims.get(sim_id)
+            return self._view(sim) if sim else None
+
+    # ---------- internals ----------
+
+    def _view(self, sim):
+        return {
+            "id": sim["id"],
+            "route_id": sim["route_id"],
+            "mode": sim["mode"],
+            "target": sim["target"],
+            "position": sim["index"],
+            "vertices": len(sim["coords"]),
+            "failed_updates": sim["failed_updates"],
+            "pickup_time": sim["pickup_time"],
+            "started_at": sim["started_at"],
+        }
+
+    def _push(self, sim_id, due):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, sim_id))
+        self._cv.notify()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="vehicle-simulator", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            ticks = []
+            with self._cv:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cv.wait(self._heap[0][0] - now if self._heap else None)
+                # everything that is due goes out together
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, sim_id = heapq.heappop(self._heap)
+                    sim = self._sims.get(sim_id)
+                    if sim is None:
+                        continue   # stopped
+                    ticks.append((sim, self._tracker_updates(sim)))
+                    sim["index"] += 1
+                    if sim["index"] < len(sim["coords"]):
+                        self._push(sim_id, now + random.uniform(SIM_TICK_MIN_S, SIM_TICK_MAX_S))
+                    else:
+                        self._sims.pop(sim_id, None)
+            self._deliver(ticks)
+
+    def _tracker_updates(self, sim):
+        """
+        Bodies for /api/update_tracker, sent in order: index + position, preceded by the
+        full route on the first tick and after a failure (indexes stay relative to it).
+        """
+        position = {
+            "route_id": sim["route_id"],
+            "index": sim["index"],
+            "position": sim["coords"][sim["index"]].tolist(),
+        }
+        if not sim["send_route"]:
+            return [position]
+        sim["send_route"] = False   # until a failure says otherwise
+        full = {
+            "route_id": sim["route_id"],
+            "route": sim["coords"].tolist(),
+            "destinations": sim["destinations"],
+            "driver_name": sim["driver_name"],
+            "vehicle_type": sim["vehicle_type"],
+            "duration": sim["duration"],
+            "distance": sim["distance"],
+            "trips": sim["trips"],
+            "pickup_time": sim["pickup_time"],
+        }
+        return [full, position] if sim["index"] else [full]
+
+    def _deliver(self, ticks):
+        """Hand ticks to the http pool / the sse publisher; never blocks the scheduler."""
+        updates = []
+        for sim, sim_updates in ticks:
+            if sim["mode"] == "http":
+                if self._http is None:
+                    self._http = ThreadPoolExecutor(max_workers=SIM_HTTP_WORKERS, thread_name_prefix="sim-http")
+                self._http.submit(self._post, sim, sim_updates)
+            else:
+                updates += [(sim, u) for u in sim_updates]
+        if updates:
+            self._outbox.put(updates)
+            if self._publisher is None or not self._publisher.is_alive():
+                self._publisher = threading.Thread(target=self._publish_loop, name="simulator-publisher", daemon=True)
+                self._publisher.start()
+
+    def _post(self, sim, updates):
+        for update in updates:
+            if not _post_update(update, url=sim["target"]):
+                self._failed([sim])
+                return
+
+    def _failed(self, sims):
+        """The tracker missed these sims' updates: resend the full route on their next tick."""
+        with self._cv:
+            for sim in sims:
+                sim["send_route"] = True
+                sim["failed_updates"] += 1
+
+    def _publish_loop(self):
+        while True:
+            batch = self._outbox.get()
+            while True:   # drain the backlog into the same pipeline
+                try:
+                    batch += self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    counts = tracker.publish_batch([u for _, u in batch], merge=False)   # every vertex, in order
+            except Exception as e:
+                print(f"simulator publish failed ({len(batch)} updates):", e)
+                self._failed({id(sim): sim for sim, _ in batch}.values())
+                continue
+            if counts["rejected"]:
+                print("simulator updates rejected:", counts["errors"][:3])
+                rejected = {str(err.get("route_id")) for err in counts["errors"]}
+                self._failed({id(sim): sim for sim, u in batch if str(u["route_id"]) in rejected}.values())
+
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+
+def get_simulator(app):
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None:
+            _simulator = Simulator(app)
+    return _simulator
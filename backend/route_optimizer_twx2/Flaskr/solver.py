@@ -0,0 +1,295 @@
+import os, time
+import numpy as np
+
+# Capacity/max-distance constrained routing over a distance matrix.
+# Node 0 is the depot (origin); every trip starts and ends there.
+# A trip is a list of node indexes like [0, 4, 2, 0].
+
+ENGINES = ("savings", "greedy")
+DEFAULT_ENGINE = os.getenv("SOLVER_ENGINE", "savings")
+DEFAULT_TIME_BUDGET_MS = int(os.getenv("SOLVER_TIME_BUDGET_MS", "250"))
+MAX_TIME_BUDGET_MS = int(os.getenv("SOLVER_MAX_TIME_BUDGET_MS", "5000"))
+
+UNREACHABLE = 1e12  # stands in for the null ORS returns for pairs it cannot route
+_EPS = 1e-6
+
+
+class Unservable(ValueError):
+    """Stops that no trip can serve; .stops are destination indexes (node - 1)."""
+
+    def __init__(self, message, stops=()):
+        super().__init__(message)
+        self.stops = list(stops)
+
+    def __reduce__(self):   # keep .stops when raised in a fleet solver process
+        return Unservable, (str(self), self.stops)
+
+
+def solve(distance_matrix, demands, capacity=9e12, max_distance=9e12, engine=None, time_budget_ms=None):
+    """
+    Returns (trips, engine_used). Raises Unservable (a ValueError) when a stop cannot
+    be served even on its own (payload > capacity or out-and-back > maximum_distance).
+    'savings' = Clarke-Wright construction + local search within time_budget_ms;
+    'greedy' = the original nearest-first loop. Savings falls back to greedy on failure.
+    """
+    D = np.asarray(distance_matrix, dtype=float)
+    D = np.where(np.isfinite(D), D, UNREACHABLE)
+    q = np.asarray(demands, dtype=float)
+    cap, max_dist = float(capacity), float(max_distance)
+
+    _check_feasible(D, q, cap, max_dist)
+    if D.shape[0] <= 1:
+        return [], "none"
+
+    engine = (engine or DEFAULT_ENGINE).lower()
+    if engine not in ENGINES:
+        raise ValueError(f"unknown solver '{engine}' (expected one of {', '.join(ENGINES)})")
+
+    if engine == "savings":
+        budget = DEFAULT_TIME_BUDGET_MS if time_budget_ms is None else float(time_budget_ms)
+        budget = max(0.0, min(budget, MAX_TIME_BUDGET_MS))
+        deadline = time.perf_counter() + budget / 1000.0
+        try:
+            routes = _savings(D, q, cap, max_dist)
+            routes = _local_search(D, q, cap, max_dist, routes, deadline)
+            return [[0] + r + [0] for r in routes], "savings"
+        except Exception as e:
+            print("savings solver failed, falling back to greedy:", e)
+
+    return greedy(D, q, cap, max_dist), "greedy"
+
+
+def trip_distance(distance_matrix, trip):
+    D = distance_matrix
+    return float(sum(D[a][b] for a, b in zip(trip, trip[1:])))
+
+
+def _check_feasible(D, q, cap, max_dist):
+    n = D.shape[0]
+    if n <= 1:
+        return
+    stops = np.arange(1, n)
+    bad = stops[(q[1:] > cap) | (D[0, 1:] + D[1:, 0] > max_dist)]
+    if bad.size:
+        listed = ", ".join(str(int(i) - 1) for i in bad[:10])
+        raise Unservable(
+            f"destination(s) {listed} cannot be served within vehicle_capacity/maximum_distance",
+            [int(i) - 1 for i in bad],
+        )
+
+
+# ---------- greedy (original engine, kept as fallback) ----------
+
+def greedy(D, q, cap, max_dist):
+    """Nearest-to-origin-first packing, one trip at a time (the pre-solver behaviour)."""
+    D = D.tolist() if isinstance(D, np.ndarray) else D
+    trips = []
+    unvisited = list(range(1, len(D)))
+
+    while unvisited:
+        trip = [0]
+        load = 0.0
+        trip_dist = 0.0
+        current = 0
+
+        for idx in sorted(unvisited, key=lambda i: D[current][i]):
+            demand = float(q[idx])
+            # distance added if we go current->idx and then return to origin
+            added_if_accept = D[current][idx] + D[idx][0]
+            if (load + demand) <= cap and (trip_dist + added_if_accept) <= max_dist:
+                trip.append(idx)
+                load += demand
+                trip_dist += D[current][idx]
+                current = idx
+
+        if len(trip) == 1:  # nothing fits; _check_feasible should have caught this
+            raise ValueError("greedy solver could not place remaining stops")
+        trip.append(0)
+        trips.append(trip)
+        visited = set(trip[1:-1])
+        unvisited = [i for i in unvisited if i not in visited]
+
+    return trips
+
+
+# ---------- Clarke-Wright savings ----------
+
+def _savings(D, q, cap, max_dist):
+    n = D.shape[0]
+    # saving of serving j right after i instead of returning to the depot in between
+    S = D[1:, 0][:, None] + D[0, 1:][None, :] - D[1:, 1:]
+    np.fill_diagonal(S, -np.inf)
+    flat = np.flatnonzero(S > _EPS)
+    order = flat[np.argsort(-S.ravel()[flat], kind="stable")]
+
+    route_of = list(range(n))          # route id per node (node i starts alone in route i)
+    routes = {i: [i] for i in range(1, n)}
+    load = {i: float(q[i]) for i in range(1, n)}
+    length = {i: float(D[0, i] + D[i, 0]) for i in range(1, n)}
+    Sf = S.ravel()
+
+    for k in order:
+        i, j = divmod(int(k), n - 1)
+        i += 1
+        j += 1
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj:
+            continue
+        a, b = routes[ri], routes[rj]
+        if a[-1] != i or b[0] != j:
+            continue
+        if load[ri] + load[rj] > cap:
+            continue
+        new_len = length[ri] + length[rj] - Sf[k]
+        if new_len > max_dist:
+            continue
+        a.extend(b)
+        for node in b:
+            route_of[node] = ri
+        load[ri] += load.pop(rj)
+        length[ri] = new_len
+        length.pop(rj)
+        routes.pop(rj)
+
+    return list(routes.values())
+
+
+# ---------- local search (2-opt, Or-opt, relocate) ----------
+
+def _route_cost(Dl, r):
+    c = Dl[0][r[0]] + Dl[r[-1]][0]
+    for a, b in zip(r, r[1:]):
+        c += Dl[a][b]
+    return c
+
+
+def _local_search(D, q, cap, max_dist, routes, deadline):
+    Dl = D.tolist()
+    routes = [list(r) for r in routes if r]
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for r in routes:
+            if time.perf_counter() >= deadline:
+                return routes
+            improved |= _two_opt(Dl, r, deadline)
+            improved |= _or_opt(Dl, r, deadline)
+        if time.perf_counter() < deadline:
+            improved |= _relocate(D, Dl, q, cap, max_dist, routes, deadline)
+            routes = [r for r in routes if r]
+    return routes
+
+
+def improve(trip, D, deadline=None):
+    """
+    2-opt then Or-opt inside one trip. trip is its stops as node indexes into D (the
+    depot is node 0 and is not listed); returns them reordered, never longer.
+    deadline is a time.perf_counter() value; None runs to a local optimum.
+    """
+    Dl = D.tolist() if isinstance(D, np.ndarray) else D
+    r = list(trip)
+    deadline = float("inf") if deadline is None else deadline
+    _two_opt(Dl, r, deadline)
+    _or_opt(Dl, r, deadline)
+    return r
+
+
+def _two_opt(Dl, r, deadline):
+    """Reverse r[i..j] when it shortens the tour (exact for asymmetric matrices)."""
+    improved_any = False
+    improved = len(r) >= 2
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        path = [0] + r + [0]
+        m = len(path)
+        fwd = [0.0] * m   # fwd[k]: cost of path[0..k] travelled forwards
+        bwd = [0.0] * m   # bwd[k]: same edges travelled backwards
+        for k in range(1, m):
+            fwd[k] = fwd[k - 1] + Dl[path[k - 1]][path[k]]
+            bwd[k] = bwd[k - 1] + Dl[path[k]][path[k - 1]]
+        for i in range(1, m - 2):
+            for j in range(i + 1, m - 1):
+                before = Dl[path[i - 1]][path[i]] + (fwd[j] - fwd[i]) + Dl[path[j]][path[j + 1]]
+                after = Dl[path[i - 1]][path[j]] + (bwd[j] - bwd[i]) + Dl[path[i]][path[j + 1]]
+                if after < before - _EPS:
+                    r[i - 1:j] = reversed(r[i - 1:j])
+                    improved = improved_any = True
+                    break
+            if improved:
+                break
+    return improved_any
+
+
+def _or_opt(Dl, r, deadline):
+    """Move a chain of 1-3 consecutive stops elsewhere in the same trip."""
+    improved_any = False
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        n = len(r)
+        for seg_len in (1, 2, 3):
+            for s in range(0, n - seg_len + 1):
+                path = [0] + r + [0]
+                first, last = path[s + 1], path[s + seg_len]
+                prev, nxt = path[s], path[s + seg_len + 1]
+                gain = Dl[prev][first] + Dl[last][nxt] - Dl[prev][nxt]
+                rest = r[:s] + r[s + seg_len:]
+                rp = [0] + rest + [0]
+                for g in range(len(rp) - 1):
+                    if g == s:
+                        continue  # same place
+                    a, b = rp[g], rp[g + 1]
+                    cost = Dl[a][first] + Dl[last][b] - Dl[a][b]
+                    if cost < gain - _EPS:
+                        r[:] = rest[:g] + r[s:s + seg_len] + rest[g:]
+                        improved = improved_any = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return improved_any
+
+
+def _relocate(D, Dl, q, cap, max_dist, routes, deadline):
+    """Move single stops between trips when it lowers total distance."""
+    loads = [float(sum(q[i] for i in r)) for r in routes]
+    costs = [_route_cost(Dl, r) for r in routes]
+    improved_any = False
+    for a_idx, ra in enumerate(routes):
+        pos = 0
+        while pos < len(ra):
+            if time.perf_counter() >= deadline:
+                return improved_any
+            s = ra[pos]
+            prev = ra[pos - 1] if pos > 0 else 0
+            nxt = ra[pos + 1] if pos + 1 < len(ra) else 0
+            gain = Dl[prev][s] + Dl[s][nxt] - Dl[prev][nxt]
+            # on non-metric road matrices a shortcut stop has gain < 0: removing it
+            # lengthens its own trip, which must stay within max_dist too
+            if costs[a_idx] - gain > max_dist:
+                pos += 1
+                continue
+            best = None
+            for b_idx, rb in enumerate(routes):
+                if b_idx == a_idx or not rb or loads[b_idx] + q[s] > cap:
+                    continue
+                path = np.array([0] + rb + [0])
+                ins = D[path[:-1], s] + D[s, path[1:]] - D[path[:-1], path[1:]]
+                g = int(np.argmin(ins))
+                delta = float(ins[g])
+                if delta < gain - _EPS and costs[b_idx] + delta <= max_dist:
+                    if best is None or delta < best[0]:
+                        best = (delta, b_idx, g)
+            if best is None:
+                pos += 1
+                continue
+            delta, b_idx, g = best
+            ra.pop(pos)
+            routes[b_idx].insert(g, s)
+            loads[a_idx] -= q[s]
+            loads[b_idx] += q[s]
+            costs[a_idx] -= gain
+            costs[b_idx] += delta
+            improved_any = True
+    return improved_any
@@ -0,0 +1,258 @@
+import os, json, threading
+import datetime as dt
+
+from flask import json as flask_json
+from flask_sse import sse, Message
+
+from .cache import TTLCache, get_redis
+from .utils import format_sse_data
+
+# Tracker SSE protocol.
+# The first update of a route (or a new route / new pickup on the same channel)
+# publishes one "snapshot" event with the whole route and its summary; every later
+# position is a small "delta" event: {"seq", "index", "position", "timestamp"}.
+# seq grows by one per event on a channel, so a client that sees a gap (or joins
+# late) fetches GET /api/tracker/<route_id>/snapshot and continues from there.
+# Updates may carry the remaining route (old body) or just {"index", "position"}.
+# TRACKER_PROTOCOL=full keeps the old one-message-per-update format for old clients.
+# State lives in Redis when REDIS_URL is set (shared by all workers), else in-process.
+
+TRACKER_PROTOCOL = os.getenv("TRACKER_PROTOCOL", "delta")
+TRACKER_TTL = int(os.getenv("TRACKER_TTL", "86400"))
+TRACKER_BATCH_MAX = int(os.getenv("TRACKER_BATCH_MAX", "5000"))  # updates per /update_tracker/batch
+
+_local = TTLCache(maxsize=10000, ttl=TRACKER_TTL)
+_lock = threading.Lock()
+
+
+# ---------- state store ----------
+
+def _key(route_id, kind):
+    return f"tracker:{route_id}:{kind}"
+
+
+def _load(route_id, kind):
+    r = get_redis()
+    if r is not None:
+        try:
+            raw = r.get(_key(route_id, kind))
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            print("tracker redis read failed:", e)
+    return _local.get(_key(route_id, kind))
+
+
+def _save(route_id, kind, value):
+    _local.set(_key(route_id, kind), value)
+    r = get_redis()
+    if r is not None:
+        try:
+            r.setex(_key(route_id, kind), TRACKER_TTL, json.dumps(value))
+        except Exception as e:
+            print("tracker redis write failed:", e)
+
+
+def _next_seq(route_id, state):
+    r = get_redis()
+    if r is not None:
+        try:
+            seq = int(r.incr(_key(route_id, "seq")))
+            r.expire(_key(route_id, "seq"), TRACKER_TTL)
+            return seq
+        except Exception as e:
+            print("tracker redis seq failed:", e)
+    return _peek_seq(route_id, state)
+
+
+def _peek_seq(route_id, state):
+    """The next seq without reserving it (publish_batch commits it after publishing)."""
+    return (state or {}).get("seq", 0) + 1
+
+
+def _commit(route_id, writes, sync_seq=True):
+    """Store what _fold produced ({"base", "state"}); sync_seq moves the Redis seq counter along."""
+    for kind in ("base", "state"):
+        if kind in writes:
+            _save(route_id, kind, writes[kind])
+    r = get_redis() if sync_seq else None
+    if r is not None and "state" in writes:
+        try:
+            r.set(_key(route_id, "seq"), writes["state"]["seq"], ex=TRACKER_TTL)
+        except Exception as e:
+            print("tracker redis seq failed:", e)
+
+
+# ---------- protocol ----------
+
+def ingest(update: dict):
+    """
+    Fold one tracker update into the route's state.
+    Returns [(event_type, data), ...] to publish on the route's channel.
+    Raises ValueError for updates that cannot be placed on a known route.
+    """
+    with _lock:
+        route_id, events, writes = _fold(update, {}, _next_seq)
+        _commit(route_id, writes, sync_seq=False)   # _next_seq already counted it
+    return events
+
+
+def _fold(update, pending, next_seq):
+    """
+    ingest() without side effects: (route_id, events, writes), where writes is the
+    {"base", "state"} to store once the events are out. `pending` holds writes of
+    earlier, not yet committed updates ({route_id: writes}); next_seq picks the seq.
+    """
+    route_id = update.get("route_id")
+    if route_id is None:
+        raise ValueError("route_id is required.")
+    route_id = str(route_id)
+    now = update.get("timestamp") or dt.datetime.now().isoformat()
+
+    staged = pending.get(route_id) or {}
+    state = staged["state"] if "state" in staged else _load(route_id, "state")
+    route = update.get("route")
+
+    if route is not None and _starts_new_route(state, route, update):
+        meta = format_sse_data({**update, "route": []})
+        meta.pop("remaining_routes", None)
+        base = {"route": list(route), "meta": meta}
+        state = {
+            "seq": next_seq(route_id, state),
+            "index": 0,
+            "position": route[0] if route else None,
+            "timestamp": now,
+            "base_len": len(route),
+            "base_end": route[-1] if route else None,
+            "pickup_time": update.get("pickup_time"),
+        }
+        writes = {"base": base, "state": state}
+        if TRACKER_PROTOCOL == "full":
+            return route_id, [(None, {**meta, "remaining_routes": base["route"]})], writes
+        return route_id, [("snapshot", _snapshot(base, state))], writes
+
+    if state is None:
+        raise ValueError("unknown route_id; send the full route first.")
+    if route is not None:
+        index = state["base_len"] - len(route)
+        position = route[0] if route else None
+    else:
+        try:
+            index = int(update["index"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("update needs either route or index.")
+        position = update.get("position")
+    if not 0 <= index <= state["base_len"]:
+        raise ValueError(f"index {index} is outside the route (0..{state['base_len']}).")
+
+    state = {**state, "seq": next_seq(route_id, state), "index": index,
+             "position": position, "timestamp": now}
+    writes = {"state": state}
+
+    if TRACKER_PROTOCOL == "full":
+        base = staged.get("base") or _load(route_id, "base") or {"route": [], "meta": {}}
+        return route_id, [(None, {**base["meta"], "remaining_routes": base["route"][index:]})], writes
+    return route_id, [("delta", {k: state[k] for k in ("seq", "index", "position", "timestamp")})], writes
+
+
+def _starts_new_route(state, route, update):
+    # a remaining route that is a suffix of the known one is just progress
+    if state is None or not route:
+        return state is None
+    return (
+        len(route) > state["base_len"]
+        or route[-1] != state["base_end"]
+        or update.get("pickup_time", state["pickup_time"]) != state["pickup_time"]
+    )
+
+
+def _snapshot(base, state):
+    return {
+        **base["meta"],
+        "seq": state["seq"],
+        "index": state["index"],
+        "position": state["position"],
+        "timestamp": state["timestamp"],
+        "route": base["route"],
+    }
+
+
+def snapshot(route_id):
+    """Full current view of a route (for late joiners / gap recovery), or None."""
+    route_id = str(route_id)
+    state = _load(route_id, "state")
+    base = _load(route_id, "base")
+    if state is None or base is None:
+        return None
+    return _snapshot(base, state)
+
+
+def publish_update(update: dict):
+    """ingest + sse.publish on the route's channel; returns the published events."""
+    events = ingest(update)
+    for event_type, data in events:
+        sse.publish(data, type=event_type, channel=str(update["route_id"]))
+    return events
+
+
+# ---------- batch ingestion ----------
+
+def coalesce(updates):
+    """
+    Collapse a batch to at most two updates per route_id, in arrival order:
+    the last full-route update and the last compact (index/position) update after it.
+    Only those are ingested, so skipped positions never consume sequence numbers.
+    """
+    groups = {}
+    for u in updates:
+        full, compact = groups.get(str(u["route_id"]), (None, None))
+        groups[str(u["route_id"])] = (u, None) if u.get("route") is not None else (full, u)
+    return [u for pair in groups.values() for u in pair if u is not None]
+
+
+def publish_batch(updates, merge=True):
+    """
+    Ingest many positions (many route_ids) and publish every resulting event over
+    one Redis pipeline. Returns per-batch counts plus the rejected items' errors.
+    merge=False publishes every update in order instead of coalescing per route.
+    Route state and sequence numbers are only stored once the pipeline went out, so
+    a failed publish (raised to the caller) leaves no gap for clients to resync over.
+    """
+    received = len(updates)
+    valid, errors = [], []
+    for i, u in enumerate(updates):
+        if isinstance(u, dict) and u.get("route_id") is not None:
+            valid.append(u)
+        else:
+            errors.append({"item": i, "error": "route_id is required."})
+
+    merged = coalesce(valid) if merge else valid
+    outgoing, pending = [], {}
+    with _lock:
+        for u in merged:
+            try:
+                route_id, events, writes = _fold(u, pending, _peek_seq)
+            except Exception as e:   # a bad item must not take the rest of the batch with it
+                errors.append({"route_id": u["route_id"], "error": str(e)})
+                continue
+            pending.setdefault(route_id, {}).update(writes)
+            outgoing += [(route_id, t, d) for t, d in events]
+
+        if outgoing:
+            # same wire format as sse.publish, but one round trip for the whole batch
+            pipe = sse.redis.pipeline(transaction=False)
+            for channel, event_type, data in outgoing:
+                pipe.publish(channel, flask_json.dumps(Message(data, type=event_type).to_dict()))
+            pipe.execute()
+
+        for route_id, writes in pending.items():
+            _commit(route_id, writes)
+
+    return {
+        "received": received,
+        "accepted": received - len(errors),
+        "rejected": len(errors),
+        "coalesced": len(valid) - len(merged),
+        "published": len(outgoing),
+        "routes": len(pending),
+        "errors": errors[:100],
+    }
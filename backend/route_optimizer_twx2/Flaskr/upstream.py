@@ -0,0 +1,174 @@
+import os, time, random, threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import observe_upstream
+
+# One pooled HTTP client per upstream (ORS, Supabase PostgREST, this service's own
+# /api/update_tracker). Each keeps a keep-alive connection pool so TLS handshakes
+# are paid once per connection, not once per call, and has its own timeout,
+# retry policy and circuit breaker:
+#   <NAME>_TIMEOUT     read timeout in seconds (connect timeout is UPSTREAM_CONNECT_TIMEOUT)
+#   <NAME>_POOL_SIZE   max pooled connections (default UPSTREAM_POOL_SIZE)
+#   <NAME>_RETRIES     attempts for idempotent calls (GET/HEAD/DELETE/PUT/OPTIONS)
+# The breaker opens after BREAKER_FAILURES consecutive failures (network errors,
+# 5xx) and fails fast with CircuitOpen for BREAKER_RESET_S, then lets one trial through.
+# Health probes pass breaker=False: they neither trip it nor get stopped by it.
+
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_S = float(os.getenv("BREAKER_RESET_S", "30"))
+
+IDEMPOTENT = {"GET", "HEAD", "DELETE", "PUT", "OPTIONS"}
+RETRY_STATUSES = {429, 502, 503, 504}
+
+_DEFAULTS = {   # name -> (read timeout s, retries)
+    "ors": (30.0, 3),
+    "supabase": (20.0, 3),
+    "self": (10.0, 1),
+}
+
+
+class CircuitOpen(requests.RequestException):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.max_failures = failures
+        self.reset_s = reset_s
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_s else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True   # exactly one probe call while half-open
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures, self.opened_at, self._trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class Upstream:
+    def __init__(self, name, timeout, retries, pool_size):
+        self.name = name
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+        self._stats_lock = threading.Lock()   # bumped from tile pools, simulator senders, probes
+
+    def request(self, method, url, retry=None, timeout=None, breaker=True, **kwargs):
+        """
+        session.request with this upstream's timeout, breaker and retry policy.
+        Returns the Response (callers still check the status); raises
+        requests.RequestException (CircuitOpen when the breaker is open).
+        retry=None retries idempotent methods only; pass True/False to override.
+        breaker=False bypasses the circuit breaker entirely (health probes).
+        """
+        method = method.upper()
+        attempts = self.retries if (method in IDEMPOTENT if retry is None else retry) else 1
+        read_timeout = timeout if timeout is not None else self.timeout
+        for attempt in range(attempts):
+            if breaker and not self.breaker.allow():
+                self._count("short_circuited")
+                raise CircuitOpen(f"{self.name}: circuit open after {self.breaker.failures} failures")
+            self._count("requests")
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.request(
+                    method, url, timeout=(min(UPSTREAM_CONNECT_TIMEOUT, read_timeout), read_timeout), **kwargs)
+            except requests.RequestException:
+                observe_upstream(self.name, url, time.perf_counter() - t0, "error")
+                self._failed(breaker)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                observe_upstream(self.name, url, time.perf_counter() - t0, resp.status_code)
+                if resp.status_code >= 500:
+                    self._failed(breaker)
+                elif breaker:
+                    self.breaker.success()
+                if resp.status_code not in RETRY_STATUSES or attempt == attempts - 1:
+                    return resp
+            self._count("retries")
+            # exponential backoff with jitter so concurrent callers don't retry in lockstep
+            time.sleep(0.25 * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _failed(self, breaker=True):
+        self._count("failures")
+        if breaker:
+            self.breaker.failure()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def describe(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {**stats, "breaker": self.breaker.state, "timeout_s": self.timeout}
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(name):
+    """Shared client for `name` ("ors", "supabase", "self", ...), built on first use."""
+    with _upstreams_lock:
+        client = _upstreams.get(name)
+        if client is None:
+            timeout, retries = _DEFAULTS.get(name, (20.0, 1))
+            env = name.upper()
+            client = Upstream(
+                name,
+                timeout=float(os.getenv(f"{env}_TIMEOUT", timeout)),
+                retries=int(os.getenv(f"{env}_RETRIES", retries)),
+                pool_size=int(os.getenv(f"{env}_POOL_SIZE", UPSTREAM_POOL_SIZE)),
+            )
+            _upstreams[name] = client
+    return client
+
+
+def upstream_stats():
+    with _upstreams_lock:
+        return {name: u.describe() for name, u in _upstreams.items()}
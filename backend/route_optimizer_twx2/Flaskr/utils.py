@@ -1,11 +1,14 @@
 import os
 import requests
 import time
-import random
 import datetime as dt
 
-# Read your ORS key from env (safer than hard-coding)
-ORS_API_KEY = os.getenv("ORS_API_KEY") or os.getenv("OPENROUTESERVICE_API_KEY")
+from .ors import fetch_matrix, fetch_directions, fetch_directions_many
+from .solver import solve, Unservable
+from .upstream import upstream, CircuitOpen
+from .metrics import stage, observe_route
+from .geometry import concat_coords, bbox_of
+from .approx import APPROX_FALLBACK, APPROX_SPARSE_MIN_STOPS, sparse_matrix, fallback_matrix
 
 def optimize_route(input_data: dict):
     """
@@ -17,53 +20,103 @@ def optimize_route(input_data: dict):
 
     driver_details = input_data.get("driver_details") or {}
     vehicle_type = (driver_details.get("vehicle_type") or "car").lower().strip()
-
-    # Map vehicle type to an ORS profile for now
-    profile_type = {
-        "car": "driving-car",
-        "truck": "driving-hgv", "hgv": "driving-hgv",
-        "motorcycle": "driving-car",
-        "bike": "cycling-regular",
-        "roadbike": "cycling-road",
-        "foot": "foot-walking",
-    }.get(vehicle_type, "driving-car")
+    profile_type = profile_for(vehicle_type)
 
     source = input_data["source_point"]
     destinations = input_data["destination_points"]
+    # fast mode: order + summaries from the matrix only, no polyline
+    matrix_only = input_data.get("geometry") is False or input_data.get("mode") == "matrix"
 
     if len(destinations) == 1:
-        feature = _point_to_point(source, destinations[0], profile_type, driver_details)
+        feature = _point_to_point(source, destinations[0], profile_type, driver_details, matrix_only=matrix_only)
         if "error" in feature:
             return feature
         p = feature.setdefault("properties", {})
         p["optimized_order"] = [0]
         p["source"] = source
         p["destinations"] = [destinations[0]]
-        _annotate_common_props(feature, driver_details, vehicle_type, engine="backend:ors")
+        _annotate_common_props(feature, driver_details, vehicle_type, engine=p.get("engine") or "backend:ors")
+        observe_route(feature)
         return feature
 
-    feature = _multi_stop(source, destinations, profile_type, driver_details)
+    try:
+        time_budget_ms = float(input_data["time_budget_ms"]) if input_data.get("time_budget_ms") is not None else None
+    except (TypeError, ValueError):
+        return {"error": "time_budget_ms must be a number."}
+
+    feature = _multi_stop(
+        source, destinations, profile_type, driver_details,
+        solver=input_data.get("solver"), time_budget_ms=time_budget_ms,
+        matrix_only=matrix_only,
+    )
     if "error" in feature: return feature
-    _annotate_common_props(feature, driver_details, vehicle_type, engine="backend:ors")
+    _annotate_common_props(feature, driver_details, vehicle_type,
+                           engine=feature["properties"].get("engine") or "backend:ors")
+    observe_route(feature)
     return feature
 
 
 # ---------- helpers ----------
 
-def _point_to_point(source, destination, profile_type, driver_details):
+# Map vehicle type to an ORS profile for now
+PROFILES = {
+    "car": "driving-car",
+    "truck": "driving-hgv", "hgv": "driving-hgv",
+    "motorcycle": "driving-car",
+    "bike": "cycling-regular",
+    "roadbike": "cycling-road",
+    "foot": "foot-walking",
+}
+
+
+def profile_for(vehicle_type):
+    return PROFILES.get((vehicle_type or "car").lower().strip(), "driving-car")
+
+
+def _point_to_point(source, destination, profile_type, driver_details, matrix_only=False):
     coordinates = [[source['lon'], source['lat']], [destination['lon'], destination['lat']]]
-    url = f"https://api.openrouteservice.org/v2/directions/{profile_type}/geojson"
-    headers = {"Authorization": ORS_API_KEY, "Content-Type": "application/json"}
-    body = {"coordinates": coordinates}
 
-    try:
-        resp = requests.post(url, json=body, headers=headers, timeout=30)
-        resp.raise_for_status()
-        feature = resp.json()['features'][0]
-    except requests.RequestException as e:
-        status = getattr(e.response, "status_code", "n/a")
-        text = getattr(e.response, "text", str(e))
-        return {"error": f"ORS directions error (status {status}): {text}"}
+    degraded = None
+    if matrix_only:
+        try:
+            with stage("matrix"):
+                distance_matrix, duration_matrix = fetch_matrix(coordinates, profile_type)
+        except ValueError as e:
+            return {"error": str(e)}
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", "n/a")
+            text = getattr(e.response, "text", str(e))
+            if not (APPROX_FALLBACK and _ors_unavailable(e)):
+                return {"error": f"ORS matrix error (status {status}): {text}"}
+            degraded = f"ORS matrix error (status {status}): {text}"
+            distance_matrix, duration_matrix = fallback_matrix(coordinates, profile_type)
+        feature = _leg_feature(coordinates, distance_matrix, duration_matrix)
+    else:
+        try:
+            with stage("directions"):
+                feature = fetch_directions(coordinates, profile_type)
+        except requests.RequestException as e:
+            status = getattr(e.response, "status_code", "n/a")
+            text = getattr(e.response, "text", str(e))
+            if not (APPROX_FALLBACK and _ors_unavailable(e)):
+                return {"error": f"ORS directions error (status {status}): {text}"}
+            # no polyline, but the leg itself still comes from ORS when its matrix answers
+            reason = f"ORS directions error (status {status}): {text}"
+            try:
+                with stage("matrix"):
+                    feature = _leg_feature(coordinates, *fetch_matrix(coordinates, profile_type))
+                feature["properties"]["degraded"] = reason
+            except ValueError as e:
+                return {"error": str(e)}
+            except requests.RequestException as me:
+                if not _ors_unavailable(me):
+                    status = getattr(me.response, "status_code", "n/a")
+                    text = getattr(me.response, "text", str(me))
+                    return {"error": f"ORS matrix error (status {status}): {text}"}
+                degraded = reason
+                feature = _leg_feature(coordinates, *fallback_matrix(coordinates, profile_type))
+    if degraded:
+        _mark_approx(feature, degraded)
 
     # Basic feasibility checks
     payload = destination.get("payload", 0)
@@ -82,91 +135,106 @@ def _point_to_point(source, destination, profile_type, driver_details):
     return feature
 
 
-def _multi_stop(source, destinations, profile_type, driver_details):
+def _leg_feature(coordinates, distance_matrix, duration_matrix):
+    leg = {"distance": float(distance_matrix[0][1]), "duration": float(duration_matrix[0][1])}
+    return {
+        "bbox": bbox_of(coordinates),
+        "type": "Feature",
+        "geometry": None,
+        "properties": {"segments": [leg], "summary": dict(leg)},
+    }
+
+
+def _ors_unavailable(e):
+    """Outage or overload (worth an estimate); any other 4xx is the request's fault and is returned."""
+    if isinstance(e, (CircuitOpen, requests.ConnectionError, requests.Timeout)):
+        return True
+    status = getattr(e.response, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _mark_approx(feature, reason):
+    """Degraded mode: summaries are great-circle estimates, not ORS results."""
+    p = feature.setdefault("properties", {})
+    p["engine"] = "approx"
+    p["estimated"] = True
+    p["degraded"] = reason
+
+
+def _multi_stop(source, destinations, profile_type, driver_details, solver=None, time_budget_ms=None,
+                matrix_only=False, solve_fn=solve):
     """
-    Simple capacity-aware greedy routing over ORS Matrix, then fetch polylines per trip.
+    Capacity-aware routing over ORS Matrix (see solver.py), then fetch polylines per trip.
     Returns a single GeoJSON Feature with concatenated geometry and segments.
     Also emits properties.optimized_order as indexes into destinations[].
+    With matrix_only the directions calls are skipped and summaries come from the matrix.
+    solve_fn lets fleet.py run the solver in a worker process (same signature as solve).
     """
-    headers = {"Authorization": ORS_API_KEY, "Content-Type": "application/json"}
-
-    # ORS Matrix over [origin + all stops]
+    # ORS Matrix over [origin + all stops] (cached pairs are not re-requested)
     all_points = [source] + destinations
     points_coords = [[p['lon'], p['lat']] for p in all_points]
 
-    matrix_url = f"https://api.openrouteservice.org/v2/matrix/{profile_type}"
-    matrix_body = {"locations": points_coords, "metrics": ["distance"], "units": "m"}
-
+    # large jobs only ask ORS for each stop's nearest neighbours (see approx.py)
+    degraded = sparse = sparse_estimated = None
     try:
-        mresp = requests.post(matrix_url, json=matrix_body, headers=headers, timeout=30)
-        mresp.raise_for_status()
-        distance_matrix = mresp.json().get('distances')
-        if not distance_matrix:
-            return {"error": "ORS matrix returned no distances"}
+        with stage("matrix"):
+            if APPROX_SPARSE_MIN_STOPS and len(points_coords) >= APPROX_SPARSE_MIN_STOPS:
+                distance_matrix, duration_matrix, sparse, sparse_estimated = sparse_matrix(
+                    points_coords, profile_type, fetch_matrix)
+            else:
+                distance_matrix, duration_matrix = fetch_matrix(points_coords, profile_type)
+    except ValueError as e:
+        return {"error": str(e)}
     except requests.RequestException as e:
         status = getattr(e.response, "status_code", "n/a")
         text = getattr(e.response, "text", str(e))
-        return {"error": f"ORS matrix error (status {status}): {text}"}
+        if not (APPROX_FALLBACK and _ors_unavailable(e)):
+            return {"error": f"ORS matrix error (status {status}): {text}"}
+        # ORS down or rate-limited: plan on great-circle estimates instead of failing
+        degraded = f"ORS matrix error (status {status}): {text}"
+        distance_matrix, duration_matrix = fallback_matrix(points_coords, profile_type)
 
-    # Greedy nearest-neighbor with capacity + max_distance constraints
+    # Capacity + max_distance constrained trips (Clarke-Wright + local search, greedy fallback)
     cap = float(driver_details.get("vehicle_capacity", 9e12))
     max_dist = float(driver_details.get("maximum_distance", 9e12))
+    demands = [0.0] + [float(p.get("payload", 0)) for p in destinations]
 
-    trips_indices = []  # list of trips, each is list of indices into all_points (0 is origin)
-    unvisited = list(range(1, len(all_points)))  # 1..N
-
-    while unvisited:
-        trip = [0]  # start at origin
-        load = 0.0
-        trip_dist = 0.0
-        current = 0
-
-        # try nearest neighbors first
-        for idx in sorted(unvisited, key=lambda i: distance_matrix[current][i]):
-            demand = float(all_points[idx].get("payload", 0))
-            # distance added if we go current->idx and then return to origin
-            added_if_accept = distance_matrix[current][idx] + distance_matrix[idx][0]
-            if (load + demand) <= cap and (trip_dist + added_if_accept) <= max_dist:
-                trip.append(idx)
-                load += demand
-                trip_dist += distance_matrix[current][idx]
-                current = idx
-
-        trip.append(0)  # return to origin
-        trips_indices.append(trip)
-        # remove visited (excluding the origin 0 added twice)
-        visited = set(trip[1:-1])
-        unvisited = [i for i in unvisited if i not in visited]
-
-    # Build directions per trip and combine
-    combined_geometry = []
-    combined_segments = []
-    total_distance = 0.0
-    total_duration = 0.0
-
-    for trip in trips_indices:
-        trip_points = [all_points[i] for i in trip]
-        trip_coords = [[p['lon'], p['lat']] for p in trip_points]
-
-        dir_url = f"https://api.openrouteservice.org/v2/directions/{profile_type}/geojson"
-        dir_body = {"coordinates": trip_coords}
+    try:
+        with stage("solve"):
+            trips_indices, solver_engine = solve_fn(
+                distance_matrix, demands, cap, max_dist,
+                engine=solver, time_budget_ms=time_budget_ms,
+            )
+    except Unservable as e:
+        return {"error": str(e), "unservable": e.stops}   # fleet.py hands these to other vehicles
+    except ValueError as e:
+        return {"error": str(e)}
+
+    from_matrix = bool(matrix_only or degraded)
+    if from_matrix:
+        feature = _matrix_trips_feature(all_points, trips_indices, distance_matrix, duration_matrix)
+    else:
         try:
-            dresp = requests.post(dir_url, json=dir_body, headers=headers, timeout=30)
-            dresp.raise_for_status()
-            feature = dresp.json()['features'][0]
+            with stage("directions"):
+                feature = _directions_trips_feature(all_points, trips_indices, profile_type)
         except requests.RequestException as e:
             status = getattr(e.response, "status_code", "n/a")
             text = getattr(e.response, "text", str(e))
-            return {"error": f"ORS directions error (status {status}): {text}"}
-
-        combined_geometry += feature['geometry']['coordinates']
-        combined_segments += feature['properties'].get('segments', [])
-        total_distance += float(feature['properties']['summary']['distance'])
-        total_duration += float(feature['properties']['summary']['duration'])
-
-    lons = [c[0] for c in combined_geometry]
-    lats = [c[1] for c in combined_geometry]
-    bbox = [min(lons), min(lats), max(lons), max(lats)]
+            if not (APPROX_FALLBACK and _ors_unavailable(e)):
+                return {"error": f"ORS directions error (status {status}): {text}"}
+            # the ORS matrix is real: summaries from it are exact (bar sparse estimates), only the polylines are missing
+            feature = _matrix_trips_feature(all_points, trips_indices, distance_matrix, duration_matrix)
+            from_matrix = True
+            feature["properties"]["degraded"] = f"ORS directions error (status {status}): {text}"
+    if degraded:
+        _mark_approx(feature, degraded)
+    if sparse:
+        feature["properties"]["matrix"] = {"mode": "sparse", **sparse}
+        # summaries over a leg that ORS never priced are estimates, as in the fallback
+        estimated_legs = sum(int(sparse_estimated[a][b]) for trip in trips_indices for a, b in zip(trip, trip[1:]))
+        if from_matrix and estimated_legs:
+            feature["properties"]["estimated"] = True
+            feature["properties"]["matrix"]["estimated_legs"] = estimated_legs
 
     # optimized order as indexes into the original destinations[] (exclude origin 0)
     optimized_order = []
@@ -174,15 +242,53 @@ def _multi_stop(source, destinations, profile_type, driver_details):
         for idx in trip[1:-1]:
             optimized_order.append(idx - 1)  # shift because destinations start at 0
 
-    combined_feature = {
-        "bbox": bbox,
+    feature["properties"].update({
+        "source": source,
+        "destinations": destinations,
+        "optimized_order": optimized_order,
+        "solver": solver_engine,
+    })
+    return feature
+
+
+def _directions_trips_feature(all_points, trips_indices, profile_type):
+    """
+    One ORS directions call per trip; concatenated geometry, segments and totals.
+    Raises requests.RequestException when any directions call fails.
+    The geometry is a single (n, 2) NumPy array; it is turned into JSON lists (or a
+    polyline) by shape_geometry at the response boundary.
+    """
+    combined_segments = []
+    trips = []
+    total_distance = 0.0
+    total_duration = 0.0
+
+    trips_coords = [[[all_points[i]['lon'], all_points[i]['lat']] for i in trip] for trip in trips_indices]
+    # one directions call per trip, fetched concurrently but combined in trip order;
+    # a RequestException propagates so the caller can tell outages from bad requests
+    trip_features = fetch_directions_many(trips_coords, profile_type)
+
+    for trip, feature in zip(trips_indices, trip_features):
+        summary = feature['properties']['summary']
+        combined_segments += feature['properties'].get('segments', [])
+        total_distance += float(summary['distance'])
+        total_duration += float(summary['duration'])
+        trips.append({
+            "stops": [i - 1 for i in trip[1:-1]],
+            "distance": float(summary['distance']),
+            "duration": float(summary['duration']),
+            "vertices": len(feature['geometry']['coordinates']),   # lets reoptimize.py split the stored line
+        })
+
+    combined_geometry = concat_coords(f['geometry']['coordinates'] for f in trip_features)
+
+    return {
+        "bbox": bbox_of(combined_geometry),
         "type": "Feature",
         "geometry": {"type": "LineString", "coordinates": combined_geometry},
         "properties": {
-            "source": source,
-            "destinations": destinations,
-            "optimized_order": optimized_order,
             "segments": combined_segments,   # each has steps[] your UI reads
+            "trips": trips,
             "summary": {
                 "distance": total_distance,
                 "duration": total_duration,
@@ -190,7 +296,41 @@ def _multi_stop(source, destinations, profile_type, driver_details):
             },
         },
     }
-    return combined_feature
+
+
+def _matrix_trips_feature(all_points, trips_indices, distance_matrix, duration_matrix):
+    """
+    Matrix-only mode: trip and total summaries straight from the matrix, no directions
+    calls. Segments carry distance/duration per leg but no steps; geometry is null.
+    """
+    segments = []
+    trips = []
+    for trip in trips_indices:
+        legs = [
+            {"distance": float(distance_matrix[a][b]), "duration": float(duration_matrix[a][b])}
+            for a, b in zip(trip, trip[1:])
+        ]
+        segments += legs
+        trips.append({
+            "stops": [i - 1 for i in trip[1:-1]],
+            "distance": sum(l["distance"] for l in legs),
+            "duration": sum(l["duration"] for l in legs),
+        })
+
+    return {
+        "bbox": bbox_of([[p['lon'], p['lat']] for p in all_points]),
+        "type": "Feature",
+        "geometry": None,
+        "properties": {
+            "segments": segments,
+            "trips": trips,
+            "summary": {
+                "distance": sum(t["distance"] for t in trips),
+                "duration": sum(t["duration"] for t in trips),
+                "trips": len(trips),
+            },
+        },
+    }
 
 
 def _annotate_common_props(feature: dict, driver_details: dict, vehicle_type: str, engine: str):
@@ -210,14 +350,14 @@ PROD_BASE = (os.getenv("API_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL") or ""
 API_BASE = (PROD_BASE if (RUNNING_IN_RENDER and PROD_BASE) else DEV_BASE)
 UPDATE_ENDPOINT = f"{API_BASE}/api/update_tracker"
 
-def _post_update(payload, retries=3, backoff=0.4):
+def _post_update(payload, retries=3, backoff=0.4, url=None):
     """
     Post tracker updates with tiny exponential backoff.
     Keeps logs quiet unless something is actually wrong.
     """
     for i in range(retries):
         try:
-            r = requests.post(UPDATE_ENDPOINT, json=payload, timeout=10)
+            r = upstream("self").post(url or UPDATE_ENDPOINT, json=payload, retry=False)
             if r.ok:
                 return True
             print(f"update_tracker non-200: {r.status_code} {r.text[:160]}")
@@ -226,30 +366,6 @@ def _post_update(payload, retries=3, backoff=0.4):
         time.sleep(backoff * (2 ** i))
     return False
 
-def simulate_route(data):
-    PICKUP_TIME = dt.datetime.now()
-
-    route_points = list(data['route_details']['geometry']['coordinates'])
-    destinations = data['route_details']['properties']['destinations']
-
-    while route_points:
-        url_data = {
-            "route_id": data['driver_details']['driver_name'],
-            "route": route_points,
-            "destinations": destinations,
-            "driver_name": data['driver_details']['driver_name'],
-            "vehicle_type": data['driver_details']['vehicle_type'],
-            "duration": data['route_details']['properties']['summary']['duration'],
-            "distance": data['route_details']['properties']['summary']['distance'],
-            "trips": data['route_details']['properties']['summary'].get('trips', 1),
-            "pickup_time": PICKUP_TIME.isoformat(),
-        }
-        route_points.pop(0)
-        ok = _post_update(url_data)
-        if ok:
-            print(f"Sent to {UPDATE_ENDPOINT} (points left={len(route_points)})")
-        time.sleep(random.uniform(2.0, 5.0))
-
 def format_sse_data(data):
     # FIX: use dt.datetime.fromisoformat (we import datetime as dt)
     pickup_time = dt.datetime.fromisoformat(data['pickup_time'])
@@ -0,0 +1,2 @@
+# Offline benchmark harness: local ORS / PostgREST stand-ins (fakes.py) and the
+# optimize_route latency/throughput runner (run.py). See run.py for usage.
@@ -0,0 +1,110 @@
+import threading, time
+import numpy as np
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+# Stand-ins for the two upstreams optimize_route talks to. Both are deterministic:
+# distances are great-circle metres x CIRCUITY, durations assume SPEED_MPS, and
+# directions geometry is LEG_VERTICES evenly spaced points per leg, so the same
+# request always produces the same response and the same amount of work.
+
+CIRCUITY = 1.3
+SPEED_MPS = 10.0
+
+
+def _haversine(a, b):
+    a, b = np.radians(a), np.radians(b)
+    h = (np.sin((b[..., 1] - a[..., 1]) / 2) ** 2
+         + np.cos(a[..., 1]) * np.cos(b[..., 1]) * np.sin((b[..., 0] - a[..., 0]) / 2) ** 2)
+    return 2 * 6_371_008.8 * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def ors_app(latency_ms=0.0, leg_vertices=20):
+    app = Flask("fake_ors")
+    app.config["calls"] = {"matrix": 0, "directions": 0}
+
+    @app.post("/v2/matrix/<profile>")
+    def matrix(profile):
+        time.sleep(latency_ms / 1000.0)
+        app.config["calls"]["matrix"] += 1
+        body = request.get_json()
+        locs = np.asarray(body["locations"], dtype=float)
+        src = locs[body.get("sources", list(range(len(locs))))]
+        dst = locs[body.get("destinations", list(range(len(locs))))]
+        dist = _haversine(src[:, None, :], dst[None, :, :]) * CIRCUITY
+        return jsonify({"distances": dist.round(1).tolist(), "durations": (dist / SPEED_MPS).round(1).tolist()})
+
+    @app.post("/v2/directions/<profile>/geojson")
+    def directions(profile):
+        time.sleep(latency_ms / 1000.0)
+        app.config["calls"]["directions"] += 1
+        coords = np.asarray(request.get_json()["coordinates"], dtype=float)
+        legs = _haversine(coords[:-1], coords[1:]) * CIRCUITY
+        t = np.linspace(0.0, 1.0, leg_vertices, endpoint=False)[:, None]
+        geometry = np.concatenate(
+            [a + t * (b - a) for a, b in zip(coords[:-1], coords[1:])] + [coords[-1:]]
+        )
+        segments = [{"distance": float(d), "duration": float(d / SPEED_MPS), "steps": []} for d in legs]
+        return jsonify({"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "bbox": geometry.min(axis=0).tolist() + geometry.max(axis=0).tolist(),
+            "geometry": {"type": "LineString", "coordinates": geometry.round(6).tolist()},
+            "properties": {
+                "segments": segments,
+                "summary": {"distance": float(legs.sum()), "duration": float(legs.sum() / SPEED_MPS)},
+            },
+        }]})
+
+    @app.route("/", methods=["GET", "HEAD"])
+    @app.get("/health")
+    def health():
+        return jsonify({"status": "ready"})
+
+    return app
+
+
+def postgrest_app(latency_ms=0.0):
+    app = Flask("fake_postgrest")
+    tables = app.config["tables"] = {}
+
+    @app.post("/rest/v1/<table>")
+    def insert(table):
+        time.sleep(latency_ms / 1000.0)
+        rows = request.get_json()
+        rows = rows if isinstance(rows, list) else [rows]
+        tables.setdefault(table, []).extend(rows)
+        return ("", 201)
+
+    @app.get("/rest/v1/<table>")
+    def select(table):
+        time.sleep(latency_ms / 1000.0)
+        return jsonify(tables.get(table, [])[: int(request.args.get("limit", 100))])
+
+    @app.delete("/rest/v1/<table>")
+    def delete(table):
+        return ("", 204)
+
+    return app
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerThread:
+    """Serve a WSGI app on 127.0.0.1:<free port> from a background thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=_QuietHandler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        return False
@@ -0,0 +1,203 @@
+"""
+Offline optimize_route benchmark.
+
+    python -m bench.run                          # full grid, writes bench/results.json
+    python -m bench.run --quick                  # stops <= 100
+    python -m bench.run --baseline bench/baseline.json --threshold 0.25
+    python -m bench.run --update-baseline bench/baseline.json
+
+Starts a fake ORS and a fake PostgREST on localhost (bench/fakes.py), points the
+service at them (ORS_BASE_URL / SUPABASE_URL) and drives POST /api/optimize_route
+through the Flask test client across stop counts, trip counts and concurrency.
+Every request uses fresh jittered coordinates, so the matrix/directions caches
+never answer for the upstream. Exits 1 when any scenario's p50/p95 latency or
+throughput is worse than the baseline by more than --threshold, or when requests fail.
+Baselines are machine-specific: record them on the box that runs the comparison.
+"""
+import os, sys, json, math, time, argparse, platform, statistics, subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .fakes import ors_app, postgrest_app, ServerThread
+
+STOPS = (2, 10, 50, 100, 250, 500, 1000)
+TRIPS = (1, 5, 20)
+CONCURRENCY = (1, 8)
+ORIGIN = (121.0560, 14.5846)   # Metro Manila, like the sample requests
+
+
+def scenarios(quick=False):
+    out = []
+    for stops in STOPS:
+        if quick and stops > 100:
+            continue
+        for trips in TRIPS:
+            if trips > stops:
+                continue
+            for conc in CONCURRENCY:
+                if conc > 1 and stops > 100:
+                    continue   # big plans are measured one at a time
+                out.append({"name": f"stops={stops},trips={trips},concurrency={conc}",
+                            "stops": stops, "trips": trips, "concurrency": conc})
+    return out
+
+
+def make_body(stops, trips, rng):
+    # stops spread over ~20 km; one payload unit each so capacity sets the trip count
+    lon = ORIGIN[0] + rng.uniform(-0.1, 0.1, stops)
+    lat = ORIGIN[1] + rng.uniform(-0.1, 0.1, stops)
+    return {
+        "source_point": {"lon": ORIGIN[0] + rng.uniform(-1e-3, 1e-3), "lat": ORIGIN[1]},
+        "destination_points": [{"lon": float(x), "lat": float(y), "payload": 1} for x, y in zip(lon, lat)],
+        "driver_details": {"driver_name": "bench", "vehicle_type": "car",
+                           "vehicle_capacity": math.ceil(stops / trips), "maximum_distance": 9e12},
+    }
+
+
+def _server_timing(header):
+    stages = {}
+    for part in (header or "").split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if dur:
+            stages[name] = float(dur)
+    return stages
+
+
+def run_scenario(app, sc, iterations, seed):
+    requests_total = max(iterations, sc["concurrency"] * 2)
+    rng = np.random.default_rng(seed)
+    bodies = [make_body(sc["stops"], sc["trips"], rng) for _ in range(requests_total)]
+
+    def one(body):
+        client = app.test_client()
+        t0 = time.perf_counter()
+        resp = client.post("/api/optimize_route", json=body)
+        elapsed = (time.perf_counter() - t0) * 1000
+        data = resp.get_json(silent=True) or {}
+        trips = ((data.get("properties") or {}).get("summary") or {}).get("trips")
+        return elapsed, resp.status_code, trips, _server_timing(resp.headers.get("Server-Timing"))
+
+    one(make_body(sc["stops"], sc["trips"], rng))   # warm-up (imports, thread pools, connections)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sc["concurrency"]) as pool:
+        results = list(pool.map(one, bodies))
+    wall = time.perf_counter() - t0
+
+    lat = sorted(r[0] for r in results)
+    ok = [r for r in results if r[1] == 200]
+    stage_names = sorted({k for r in ok for k in r[3]})
+    return {
+        **sc,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "trips_mean": statistics.fmean(r[2] for r in ok if r[2]) if ok else None,
+        "p50_ms": round(float(np.percentile(lat, 50)), 2),
+        "p95_ms": round(float(np.percentile(lat, 95)), 2),
+        "mean_ms": round(statistics.fmean(lat), 2),
+        "throughput_rps": round(len(results) / wall, 3),
+        "stages_mean_ms": {k: round(statistics.fmean(r[3].get(k, 0.0) for r in ok), 2) for k in stage_names},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regressions as human-readable strings (empty when within threshold)."""
+    base = {s["name"]: s for s in baseline.get("scenarios", [])}
+    problems = []
+    for s in results["scenarios"]:
+        if s["errors"]:
+            problems.append(f"{s['name']}: {s['errors']} failed requests")
+        b = base.get(s["name"])
+        if not b:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if s[key] > b[key] * (1 + threshold):
+                problems.append(f"{s['name']}: {key} {s[key]} > baseline {b[key]} (+{threshold:.0%})")
+        if s["throughput_rps"] < b["throughput_rps"] * (1 - threshold):
+            problems.append(f"{s['name']}: throughput {s['throughput_rps']} < baseline {b['throughput_rps']}")
+    return problems
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--quick", action="store_true", help="only stop counts <= 100")
+    ap.add_argument("--iterations", type=int, default=5, help="requests per scenario (at least 2 x concurrency)")
+    ap.add_argument("--ors-latency-ms", type=float, default=20.0, help="simulated ORS latency per call")
+    ap.add_argument("--db-latency-ms", type=float, default=10.0, help="simulated PostgREST latency per call")
+    ap.add_argument("--leg-vertices", type=int, default=20, help="directions vertices per leg")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--only", help="substring filter on scenario names")
+    ap.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "results.json"))
+    ap.add_argument("--baseline", help="results file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    ap.add_argument("--update-baseline", metavar="PATH", help="also write the results to PATH")
+    args = ap.parse_args(argv)
+
+    with ServerThread(ors_app(args.ors_latency_ms, args.leg_vertices)) as ors, \
+            ServerThread(postgrest_app(args.db_latency_ms)) as db:
+        # module-level config is read at import time, so set it before importing the app
+        os.environ.update({
+            "ORS_BASE_URL": ors.url, "ORS_API_KEY": "bench",
+            "SUPABASE_URL": db.url, "SUPABASE_SERVICE_ROLE_KEY": "bench",
+            "REDIS_URL": "", "CACHE_REDIS": "0",
+            "PERSIST_DEADLETTER_PATH": os.devnull,
+        })
+        from Flaskr import create_app
+        app = create_app()
+
+        results = {
+            "meta": {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "ors_latency_ms": args.ors_latency_ms,
+                "db_latency_ms": args.db_latency_ms,
+                "leg_vertices": args.leg_vertices,
+            },
+            "scenarios": [],
+        }
+        for i, sc in enumerate(scenarios(args.quick)):
+            if args.only and args.only not in sc["name"]:
+                continue
+            res = run_scenario(app, sc, args.iterations, args.seed + i)
+            results["scenarios"].append(res)
+            print(f"{res['name']:<36} p50={res['p50_ms']:>9.1f}ms p95={res['p95_ms']:>9.1f}ms "
+                  f"rps={res['throughput_rps']:>7.2f} trips={res['trips_mean']} errors={res['errors']}")
+        results["meta"]["upstream_calls"] = dict(ors.app.config["calls"])
+
+        # drain the write-behind queue while the fake PostgREST is still up
+        from Flaskr import persistence
+        if persistence._writer is not None:
+            persistence._writer.close()
+        results["meta"]["rows_written"] = {t: len(rows) for t, rows in db.app.config["tables"].items()}
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results written to", args.out)
+    if args.update_baseline:
+        with open(args.update_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    problems = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.threshold)
+    else:
+        problems = [f"{s['name']}: {s['errors']} failed requests" for s in results["scenarios"] if s["errors"]]
+    for p in problems:
+        print("REGRESSION:", p)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+import requests
+
+from Flaskr import approx, utils
+from Flaskr.cache import matrix_cache, coord_key, pair_key
+from Flaskr.geometry import haversine_m
+from Flaskr.upstream import CircuitOpen
+
+
+def _coords(n, seed=9):
+    rng = np.random.default_rng(seed)
+    return (np.column_stack((121.05 + rng.uniform(-0.1, 0.1, n), 14.58 + rng.uniform(-0.1, 0.1, n)))).tolist()
+
+
+def test_calibration_learns_circuity_and_speed_from_cached_pairs(monkeypatch):
+    monkeypatch.setattr(approx, "_factors", {})
+    pts = _coords(12)
+    entries = {}
+    for a in pts:
+        for b in pts:
+            if a != b:
+                d = float(haversine_m(a, b)) * 1.6
+                entries[pair_key("test-profile", coord_key(*a), coord_key(*b))] = [d, d / 12.0]
+    matrix_cache.local.set_many(entries)
+    circuity, speed = approx.factors("test-profile")
+    assert abs(circuity - 1.6) < 0.01 and abs(speed - 12.0) < 0.05
+
+
+def test_sparse_matrix_fetches_only_neighbour_pairs():
+    pts = _coords(120)
+    asked = {}
+
+    def fetch(points, profile, needed):
+        a = np.asarray(points)
+        asked["pairs"] = int(needed.sum())
+        d = haversine_m(a[:, None, :], a[None, :, :]) * 2.0
+        return np.where(needed, d, 0.0), np.where(needed, d / 10, 0.0)
+
+    d, t, info, estimated = approx.sparse_matrix(pts, "driving-car", fetch)
+    assert asked["pairs"] == info["pairs_fetched"] < info["pairs_total"] / 4
+    assert np.all(d[~np.eye(120, dtype=bool)] > 0)
+    # the origin's row and column always come from the routing engine
+    a = np.asarray(pts)
+    np.testing.assert_allclose(d[0, 1:], haversine_m(a[0], a[1:]) * 2.0)
+    assert info["pairs_estimated"] == int(estimated.sum()) == info["pairs_total"] - info["pairs_fetched"]
+
+
+def test_sparse_matrix_keeps_stored_and_cached_pairs():
+    pts = _coords(60)
+    a = np.asarray(pts)
+    real = haversine_m(a[:, None, :], a[None, :, :]) * 2.0
+    known = np.zeros(real.shape, dtype=bool)
+    known[:20, :20] = True   # e.g. the first 20 points are in the precomputed store
+
+    def fetch(points, profile, needed):
+        # the store block comes back whole, needed or not
+        d = np.where(known[np.ix_(order, order)] | needed, real[np.ix_(order, order)], 0.0)
+        return d, d / 10
+
+    order = approx.spatial_order(pts)
+    d, t, info, estimated = approx.sparse_matrix(pts, "driving-car", fetch)
+    off = ~np.eye(60, dtype=bool)
+    np.testing.assert_allclose(d[known & off], real[known & off])
+    assert not estimated[known].any() and estimated.any()
+    np.testing.assert_allclose(d[~estimated & off], real[~estimated & off])
+    assert info["pairs_estimated"] == int(estimated.sum())
+
+
+def test_matrix_only_summaries_over_estimated_pairs_are_flagged(monkeypatch):
+    pts = _coords(12)
+    a = np.asarray(pts)
+    real = haversine_m(a[:, None, :], a[None, :, :]) * 2.0
+
+    def fetch(points, profile, needed=None):
+        return np.where(needed, real, 0.0), np.where(needed, real / 10, 0.0)
+
+    monkeypatch.setattr(approx, "spatial_order", lambda coords: np.arange(len(coords)))
+    monkeypatch.setattr(utils, "fetch_matrix", fetch)
+    monkeypatch.setattr(utils, "APPROX_SPARSE_MIN_STOPS", 12)
+    body = {
+        "source_point": {"lon": pts[0][0], "lat": pts[0][1]},
+        "destination_points": [{"lon": x, "lat": y, "payload": 1} for x, y in pts[1:]],
+        "driver_details": {"vehicle_capacity": 20},
+        "mode": "matrix",
+    }
+
+    monkeypatch.setattr(approx, "APPROX_KNN", 1)   # the trip has to use pairs ORS never priced
+    p = utils.optimize_route(body)["properties"]
+    assert p["estimated"] is True and p["matrix"]["estimated_legs"] > 0
+
+    monkeypatch.setattr(approx, "APPROX_KNN", 11)   # every pair is fetched
+    p = utils.optimize_route(body)["properties"]
+    assert "estimated" not in p and p["matrix"]["pairs_estimated"] == 0
+
+
+def test_matrix_outage_falls_back_to_estimates(monkeypatch):
+    def down(*args, **kwargs):
+        raise requests.ConnectionError("ORS unreachable")
+
+    monkeypatch.setattr(utils, "fetch_matrix", down)
+    pts = _coords(6)
+    feature = utils.optimize_route({
+        "source_point": {"lon": pts[0][0], "lat": pts[0][1]},
+        "destination_points": [{"lon": x, "lat": y, "payload": 1} for x, y in pts[1:]],
+        "driver_details": {"vehicle_capacity": 10},
+    })
+    p = feature["properties"]
+    assert p["engine"] == "approx" and p["estimated"] is True
+    assert sorted(p["optimized_order"]) == list(range(5))
+    assert p["summary"]["distance"] > 0 and feature["geometry"] is None
+
+
+def _line_matrix(coords, profile, needed=None):
+    # every point 1 km further along a road, at 10 m/s
+    idx = np.arange(len(coords), dtype=float)
+    d = np.abs(np.subtract.outer(idx, idx)) * 1000.0
+    return d, d / 10.0
+
+
+def _directions_down(*args, **kwargs):
+    raise requests.ConnectionError("ORS directions unreachable")
+
+
+def test_directions_outage_keeps_the_real_matrix(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_matrix", _line_matrix)
+    monkeypatch.setattr(utils, "fetch_directions_many", _directions_down)
+    feature = utils.optimize_route({
+        "source_point": {"lon": 121.0, "lat": 14.5},
+        "destination_points": [{"lon": 121.0 + 0.01 * i, "lat": 14.5, "payload": 1} for i in range(1, 5)],
+        "driver_details": {"vehicle_capacity": 10},
+    })
+    p = feature["properties"]
+    assert p["engine"] == "backend:ors" and "estimated" not in p and "directions" in p["degraded"]
+    assert feature["geometry"] is None and p["summary"]["distance"] == 8000.0
+
+
+def test_point_to_point_directions_outage_uses_the_leg_matrix(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_matrix", _line_matrix)
+    monkeypatch.setattr(utils, "fetch_directions", _directions_down)
+    feature = utils.optimize_route({
+        "source_point": {"lon": 121.0, "lat": 14.5},
+        "destination_points": [{"lon": 121.01, "lat": 14.5, "payload": 1}],
+        "driver_details": {"vehicle_capacity": 10},
+    })
+    p = feature["properties"]
+    assert p["engine"] == "backend:ors" and "estimated" not in p
+    assert p["summary"] == {"distance": 1000.0, "duration": 100.0}
+
+
+def _http_error(code):
+    resp = requests.Response()
+    resp.status_code, resp._content = code, b'{"error": "x"}'
+    return requests.HTTPError(f"{code}", response=resp)
+
+
+@pytest.mark.parametrize("error, falls_back", [
+    (requests.Timeout("slow"), True), (_http_error(429), True), (_http_error(503), True),
+    (CircuitOpen("ors"), True), (_http_error(400), False), (_http_error(403), False),
+])
+def test_only_outages_fall_back_to_estimates(monkeypatch, error, falls_back):
+    def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(utils, "fetch_matrix", fail)
+    feature = utils.optimize_route({
+        "source_point": {"lon": 121.0, "lat": 14.5},
+        "destination_points": [{"lon": 121.01, "lat": 14.5, "payload": 1}, {"lon": 121.02, "lat": 14.5}],
+        "driver_details": {"vehicle_capacity": 10},
+    })
+    if falls_back:
+        assert feature["properties"]["estimated"] is True
+    else:
+        assert feature["error"].startswith(f"ORS matrix error (status {error.response.status_code})")
@@ -0,0 +1,23 @@
+import time
+
+from Flaskr.cache import TTLCache
+
+
+def test_lru_eviction_and_counters():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.set("a", 1)
+    c.set("b", 2)
+    assert c.get("a") == 1      # "a" is now most recently used
+    c.set("c", 3)               # evicts "b"
+    assert c.get("b") is None
+    assert c.get_many(["a", "c"]) == {"a": 1, "c": 3}
+    s = c.stats()
+    assert (s["hits"], s["misses"], s["evictions"]) == (3, 1, 1)
+
+
+def test_entries_expire():
+    c = TTLCache(maxsize=10, ttl=0.01)
+    c.set("a", 1)
+    time.sleep(0.02)
+    assert c.get("a") is None
+    assert len(c) == 0
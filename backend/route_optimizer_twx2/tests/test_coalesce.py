@@ -0,0 +1,84 @@
+import threading, time
+
+from Flaskr import coalesce
+from Flaskr.coalesce import SingleFlight, request_key
+
+
+def test_request_key_ignores_key_order():
+    a = {"source_point": {"lat": 1, "lon": 2}, "destination_points": [{"lat": 3, "lon": 4, "payload": 1}]}
+    b = {"destination_points": [{"payload": 1, "lon": 4, "lat": 3}], "source_point": {"lon": 2, "lat": 1}}
+    assert request_key("optimize_route", a) == request_key("optimize_route", b)
+    assert request_key("optimize_route", a) != request_key("request_route", a)
+
+
+def test_concurrent_identical_calls_share_one_computation():
+    sf, runs, out = SingleFlight(), [], []
+
+    def work():
+        runs.append(1)
+        time.sleep(0.2)
+        return {"ok": True}, 200
+
+    threads = [threading.Thread(target=lambda: out.append(sf.do("k", work))) for _ in range(5)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert len(runs) == 1
+    assert sorted(shared for _, shared in out) == [False, True, True, True, True]
+    assert all(value == ({"ok": True}, 200) for value, _ in out)
+
+
+class FakeRedis:
+    """get / set(nx, px) / eval(_UNLOCK) with expiry, shared by two simulated workers."""
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        item = self.data.get(key)
+        if item and item[1] is not None and item[1] < time.monotonic():
+            del self.data[key]
+            item = None
+        return item
+
+    def get(self, key):
+        with self.lock:
+            item = self._live(key)
+            return item[0] if item else None
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and self._live(key):
+                return False
+            self.data[key] = (value, time.monotonic() + px / 1000.0 if px else None)
+            return True
+
+    def eval(self, script, numkeys, key, token):
+        with self.lock:
+            item = self._live(key)
+            if item and item[0] == token:
+                del self.data[key]
+
+
+def test_cross_worker_shares_only_with_concurrent_requests(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(coalesce, "COALESCE_REDIS", True)
+    monkeypatch.setattr(coalesce, "get_redis", lambda: redis)
+    runs = []
+
+    def work():
+        runs.append(1)
+        time.sleep(0.2)
+        return {"run": len(runs)}, 200
+
+    workers, out = [SingleFlight(), SingleFlight()], []
+    threads = [threading.Thread(target=lambda sf=sf: out.append(sf.do("k", work))) for sf in workers]
+    threads[0].start()
+    time.sleep(0.05)
+    threads[1].start()
+    [t.join() for t in threads]
+    assert len(runs) == 1 and sorted(shared for _, shared in out) == [False, True]
+
+    # the same body again once the leader is done: a new computation, not the old plan
+    value, shared = workers[1].do("k", work)
+    assert len(runs) == 2 and not shared and value == ({"run": 2}, 200)
@@ -0,0 +1,95 @@
+import json, time, threading
+
+import pytest
+import requests
+
+from Flaskr import ors
+from Flaskr.cache import directions_cache
+
+
+class FakeORS:
+    def __init__(self):
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        coords = kwargs["json"]["coordinates"]
+        self.calls.append(coords)
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = json.dumps({"features": [{
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": coords},
+            "properties": {"summary": {"distance": 1200.0, "duration": 140.0},
+                           "segments": [{"distance": 1200.0, "duration": 140.0, "steps": []}]},
+        }]}).encode()
+        return resp
+
+
+def test_cache_hit_makes_no_upstream_call(monkeypatch):
+    fake = FakeORS()
+    monkeypatch.setattr(ors, "upstream", lambda name: fake)
+    directions_cache.local.clear()
+    coords = [[121.011, 14.501], [121.022, 14.512]]
+
+    first = ors.fetch_directions(coords, "driving-car")
+    second = ors.fetch_directions([[121.011000001, 14.501], [121.022, 14.512]], "driving-car")   # same rounded key
+    assert len(fake.calls) == 1
+    assert second["properties"]["summary"] == first["properties"]["summary"]
+
+    ors.fetch_directions(coords, "driving-hgv")   # other profile, other key
+    assert len(fake.calls) == 2
+
+
+def test_returned_feature_is_isolated_from_the_cached_copy(monkeypatch):
+    fake = FakeORS()
+    monkeypatch.setattr(ors, "upstream", lambda name: fake)
+    directions_cache.local.clear()
+    coords = [[121.031, 14.521], [121.042, 14.532]]
+
+    feature = ors.fetch_directions(coords, "driving-car")
+    feature["properties"]["engine"] = "backend:ors"
+    feature["properties"]["summary"]["distance"] = 0.0
+    feature["properties"]["segments"][0]["eta_ml"] = 99
+    feature["properties"]["segments"].append({"distance": 1.0})
+
+    again = ors.fetch_directions(coords, "driving-car")
+    assert len(fake.calls) == 1
+    assert "engine" not in again["properties"]
+    assert again["properties"]["summary"]["distance"] == 1200.0
+    assert again["properties"]["segments"] == [{"distance": 1200.0, "duration": 140.0, "steps": []}]
+
+
+def test_many_returns_input_order_when_calls_finish_out_of_order(monkeypatch):
+    delays = [0.15, 0.0, 0.1, 0.05]
+
+    def fake(coords, profile):
+        time.sleep(delays[coords[0][0]])
+        return {"properties": {"trip": coords[0][0]}}
+
+    monkeypatch.setattr(ors, "fetch_directions", fake)
+    features = ors.fetch_directions_many([[[i, 0], [i, 1]] for i in range(4)], "driving-car", max_workers=4)
+    assert [f["properties"]["trip"] for f in features] == [0, 1, 2, 3]
+
+
+def test_many_first_failure_cancels_pending_calls_and_is_reraised(monkeypatch):
+    release, started = threading.Event(), []
+
+    def fake(coords, profile):
+        i = coords[0][0]
+        started.append(i)
+        if i == 0:
+            release.wait(2)   # a straggler the caller must not wait for
+        elif i == 1:
+            raise requests.HTTPError("ORS 500")
+        else:
+            time.sleep(0.2)
+        return {"properties": {"trip": i}}
+
+    monkeypatch.setattr(ors, "fetch_directions", fake)
+    t0 = time.monotonic()
+    with pytest.raises(requests.HTTPError, match="ORS 500"):
+        ors.fetch_directions_many([[[i, 0], [i, 1]] for i in range(8)], "driving-car", max_workers=2)
+    assert time.monotonic() - t0 < 1.0
+    release.set()
+    time.sleep(0.3)
+    assert len(started) <= 3   # the failing worker may pick up one more before the rest are cancelled
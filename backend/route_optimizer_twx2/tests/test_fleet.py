@@ -0,0 +1,98 @@
+import numpy as np
+
+from Flaskr import fleet, utils
+from Flaskr.fleet import partition, optimize_fleet
+from Flaskr.geometry import haversine_m
+
+
+def _stops(n, seed=5):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((121.05 + rng.uniform(-0.1, 0.1, n), 14.58 + rng.uniform(-0.1, 0.1, n)))
+
+
+def test_partition_respects_capacity_and_is_deterministic():
+    stops = _stops(200)
+    labels, overflow = partition(stops, [1.0] * 200, [12.0] * 20)
+    assert overflow == []
+    assert np.bincount(labels, minlength=20).max() <= 12
+    again, _ = partition(stops, [1.0] * 200, [12.0] * 20)
+    assert np.array_equal(labels, again)
+
+
+def test_fleet_returns_one_feature_per_vehicle(monkeypatch):
+    def fake_matrix(coords, profile):
+        a = np.asarray(coords, dtype=float)
+        D = haversine_m(a[:, None, :], a[None, :, :])
+        return D, D / 10.0
+
+    monkeypatch.setattr(utils, "fetch_matrix", fake_matrix)
+    stops = _stops(30)
+    body = {
+        "source_point": {"lon": 121.05, "lat": 14.58},
+        "destination_points": [{"lon": x, "lat": y, "payload": 1} for x, y in stops.tolist()],
+        "vehicles": [{"vehicle_id": f"van-{i}", "vehicle_capacity": 8} for i in range(5)],
+        "mode": "matrix",
+    }
+    fc = optimize_fleet(body)
+    assert fc["type"] == "FeatureCollection" and len(fc["features"]) == 5
+    served = sorted(i for f in fc["features"] for i in f["properties"]["optimized_order_global"])
+    assert served == list(range(30))
+    assert all(f["properties"]["summary"]["trips"] <= 1 for f in fc["features"])
+    fleet = fc["properties"]["fleet"]
+    assert fleet["stops"] == 30 and fleet["over_capacity"] == []
+    assert abs(fleet["distance"] - sum(f["properties"]["summary"]["distance"] for f in fc["features"])) < 1e-6
+
+
+def _road_matrix(coords, profile):
+    # roads 1.5x the great-circle distance: the partition's crow-flies check passes, the solve does not
+    a = np.asarray(coords, dtype=float)
+    D = haversine_m(a[:, None, :], a[None, :, :]) * 1.5
+    return D, D / 10.0
+
+
+def test_stops_out_of_a_vehicles_reach_move_or_come_back_unassigned(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_matrix", _road_matrix)
+    lon = [121.0 + 0.01 * i for i in range(21)]   # stops 1..19 on a line between two depots
+    leg = float(haversine_m(np.array([121.0, 14.5]), np.array([121.01, 14.5])))
+    body = {
+        "destination_points": [{"lon": x, "lat": 14.5, "payload": 1} for x in lon[1:20]],
+        "vehicles": [
+            # by road, each reaches the five stops nearest to its depot
+            {"vehicle_id": "west", "start_point": {"lon": lon[0], "lat": 14.5}, "maximum_distance": 3 * 5.5 * leg},
+            {"vehicle_id": "east", "start_point": {"lon": lon[20], "lat": 14.5}, "maximum_distance": 3 * 5.5 * leg},
+        ],
+        "mode": "matrix",
+    }
+    fc = optimize_fleet(body)
+    west, east = (f["properties"]["destination_indexes"] for f in fc["features"])
+    assert west == [0, 1, 2, 3, 4] and east == [14, 15, 16, 17, 18]
+    assert fc["properties"]["fleet"]["unassigned"] == list(range(5, 14))
+
+    body["vehicles"][1].pop("maximum_distance")   # east can go anywhere: it takes the rest
+    fc = optimize_fleet(body)
+    west, east = (f["properties"]["destination_indexes"] for f in fc["features"])
+    assert west == [0, 1, 2, 3, 4] and east == list(range(5, 19))
+    assert fc["properties"]["fleet"]["unassigned"] == []
+
+
+def test_parallel_solve_on_the_spawn_process_pool(monkeypatch):
+    monkeypatch.setattr(utils, "fetch_matrix", _road_matrix)
+    monkeypatch.setattr(fleet, "FLEET_PROCESSES", 2)
+    monkeypatch.setattr(fleet, "FLEET_PROCESS_MIN_STOPS", 5)
+    monkeypatch.setattr(fleet, "_process_pool", None)
+    stops = _stops(24)
+    body = {
+        "source_point": {"lon": 121.05, "lat": 14.58},
+        "destination_points": [{"lon": x, "lat": y, "payload": 1} for x, y in stops.tolist()],
+        "vehicles": [{"vehicle_id": f"van-{i}", "vehicle_capacity": 6} for i in range(4)],
+        "mode": "matrix",
+    }
+    try:
+        fc = optimize_fleet(body)
+        assert fc["properties"]["fleet"]["parallel_solve"] is True
+        served = sorted(i for f in fc["features"] for i in f["properties"]["optimized_order_global"])
+        assert served == list(range(24)) and fleet._process_pool is not None
+        assert all(f["properties"]["summary"]["trips"] == 1 for f in fc["features"])
+    finally:
+        if fleet._process_pool is not None:
+            fleet._process_pool.shutdown()
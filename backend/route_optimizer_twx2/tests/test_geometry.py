@@ -0,0 +1,49 @@
+import numpy as np
+
+from Flaskr.geometry import (encode_polyline, decode_polyline, simplify, shape_geometry, bbox_of, path_length_m,
+                            concat_coords, encode_geometry_for_storage, decode_geometry)
+
+
+def test_polyline_matches_reference_encoding():
+    # Google's documented example (lat/lon order inside the string)
+    coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert encode_polyline(coords) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert np.allclose(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), coords)
+
+
+def test_polyline6_round_trip_is_lossless():
+    coords = [[121.056882, 14.584524], [121.056625, 14.584532], [121.056009, 14.584549]]
+    assert decode_polyline(encode_polyline(coords, 6), 6) == coords
+
+
+def test_simplify_keeps_endpoints_and_drops_collinear_points():
+    line = [[121.0 + i * 1e-4, 14.5] for i in range(100)] + [[121.01, 14.51]]
+    out = simplify(line, tolerance_m=1.0)
+    assert out.tolist() == [line[0], line[99], line[100]]
+
+
+def test_shape_geometry_encodes_on_request():
+    f = {"geometry": {"type": "LineString", "coordinates": [[121.0, 14.5], [121.1, 14.6]]}}
+    assert shape_geometry(f, {"geometry_format": "polyline6"}) is None
+    assert f["geometry"]["encoding"] == "polyline6"
+    assert shape_geometry(f, {"geometry_format": "wkt"}) == "unknown geometry_format 'wkt'"
+
+
+def test_array_geometry_bbox_length_and_json_boundary():
+    coords = concat_coords([[[121.0, 14.5], [121.01, 14.5]], np.array([[121.01, 14.49]])])
+    assert coords.shape == (3, 2)
+    assert bbox_of(coords) == [121.0, 14.49, 121.01, 14.5]
+    # ~1.08 km east + ~1.11 km south
+    assert 2150 < path_length_m(coords) < 2220
+
+    feature = {"geometry": {"type": "LineString", "coordinates": coords}}
+    assert shape_geometry(feature, {}) is None
+    assert isinstance(feature["geometry"]["coordinates"], list)
+
+
+def test_storage_stays_geojson_unless_a_polyline_is_asked_for():
+    line = {"type": "LineString", "coordinates": [[121.0, 14.5], [121.001234, 14.512345]]}
+    assert encode_geometry_for_storage(line) == line
+    stored = encode_geometry_for_storage(line, "polyline6")
+    assert stored["encoding"] == "polyline6" and isinstance(stored["coordinates"], str)
+    assert decode_geometry(stored) == line
@@ -0,0 +1,76 @@
+import time, threading
+
+import pytest
+
+from Flaskr import create_app, health, routes
+
+
+class Checks:
+    """Three checks that count their calls; `slow` makes every later probe block."""
+
+    def __init__(self):
+        self.calls = 0
+        self.slow = threading.Event()
+
+    def check(self, status="ok"):
+        def fn():
+            self.calls += 1
+            if self.slow.is_set():
+                time.sleep(1)
+            return {"status": status, "latency_ms": 0}
+        return fn
+
+
+@pytest.fixture
+def checks():
+    return Checks()
+
+
+@pytest.fixture
+def prober(checks, monkeypatch):
+    monkeypatch.setattr(health, "HEALTH_FRESH_MIN_INTERVAL", 0.05)
+    p = health.HealthProber({"engine": checks.check(), "redis": checks.check("skipped"),
+                             "supabase": checks.check()}, interval=3600)
+    monkeypatch.setattr(routes, "get_prober", lambda rest, headers: p)
+    return p
+
+
+def test_cached_results_and_fresh_reprobe(prober, checks):
+    first, at = prober.results()            # nothing cached yet: probes once, in parallel
+    assert checks.calls == 3 and first["engine"]["status"] == "ok" and "checked_at" in first["engine"]
+    again, at2 = prober.results()
+    assert checks.calls == 3 and at2 == at
+
+    prober.results(fresh=True)              # within HEALTH_FRESH_MIN_INTERVAL: still cached
+    assert checks.calls == 3
+    time.sleep(0.06)
+    _, at3 = prober.results(fresh=True)
+    assert checks.calls == 6 and at3 > at
+
+
+def test_probes_run_in_parallel(prober, checks):
+    prober.results()
+    checks.slow.set()
+    t0 = time.monotonic()
+    prober.probe()
+    assert time.monotonic() - t0 < 1.9      # three 1 s checks, not 3 s
+
+
+def test_endpoint_serves_the_cache_without_waiting_for_the_network(prober, checks):
+    client = create_app().test_client()
+    body = client.get("/api/health").get_json()
+    assert body["status"] == "ok" and body["stale"] is False and body["db"] is True
+
+    checks.slow.set()                       # the network hangs from now on
+    worker = threading.Thread(target=prober.probe)   # a background probe is in flight
+    worker.start()
+    t0 = time.monotonic()
+    body = client.get("/api/health").get_json()
+    assert time.monotonic() - t0 < 0.5
+    assert body["checks"]["engine"]["status"] == "ok"
+    worker.join()
+
+    results, checked_at = prober._snapshot      # the prober thread has stopped refreshing
+    prober._snapshot = (results, checked_at - 3 * prober.interval)
+    body = client.get("/api/health").get_json()
+    assert body["stale"] is True and body["age_s"] > 2 * prober.interval
@@ -0,0 +1,174 @@
+import re, json, time
+
+import pytest
+import requests
+
+from Flaskr import cache, create_app, routes
+from Flaskr.cache import TieredCache
+
+
+class FakePostgREST:
+    """Just enough of /route_requests for the history endpoints (keyset `or`, id=eq., DELETE)."""
+
+    KEYSET = re.compile(r'\(request_time\.lt\."(.+)",and\(request_time\.eq\."(.+)",id\.lt\.(.+)\)\)')
+
+    def __init__(self):
+        self.rows = []
+        self.gets = 0
+
+    def add(self, rid, request_time, result=True):
+        self.rows.append({
+            "id": rid, "request_time": request_time, "origin_id": "depot", "engine": "default",
+            "vehicle_id": "van", "stops": {"destination_ids": ["a", "b"]}, "status": "completed",
+            "route_results": [{"total_distance": 1000.0, "optimized_order": [1, 0], "geometry": None}] if result else [],
+        })
+
+    def get(self, url, params=None, **kwargs):
+        self.gets += 1
+        rows = sorted(self.rows, key=lambda r: (r["request_time"], r["id"]), reverse=True)
+        if "id" in params:
+            rows = [r for r in rows if r["id"] == params["id"][len("eq."):]]
+        if "or" in params:
+            lt, eq, after_id = self.KEYSET.fullmatch(params["or"]).groups()
+            assert lt == eq
+            rows = [r for r in rows if r["request_time"] < lt or (r["request_time"] == eq and r["id"] < after_id)]
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = json.dumps(rows[:int(params.get("limit", 1000))]).encode()
+        return resp
+
+    def delete(self, url, params=None, **kwargs):
+        self.rows = [r for r in self.rows if r["id"] != params["id"][len("eq."):]]
+        resp = requests.Response()
+        resp.status_code = 204
+        return resp
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakePostgREST()
+    monkeypatch.setattr(routes, "upstream", lambda name: fake)
+    monkeypatch.setattr(routes, "REST", "http://db.invalid/rest/v1")
+    monkeypatch.setattr(routes, "SUPABASE_SERVICE_KEY", "test-key")
+    routes._history_pages.local.clear()
+    routes._history_details.local.clear()
+    return fake
+
+
+@pytest.fixture
+def client():
+    return create_app().test_client()
+
+
+def _ids(resp):
+    return [item["request_id"] for item in resp.get_json()["items"]]
+
+
+def test_cursor_pages_are_stable_when_new_rows_arrive(db, client):
+    # two rows share a timestamp: the id breaks the tie
+    for i, t in enumerate(["2026-05-01T10:00", "2026-05-01T11:00", "2026-05-01T11:00",
+                           "2026-05-01T12:00", "2026-05-01T13:00", "2026-05-01T14:00", "2026-05-01T15:00"]):
+        db.add(f"r{i}", t)
+
+    first = client.get("/api/history?limit=3")
+    assert _ids(first) == ["r6", "r5", "r4"]
+    db.add("r7", "2026-05-01T16:00")   # a newer route must not shift the next pages
+    second = client.get(f"/api/history?limit=3&cursor={first.get_json()['next_cursor']}")
+    assert _ids(second) == ["r3", "r2", "r1"]
+    third = client.get(f"/api/history?limit=3&cursor={second.get_json()['next_cursor']}")
+    assert _ids(third) == ["r0"] and third.get_json()["next_cursor"] is None
+
+    assert client.get("/api/history?cursor=not-a-cursor").status_code == 400
+    assert client.get("/api/history?fields=request_id,nope").status_code == 400
+    assert client.get("/api/history?fields=request_id").get_json()["items"][0] == {"request_id": "r7"}
+
+
+def test_etag_revalidation_and_new_row(db, client):
+    db.add("r0", "2026-05-01T10:00")
+    first = client.get("/api/history")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and etag
+
+    gets = db.gets
+    again = client.get("/api/history", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["ETag"] == etag
+    assert db.gets == gets   # served from the page cache
+
+    db.add("r1", "2026-05-01T11:00")
+    routes._history_pages.bump()   # what persist_request_and_result does on every save
+    changed = client.get("/api/history", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+    assert _ids(changed) == ["r1", "r0"]
+
+
+def test_detail_cache_hit_miss_and_invalidation(db, client):
+    db.add("r0", "2026-05-01T10:00")
+    miss = client.get("/api/history/r0")
+    assert miss.status_code == 200 and db.gets == 1
+    hit = client.get("/api/history/r0")
+    assert hit.get_json() == miss.get_json() and hit.headers["ETag"] == miss.headers["ETag"]
+    assert db.gets == 1
+    assert client.get("/api/history/r0", headers={"If-None-Match": miss.headers["ETag"]}).status_code == 304
+
+    assert client.delete("/api/history/r0").status_code == 204
+    assert client.get("/api/history/r0").status_code == 404
+    assert db.gets == 2
+
+
+def test_detail_without_result_is_not_cached_and_entries_expire(db, client, monkeypatch):
+    db.add("r0", "2026-05-01T10:00", result=False)   # write-behind has not stored the result yet
+    assert client.get("/api/history/r0").get_json()["result"] is None
+    db.rows[0]["route_results"] = [{"total_distance": 5.0, "geometry": None}]
+    assert client.get("/api/history/r0").get_json()["result"]["total_distance"] == 5.0
+    assert db.gets == 2
+
+    monkeypatch.setattr(routes._history_details.local, "ttl", 0.01)
+    db.add("r1", "2026-05-01T11:00")
+    client.get("/api/history/r1")
+    time.sleep(0.02)
+    client.get("/api/history/r1")
+    assert db.gets == 4
+
+
+class FakeRedis:
+    """The slice of redis-py TieredCache uses, shared by every simulated worker."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self, transaction=False):
+        return self
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def execute(self):
+        pass
+
+
+def test_list_cache_is_shared_and_invalidated_across_workers(db, client, monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+    db.add("r0", "2026-05-01T10:00")
+    assert _ids(client.get("/api/history")) == ["r0"] and db.gets == 1
+
+    routes._history_pages.local.clear()   # another worker: empty local tier, same Redis
+    assert _ids(client.get("/api/history")) == ["r0"] and db.gets == 1
+
+    # that worker deletes the route: its bump reaches this worker's next lookup
+    other = TieredCache("history:page", maxsize=8, ttl=5)
+    db.rows.clear()
+    other.bump()
+    assert _ids(client.get("/api/history")) == [] and db.gets == 2
@@ -0,0 +1,78 @@
+import threading, time
+
+import pytest
+
+from Flaskr import create_app, jobs
+
+
+def _wait_for(queue, job_id, status, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job and job["status"] == status:
+            return job
+        time.sleep(0.005)
+    raise AssertionError(f"job {job_id} never reached {status}: {queue.get(job_id)}")
+
+
+@pytest.fixture
+def app():
+    return create_app()
+
+
+@pytest.fixture
+def gated(app, monkeypatch):
+    """A job queue whose runner blocks until `release` is set; returned as (queue, release)."""
+    release = threading.Event()
+
+    def runner(payload):
+        release.wait(2)
+        if payload.get("fail"):
+            return {"error": "no route"}, 400
+        return {"type": "Feature", "properties": {"stops": len(payload["destination_points"])}}, 200
+
+    queue = jobs.InProcessJobQueue(app, runner, workers=1)
+    monkeypatch.setattr(jobs, "_queue", queue)
+    return queue, release
+
+
+def test_lifecycle_queued_running_completed(gated):
+    queue, release = gated
+    first = queue.submit({"destination_points": [{}, {}]})
+    second = queue.submit({"destination_points": [{}]})   # one worker: waits behind the first
+
+    _wait_for(queue, first, "running")
+    assert queue.get(second)["status"] == "queued"
+    release.set()
+    done = _wait_for(queue, first, "completed")
+    assert done["http_status"] == 200 and done["result"]["properties"]["stops"] == 2
+    assert done["created_at"] <= done["started_at"] <= done["finished_at"]
+    _wait_for(queue, second, "completed")
+
+
+def test_failed_job_keeps_the_error(gated):
+    queue, release = gated
+    release.set()
+    job = _wait_for(queue, queue.submit({"destination_points": [{}], "fail": True}), "failed")
+    assert job["http_status"] == 400 and job["error"] == "no route"
+
+
+def test_status_endpoint_and_result_after_completion(app, gated):
+    queue, release = gated
+    client = app.test_client()
+    assert client.post("/api/jobs", json={}).status_code == 400
+    resp = client.post("/api/jobs", json={"destination_points": [{}, {}, {}]})
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+    assert resp.get_json()["url"] == f"/api/jobs/{job_id}"
+
+    _wait_for(queue, job_id, "running")
+    body = client.get(f"/api/jobs/{job_id}").get_json()
+    assert body["status"] == "running" and body["result"] is None and "payload" not in body
+
+    release.set()
+    _wait_for(queue, job_id, "completed")
+    for _ in range(2):   # still readable after completion, as often as the client polls
+        body = client.get(f"/api/jobs/{job_id}").get_json()
+        assert body["status"] == "completed" and body["result"]["properties"]["stops"] == 3
+    assert client.get("/api/jobs/nope").status_code == 404
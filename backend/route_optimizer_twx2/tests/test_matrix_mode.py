@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from Flaskr import utils
+
+
+@pytest.fixture
+def fake_matrix(monkeypatch):
+    # origin + 4 stops on a line, 1 km apart, at 10 m/s
+    D = np.abs(np.subtract.outer(np.arange(5.0), np.arange(5.0))) * 1000.0
+
+    def fetch(coords, profile, needed=None):
+        assert len(coords) == 5
+        return D, D / 10.0
+
+    def no_directions(*args, **kwargs):
+        raise AssertionError("matrix mode must not call directions")
+
+    monkeypatch.setattr(utils, "fetch_matrix", fetch)
+    monkeypatch.setattr(utils, "fetch_directions_many", no_directions)
+    return D
+
+
+@pytest.mark.parametrize("flag", [{"geometry": False}, {"mode": "matrix"}])
+def test_matrix_only_summaries_and_trips(fake_matrix, flag):
+    body = {
+        "source_point": {"lon": 121.0, "lat": 14.5},
+        "destination_points": [{"lon": 121.0 + 0.01 * i, "lat": 14.5, "payload": 1} for i in range(1, 5)],
+        "driver_details": {"vehicle_capacity": 2},
+        **flag,
+    }
+    feature = utils.optimize_route(body)
+    p = feature["properties"]
+    assert feature["geometry"] is None
+    assert p["engine"] == "backend:ors" and "estimated" not in p
+
+    # capacity 2 -> two trips; each trip's totals are the sum of its legs
+    assert p["summary"]["trips"] == len(p["trips"]) == 2
+    assert sorted(s for t in p["trips"] for s in t["stops"]) == [0, 1, 2, 3]
+    assert len(p["segments"]) == sum(len(t["stops"]) + 1 for t in p["trips"])
+    for t in p["trips"]:
+        path = [0] + [s + 1 for s in t["stops"]] + [0]
+        assert t["distance"] == sum(fake_matrix[a, b] for a, b in zip(path, path[1:]))
+        assert t["duration"] == pytest.approx(t["distance"] / 10.0)
+    assert p["summary"]["distance"] == sum(t["distance"] for t in p["trips"]) == 12000.0
+    assert p["summary"]["duration"] == pytest.approx(1200.0)
+    assert all("steps" not in s for s in p["segments"])
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from Flaskr import ors, matrix_store
+from Flaskr.geometry import haversine_m
+
+
+def _locations(n, seed=11):
+    rng = np.random.default_rng(seed)
+    return [{"id": i, "lon": 121.05 + x, "lat": 14.58 + y} for i, (x, y) in enumerate(rng.uniform(-0.1, 0.1, (n, 2)).tolist())]
+
+
+@pytest.fixture
+def fake_tiles(monkeypatch):
+    fetched = []
+
+    def fetch(points_coords, tiles, profile_type):
+        a = np.asarray(points_coords)
+        out = []
+        for sources, destinations in tiles:
+            fetched.append((len(sources), len(destinations)))
+            d = haversine_m(a[sources][:, None, :], a[destinations][None, :, :])
+            out.append((d, d / 10.0))
+        return out
+
+    monkeypatch.setattr(ors, "_fetch_tiles", fetch)
+    return fetched
+
+
+def test_incremental_build_fetches_only_new_rows_and_columns(tmp_path, fake_tiles):
+    locs = _locations(60)
+    first = matrix_store.build("driving-car", locs[:50], directory=tmp_path)
+    assert first["locations"] == 50 and first["build"] == 1
+    cells_full = sum(r * c for r, c in fake_tiles)
+
+    fake_tiles.clear()
+    second = matrix_store.build("driving-car", locs, directory=tmp_path)
+    assert second["added"] == 10 and second["build"] == 2
+    assert sum(r * c for r, c in fake_tiles) < cells_full   # 10 rows + 10 columns, not 60 x 60
+
+    store = matrix_store.MatrixStore(matrix_store.store_path("driving-car", tmp_path))
+    a = np.array([[l["lon"], l["lat"]] for l in locs])
+    expected = haversine_m(a[:, None, :], a[None, :, :])
+    np.testing.assert_allclose(store.distances, expected, rtol=1e-6, atol=0.01)
+    assert matrix_store.build("driving-car", locs, directory=tmp_path)["added"] == 0
+
+
+def test_known_locations_need_no_upstream_call(tmp_path, fake_tiles, monkeypatch):
+    locs = _locations(20)
+    matrix_store.build("driving-car", locs, directory=tmp_path)
+    monkeypatch.setattr(matrix_store, "MATRIX_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(matrix_store, "_stores", {})
+
+    fake_tiles.clear()
+    coords = [[l["lon"], l["lat"]] for l in locs[5:12]]
+    dist, _ = ors.fetch_matrix(coords, "driving-car")
+    assert fake_tiles == []
+    a = np.asarray(coords)
+    np.testing.assert_allclose(dist, haversine_m(a[:, None, :], a[None, :, :]), rtol=1e-6, atol=0.01)
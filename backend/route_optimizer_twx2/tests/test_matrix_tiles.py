@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+import pytest
+import requests
+
+from Flaskr import ors, upstream as up
+from Flaskr.cache import matrix_cache, coord_key, pair_key
+from Flaskr.geometry import haversine_m
+
+
+def _coords(n, seed=21):
+    rng = np.random.default_rng(seed)
+    return np.column_stack((121.05 + rng.uniform(-0.1, 0.1, n), 14.58 + rng.uniform(-0.1, 0.1, n))).tolist()
+
+
+class FakeMatrixAPI:
+    """Stands in for requests.Session.request against /v2/matrix; `replies` scripts status codes."""
+
+    def __init__(self, unroutable=(), replies=()):
+        self.unroutable = set(unroutable)   # (lon, lat) destinations ORS cannot reach
+        self.replies = list(replies)
+        self.calls = []
+
+    def __call__(self, method, url, **kwargs):
+        body = kwargs["json"]
+        self.calls.append((body["sources"], body["destinations"]))
+        resp = requests.Response()
+        resp.status_code = self.replies.pop(0) if self.replies else 200
+        if resp.status_code != 200:
+            resp._content = b'{"error": "nope"}'
+            return resp
+        locs = np.asarray(body["locations"])
+        dist = [[None if tuple(locs[d]) in self.unroutable else float(haversine_m(locs[s], locs[d]))
+                 for d in body["destinations"]] for s in body["sources"]]
+        dur = [[None if x is None else x / 10.0 for x in row] for row in dist]
+        resp._content = json.dumps({"distances": dist, "durations": dur}).encode()
+        return resp
+
+
+@pytest.fixture
+def ors_client(monkeypatch):
+    client = up.Upstream("ors-test", timeout=5, retries=3, pool_size=4)
+    monkeypatch.setattr(ors, "upstream", lambda name: client)
+    monkeypatch.setattr(ors, "MATRIX_TILE", 4)
+    monkeypatch.setattr(up.time, "sleep", lambda s: None)   # no retry backoff in tests
+    matrix_cache.local.clear()
+    return client
+
+
+def test_large_matrix_is_assembled_from_tiles(ors_client, monkeypatch):
+    pts = _coords(11)
+    api = FakeMatrixAPI(unroutable=[tuple(pts[9])])
+    monkeypatch.setattr(ors_client.session, "request", api)
+    a = np.asarray(pts)
+    expected = haversine_m(a[:, None, :], a[None, :, :])
+
+    # one fully cached tile (with values ORS would not return) needs no call
+    keys = [coord_key(*p) for p in pts]
+    matrix_cache.set_many({pair_key("driving-car", keys[i], keys[j]): [1.0, 2.0]
+                           for i in range(4) for j in range(4, 8)})
+
+    dist, dur = ors.fetch_matrix(pts, "driving-car")
+    assert len(api.calls) == 8   # 3 x 3 tiles of at most 4 x 4 on an 11 x 11 matrix, one cached
+    assert all(len(s) <= 4 and len(d) <= 4 for s, d in api.calls)
+
+    cached = np.zeros((11, 11), dtype=bool)
+    cached[:4, 4:8] = True
+    assert np.all(dist[cached] == 1.0) and np.all(dur[cached] == 2.0)
+    assert np.all(np.isnan(dist[np.arange(11) != 9, 9]))
+    routable = ~cached & ~np.eye(11, dtype=bool)
+    routable[:, 9] = False
+    np.testing.assert_allclose(dist[routable], expected[routable], rtol=1e-9)
+    np.testing.assert_allclose(dur[routable], expected[routable] / 10.0, rtol=1e-9)
+
+    # fetched pairs are cached now, NaN pairs are not
+    api.calls.clear()
+    again, _ = ors.fetch_matrix(pts, "driving-car")
+    assert len(api.calls) == 3 and all(len(d) == 1 for _, d in api.calls)   # just column 9, per row block
+    np.testing.assert_allclose(again[routable], dist[routable])
+
+
+def test_tile_is_retried_on_its_own(ors_client, monkeypatch):
+    api = FakeMatrixAPI(replies=[503])
+    monkeypatch.setattr(ors_client.session, "request", api)
+    pts = _coords(6, seed=22)
+    dist, _ = ors.fetch_matrix(pts, "driving-car")
+    assert len(api.calls) == 5   # 4 tiles, one of them twice
+    assert ors_client.stats["retries"] == 1
+    a = np.asarray(pts)
+    np.testing.assert_allclose(dist, haversine_m(a[:, None, :], a[None, :, :]), rtol=1e-9)
+
+
+def test_tile_failure_is_raised(ors_client, monkeypatch):
+    api = FakeMatrixAPI(replies=[400])   # not retryable
+    monkeypatch.setattr(ors_client.session, "request", api)
+    with pytest.raises(requests.HTTPError):
+        ors.fetch_matrix(_coords(6, seed=23), "driving-car")
+    assert ors_client.stats["retries"] == 0
@@ -0,0 +1,36 @@
+from flask import Flask
+
+from Flaskr import metrics
+
+
+def test_stage_timings_reach_server_timing_and_histogram():
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route("/work")
+    def work():
+        with metrics.stage("unit_test_stage"):
+            pass
+        return "ok"
+
+    resp = app.test_client().get("/work")
+    assert resp.headers["Server-Timing"].startswith("unit_test_stage;dur=")
+    assert "total;dur=" in resp.headers["Server-Timing"]
+
+    text = metrics.render({"matrix": {"hits": 3, "misses": 1, "evictions": 0, "size": 4}})
+    assert 'routest_stage_seconds_count{stage="unit_test_stage"} 1' in text
+    assert 'routest_stage_seconds_bucket{stage="unit_test_stage",le="+Inf"} 1' in text
+    assert 'routest_http_responses_total{endpoint="/work",method="GET",code="200"} 1' in text
+    assert 'routest_cache_hits_total{cache="matrix"} 3' in text
+
+
+def test_upstream_endpoint_labels_are_a_fixed_set():
+    assert metrics.upstream_endpoint("https://ors.invalid/ors/v2/matrix/driving-hgv") == "/v2/matrix/{profile}"
+    assert metrics.upstream_endpoint("https://ors.invalid/v2/directions/foot-walking/geojson") == \
+        "/v2/directions/{profile}/geojson"
+    assert metrics.upstream_endpoint("https://db.invalid/rest/v1/route_requests?id=eq.42") == "/rest/v1/route_requests"
+    assert metrics.upstream_endpoint("http://peer.invalid/api/update_tracker/batch") == "/api/update_tracker/batch"
+    assert metrics.upstream_endpoint("https://ors.invalid") == "/"
+    # caller-supplied targets and ids in the path must not mint new series
+    assert metrics.upstream_endpoint("http://anything.invalid/hook/8f3a2c") == "other"
+    assert metrics.upstream_endpoint("https://db.invalid/rest/v1/route_requests/8f3a2c") == "other"
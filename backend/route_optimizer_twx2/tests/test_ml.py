@@ -0,0 +1,109 @@
+import datetime as dt
+
+import pytest
+
+from Flaskr import ml
+
+
+class FakeModel:
+    """predict() returns distance_km * 2 minutes and remembers the matrix it saw."""
+
+    def __init__(self):
+        self.seen = []
+
+    def predict(self, X):
+        self.seen.append(X)
+        return X[:, ml.FEATURE_COLUMNS.index("distance_km")] * 2.0
+
+
+class FakeBooster:
+    def __init__(self, names):
+        self.feature_names = names
+        self.seen = []
+
+    def inplace_predict(self, X, validate_features=True):
+        self.seen.append(X)
+        return X[:, self.feature_names.index("distance_km")]
+
+
+class FakeXGB:
+    def __init__(self, names):
+        self.booster = FakeBooster(names)
+
+    def get_booster(self):
+        return self.booster
+
+    def predict(self, X):
+        raise AssertionError("XGBoost models are scored through the booster")
+
+
+@pytest.fixture
+def model(monkeypatch):
+    m = FakeModel()
+    monkeypatch.setattr(ml, "_model", m)
+    return m
+
+
+def test_feature_columns_keep_the_training_layout():
+    assert ml.FEATURE_COLUMNS == [
+        "weather_Cloudy", "weather_Stormy", "weather_Sunny", "weather_Windy",
+        "traffic_High", "traffic_Jam", "traffic_Low", "traffic_Medium",
+        "weekday_ordered", "hour_ordered", "distance_km", "driver_age",
+    ]
+    X, pickups = ml.build_features([
+        {"weather": "Stormy", "traffic": "Jam", "distance_m": 2500,
+         "pickup_time": "2026-03-04T17:30:00", "driver_age": 41},   # a Wednesday
+        {"weather": "Foggy", "pickup_time": dt.datetime(2026, 3, 8, 6)},   # unknown weather, defaults
+    ])
+    assert X[0].tolist() == [0, 1, 0, 0, 0, 1, 0, 0, 2, 17, 2.5, 41]
+    assert X[1].tolist() == [0, 0, 0, 0, 0, 0, 1, 0, 6, 6, 0, 30]
+    assert pickups[1] == dt.datetime(2026, 3, 8, 6)
+
+
+def test_batch_is_one_model_call_in_input_order(model):
+    out = ml.predict_eta_batch([
+        {"distance_m": d, "pickup_time": "2026-03-04T08:00:00"} for d in (3000, 1000, 2000)
+    ])
+    assert len(model.seen) == 1 and model.seen[0].shape == (3, len(ml.FEATURE_COLUMNS))
+    assert [m for m, _ in out] == [6.0, 2.0, 4.0]
+    assert out[0][1] == "2026-03-04T08:06:00"
+    assert ml.predict_eta_batch([]) == []
+
+
+def test_booster_gets_columns_in_its_own_order(monkeypatch):
+    names = ["distance_km", "hour_ordered"] + [c for c in ml.FEATURE_COLUMNS if c not in ("distance_km", "hour_ordered")]
+    xgb = FakeXGB(names)
+    monkeypatch.setattr(ml, "_model", xgb)
+    out = ml.predict_eta_batch([{"distance_m": 7000, "pickup_time": "2026-03-04T09:00:00"}])
+    X = xgb.booster.seen[0]
+    assert X[0, 0] == 7.0 and X[0, 1] == 9.0
+    assert out[0][0] == 7.0
+
+
+def test_unavailable_model_returns_none(monkeypatch):
+    monkeypatch.setattr(ml, "_model", "ERROR:missing")
+    assert ml.predict_eta_batch([{"distance_m": 1000}]) is None
+
+
+def test_per_leg_etas_for_a_multi_trip_route(model):
+    from Flaskr.routes import _apply_ml_eta
+
+    # trip 0 serves destinations 1 then 0 (3 legs), trip 1 serves destination 2 (2 legs)
+    segments = [{"distance": 1000.0 * k, "duration": 60.0} for k in range(1, 6)]
+    feature = {"properties": {
+        "segments": segments,
+        "trips": [{"stops": [1, 0]}, {"stops": [2]}],
+        "summary": {"distance": 15000.0, "duration": 300.0, "trips": 2},
+    }}
+    _apply_ml_eta({"use_ml_eta": True, "ml_eta_per_stop": True}, feature)
+
+    assert len(model.seen) == 1 and model.seen[0].shape[0] == 6   # 5 legs + the whole route
+    p = feature["properties"]
+    assert [s["eta_minutes_ml"] for s in segments] == [2.0, 4.0, 6.0, 8.0, 10.0]
+    assert p["eta_minutes_ml"] == 30.0
+    # the return leg of trip 0 counts towards arrival times but is not a stop
+    assert [(e["destination_index"], e["trip"], e["eta_minutes_ml"]) for e in p["stop_etas"]] == \
+        [(1, 0, 2.0), (0, 0, 4.0), (2, 1, 8.0)]
+    start = dt.datetime.fromisoformat(segments[0]["arrival_time_ml"]) - dt.timedelta(minutes=2)
+    arrivals = [dt.datetime.fromisoformat(e["arrival_time_ml"]) - start for e in p["stop_etas"]]
+    assert arrivals == [dt.timedelta(minutes=m) for m in (2, 6, 20)]
@@ -0,0 +1,49 @@
+import json
+
+import requests
+
+from Flaskr import persistence
+
+
+class FakePostgREST:
+    """route_requests.origin_id is NOT NULL: any insert containing a null one is rejected."""
+
+    def __init__(self):
+        self.tables = {"route_requests": [], "route_results": []}
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        rows = kwargs["json"]
+        table = url.rsplit("/", 1)[1]
+        self.calls.append((table, len(rows)))
+        resp = requests.Response()
+        if table == "route_requests" and any(r["origin_id"] is None for r in rows):
+            resp.status_code, resp._content = 400, b'{"code": "23502"}'
+        else:
+            resp.status_code = 201
+            self.tables[table] += rows
+        return resp
+
+
+def _pair(i, origin_id="depot"):
+    return {"id": f"r{i}", "origin_id": origin_id}, {"request_id": f"r{i}"}
+
+
+def test_rejected_batch_dead_letters_only_the_bad_rows(tmp_path, monkeypatch):
+    db = FakePostgREST()
+    monkeypatch.setattr(persistence, "upstream", lambda name: db)
+    deadletter = tmp_path / "dead.jsonl"
+    monkeypatch.setattr(persistence, "PERSIST_DEADLETTER_PATH", str(deadletter))
+
+    writer = persistence.WriteBehindWriter("http://db.invalid/rest/v1", {})
+    batch = [_pair(0), _pair(1, origin_id=None), _pair(2)]
+    assert writer._write_batch(batch) == 2
+    writer.close()
+
+    assert [r["id"] for r in db.tables["route_requests"]] == ["r0", "r2"]
+    assert [r["request_id"] for r in db.tables["route_results"]] == ["r0", "r2"]
+    dead = [json.loads(line) for line in deadletter.read_text().splitlines()]
+    assert [(d["table"], d["row"].get("id") or d["row"]["request_id"]) for d in dead] == \
+        [("route_requests", "r1"), ("route_results", "r1")]
+    assert writer.stats["written"] == 2 and writer.stats["dead_lettered"] == 2
+    assert writer.stats["row_fallbacks"] == 1 and writer.stats["retries"] == 0
@@ -0,0 +1,122 @@
+import numpy as np
+
+from Flaskr import reoptimize as reopt
+from Flaskr.ors import _pair_tiles
+from Flaskr.geometry import haversine_m
+
+
+def test_pair_tiles_use_one_row_and_one_column_for_a_new_stop():
+    n, k = 40, 40
+    missing = {(k, j) for j in range(n)} | {(j, k) for j in range(n)}
+    tiles = _pair_tiles(missing)
+    assert len(tiles) == 2
+    assert {(len(s), len(d)) for s, d in tiles} == {(1, n), (n, 1)}
+    assert _pair_tiles({(a, b) for a in range(5) for b in range(5) if a != b}) == [(list(range(5)),) * 2]
+
+
+def test_remove_and_add_only_fetch_new_pairs(monkeypatch):
+    rng = np.random.default_rng(3)
+    pts = [{"lon": 121.05 + x, "lat": 14.58 + y, "payload": 1} for x, y in rng.uniform(-0.05, 0.05, (8, 2)).tolist()]
+    source = {"lon": 121.05, "lat": 14.58}
+    coords = np.array([[source["lon"], source["lat"]]] + [[p["lon"], p["lat"]] for p in pts])
+    D = haversine_m(coords[:, None, :], coords[None, :, :])
+    trips = [{"stops": [0, 1, 2, 3]}, {"stops": [4, 5, 6, 7]}]
+    legs = []
+    for t in trips:
+        path = [0] + [s + 1 for s in t["stops"]] + [0]
+        legs += [{"distance": D[a, b], "duration": D[a, b] / 10} for a, b in zip(path, path[1:])]
+
+    asked = []
+
+    def fake_pairs(points, pairs, profile):
+        asked.extend(pairs)
+        a = np.asarray(points)
+        return {(i, j): (float(haversine_m(a[i], a[j])), 0.0) for i, j in pairs}
+
+    monkeypatch.setattr(reopt, "fetch_pairs", fake_pairs)
+    monkeypatch.setattr(reopt, "REOPT_REPAIR_MAX_STOPS", 0)
+    saved = {"source_point": source, "destination_points": pts, "trips": trips,
+             "driver_details": {"vehicle_capacity": 5}, "destination_ids": list("abcdefgh")}
+    new = {"lon": 121.06, "lat": 14.59, "payload": 1, "id": "z"}
+    feature, payload = reopt.reoptimize(saved, legs, None, {"remove": [1], "add": [new], "mode": "matrix"})
+
+    p = feature["properties"]
+    assert sorted(p["optimized_order"]) == list(range(8))
+    assert p["summary"]["trips"] == 2
+    # 1 bridging pair for the removal + the new stop's row and column (9 nodes)
+    assert len(asked) == 1 + 2 * 8
+    assert payload["meta"]["destination_ids"] == list("acdefgh") + ["z"]
+
+
+def _saved_plan(D, trips):
+    """Legs for `trips` (destination indexes) over node matrix D (node = destination + 1)."""
+    legs = []
+    for t in trips:
+        path = [0] + [s + 1 for s in t["stops"]] + [0]
+        legs += [{"distance": float(D[a][b]), "duration": float(D[a][b]) / 10} for a, b in zip(path, path[1:])]
+    return legs
+
+
+def _pairs_by_lon(D):
+    """fetch_pairs over a fixed matrix: the node's label is its lon offset in millidegrees."""
+    def fetch(points, pairs, profile):
+        label = [round((p[0] - 121.0) * 1000) for p in points]
+        return {(i, j): (float(D[label[i]][label[j]]), 0.0) for i, j in pairs}
+    return fetch
+
+
+def _pt(label, payload=1):
+    return {"lon": 121.0 + label / 1000, "lat": 14.5, "payload": payload}
+
+
+def test_added_stop_over_capacity_or_out_of_reach(monkeypatch):
+    # depot 0 and stops 1..4 on a line, 10 m apart; stop 9 is far away
+    D = [[abs(a - b) * 10.0 if 9 not in (a, b) or a == b else 500.0 for b in range(10)] for a in range(10)]
+    monkeypatch.setattr(reopt, "fetch_pairs", _pairs_by_lon(D))
+    monkeypatch.setattr(reopt, "REOPT_REPAIR_MAX_STOPS", 0)
+    trips = [{"stops": [0, 1]}, {"stops": [2, 3]}]
+    saved = {"source_point": _pt(0), "destination_points": [_pt(i) for i in range(1, 5)], "trips": trips,
+             "driver_details": {"vehicle_capacity": 2, "maximum_distance": 200}}
+
+    feature, _ = reopt.reoptimize(saved, _saved_plan(D, trips), None, {"add": [_pt(5)], "mode": "matrix"})
+    p = feature["properties"]   # both trips are full: the new stop gets a trip of its own
+    assert [t["stops"] for t in p["trips"]] == [[0, 1], [2, 3], [4]]
+    assert p["changes"]["changed_trips"] == [2]
+
+    feature, payload = reopt.reoptimize(saved, _saved_plan(D, trips), None, {"add": [_pt(9)], "mode": "matrix"})
+    assert "cannot be served" in feature["error"] and payload is None
+
+
+def test_removal_that_lengthens_a_trip_on_a_non_metric_matrix_splits_it(monkeypatch):
+    # stop 2 is a shortcut between 1 and 3: without it the trip is 70 m, over max_distance
+    D = [[0, 10, 10, 10],
+         [10, 0, 1, 50],
+         [10, 1, 0, 10],
+         [10, 50, 10, 0]]
+    monkeypatch.setattr(reopt, "fetch_pairs", _pairs_by_lon(D))
+    trips = [{"stops": [0, 1, 2]}]
+    saved = {"source_point": _pt(0), "destination_points": [_pt(i) for i in range(1, 4)], "trips": trips,
+             "driver_details": {"vehicle_capacity": 10, "maximum_distance": 40}}
+
+    feature, _ = reopt.reoptimize(saved, _saved_plan(D, trips), None, {"remove": [1], "mode": "matrix"})
+    p = feature["properties"]
+    assert [t["stops"] for t in p["trips"]] == [[0], [1]]
+    assert all(t["distance"] <= 40 for t in p["trips"]) and p["summary"]["distance"] == 40
+
+
+def test_changed_trip_is_repaired_by_the_solver_local_search(monkeypatch):
+    # depot 0 and stops 1..6 on a line, saved in a zig-zag order
+    D = [[abs(a - b) * 10.0 for b in range(8)] for a in range(8)]
+    monkeypatch.setattr(reopt, "fetch_pairs", _pairs_by_lon(D))
+    trips = [{"stops": [4, 0, 5, 1, 3, 2]}]
+    saved = {"source_point": _pt(0), "destination_points": [_pt(i) for i in range(1, 7)], "trips": trips,
+             "driver_details": {"vehicle_capacity": 10}}
+    changes = {"add": [_pt(7)], "mode": "matrix"}
+
+    monkeypatch.setattr(reopt, "REOPT_REPAIR_MAX_STOPS", 0)
+    unrepaired, _ = reopt.reoptimize(saved, _saved_plan(D, trips), None, changes)
+    monkeypatch.setattr(reopt, "REOPT_REPAIR_MAX_STOPS", 30)
+    repaired, _ = reopt.reoptimize(saved, _saved_plan(D, trips), None, changes)
+    assert unrepaired["properties"]["summary"]["distance"] > 140
+    assert repaired["properties"]["summary"]["distance"] == 140   # out to stop 7 and back
+    assert sorted(repaired["properties"]["optimized_order"]) == list(range(7))
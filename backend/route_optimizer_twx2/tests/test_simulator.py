@@ -0,0 +1,88 @@
+import json, time
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+import Flaskr.simulator as simulator
+
+
+def test_one_scheduler_drives_many_vehicles_to_completion(monkeypatch):
+    monkeypatch.setattr(simulator, "SIM_TICK_MIN_S", 0.0)
+    monkeypatch.setattr(simulator, "SIM_TICK_MAX_S", 0.001)
+    published, pipelines = [], []
+
+    class Pipe:
+        def publish(self, channel, message):
+            m = json.loads(message)
+            published.append((channel, m["type"], m["data"]))
+
+        def execute(self):
+            pipelines.append(1)
+
+    fake_sse = SimpleNamespace(redis=SimpleNamespace(pipeline=lambda transaction=False: Pipe()))
+    monkeypatch.setattr(simulator.tracker, "sse", fake_sse)
+
+    sim = simulator.Simulator(Flask(__name__))
+    route = {
+        "geometry": {"coordinates": [[121.0 + i * 1e-3, 14.5] for i in range(5)]},
+        "properties": {"destinations": [], "summary": {"duration": 60, "distance": 500}},
+    }
+    ids = [sim.start({"driver_details": {"driver_name": f"v{i}"}, "route_details": route}) for i in range(50)]
+
+    deadline = time.time() + 5
+    while (sim.list() or len(published) < 50 * 5) and time.time() < deadline:
+        time.sleep(0.01)   # publishing trails the scheduler by one hand-off
+    assert sim.list() == []
+    assert not sim.stop(ids[0])   # finished simulations are forgotten
+    # each vehicle: one snapshot with the whole route, then one small delta per vertex
+    events = [(t, d) for ch, t, d in published if ch == "v7"]
+    assert events[0][0] == "snapshot" and len(events[0][1]["route"]) == 5
+    assert [(t, d["seq"] - events[0][1]["seq"], d["index"]) for t, d in events[1:]] == \
+        [("delta", i, i) for i in range(1, 5)]
+    assert "route" not in events[1][1]
+    assert len(pipelines) < len(published) / 10   # due ticks share one pipeline
+
+
+def test_vehicles_resend_their_route_after_a_failed_publish(monkeypatch):
+    # slow enough that the failure is known before the vehicle reaches its last vertex
+    monkeypatch.setattr(simulator, "SIM_TICK_MIN_S", 0.02)
+    monkeypatch.setattr(simulator, "SIM_TICK_MAX_S", 0.03)
+    published, executes = [], []
+
+    class Pipe:
+        def __init__(self):
+            self.buffer = []
+
+        def publish(self, channel, message):
+            m = json.loads(message)
+            self.buffer.append((channel, m["type"], m["data"]))
+
+        def execute(self):
+            executes.append(1)
+            if len(executes) == 1:
+                raise ConnectionError("redis went away")   # the snapshots never reach anyone
+            published.extend(self.buffer)
+
+    fake_sse = SimpleNamespace(redis=SimpleNamespace(pipeline=lambda transaction=False: Pipe()))
+    monkeypatch.setattr(simulator.tracker, "sse", fake_sse)
+
+    sim = simulator.Simulator(Flask(__name__))
+    route = {
+        "geometry": {"coordinates": [[121.0 + i * 1e-3, 14.5] for i in range(6)]},
+        "properties": {"destinations": [], "summary": {"duration": 60, "distance": 500}},
+    }
+    with pytest.raises(ValueError):
+        sim.start({"driver_details": {}, "route_details": route})   # no driver_name, no route_id
+    sim.start({"driver_details": {"driver_name": "resend-1"}, "route_details": route})
+
+    deadline = time.time() + 5
+    while (sim.list() or not any(d["index"] == 5 for _, _, d in published)) and time.time() < deadline:
+        time.sleep(0.01)
+    events = [(t, d) for ch, t, d in published if ch == "resend-1"]
+    # the failed snapshot is sent again with the route, then the vehicle carries on
+    assert events[0][0] == "snapshot" and len(events[0][1]["route"]) == 6
+    indexes = [d["index"] for _, d in events]
+    assert indexes[-1] == 5 and indexes == sorted(indexes)
+    seqs = [d["seq"] for _, d in events]
+    assert seqs == list(range(seqs[0], seqs[0] + len(seqs)))   # no gap for clients to resync over
@@ -0,0 +1,70 @@
+import time
+
+import numpy as np
+import pytest
+
+from Flaskr.solver import solve, trip_distance, _relocate
+
+
+def _instance(n, seed=7):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 20000, size=(n + 1, 2))
+    D = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1)) * 1.3
+    demands = [0.0] + list(rng.integers(1, 4, size=n).astype(float))
+    return D, demands
+
+
+def _check(trips, D, demands, cap, max_dist, n):
+    served = sorted(i for t in trips for i in t[1:-1])
+    assert served == list(range(1, n + 1))
+    for t in trips:
+        assert t[0] == 0 and t[-1] == 0
+        assert sum(demands[i] for i in t) <= cap
+        assert trip_distance(D, t) <= max_dist + 1e-6
+
+
+@pytest.mark.parametrize("engine", ["savings", "greedy"])
+def test_respects_capacity_and_max_distance(engine):
+    D, demands = _instance(60)
+    trips, used = solve(D, demands, capacity=10, max_distance=80000, engine=engine, time_budget_ms=200)
+    assert used == engine
+    _check(trips, D, demands, 10, 80000, 60)
+
+
+def test_savings_beats_greedy():
+    D, demands = _instance(80, seed=3)
+    total = lambda trips: sum(trip_distance(D, t) for t in trips)
+    savings, _ = solve(D, demands, capacity=12, engine="savings", time_budget_ms=300)
+    greedy, _ = solve(D, demands, capacity=12, engine="greedy")
+    assert total(savings) < total(greedy)
+
+
+def test_unservable_stop_is_reported():
+    D, demands = _instance(5)
+    demands[3] = 50
+    with pytest.raises(ValueError, match="destination"):
+        solve(D, demands, capacity=10)
+
+
+def test_relocate_keeps_the_source_trip_within_max_distance():
+    # non-metric: 1 -> 2 -> 3 is shorter than 1 -> 3, so dropping stop 2 lengthens its trip
+    D = np.full((5, 5), 10.0)
+    np.fill_diagonal(D, 0.0)
+    D[1, 2] = D[2, 3] = 1.0
+    D[1, 3] = 3.0
+    D[0, 4] = D[4, 0] = 5.0
+    D[0, 2], D[2, 4] = 1.0, 2.0
+    routes = [[1, 2, 3], [4]]   # 22 and 10 long
+    # moving 2 would shorten [4] by 2 but stretch [1, 3] to 23
+    _relocate(D, D.tolist(), np.ones(5), 10, 22.5, routes, time.perf_counter() + 1)
+    assert routes == [[1, 2, 3], [4]]
+
+
+def test_non_metric_matrix_respects_max_distance():
+    D, demands = _instance(40, seed=5)
+    rng = np.random.default_rng(5)
+    D = D * rng.uniform(0.3, 3.0, size=D.shape)   # asymmetric, breaks the triangle inequality
+    np.fill_diagonal(D, 0.0)
+    max_dist = float((D[0, 1:] + D[1:, 0]).max()) * 1.5
+    trips, _ = solve(D, demands, capacity=10, max_distance=max_dist, time_budget_ms=300)
+    _check(trips, D, demands, 10, max_dist, 40)
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+from Flaskr import tracker
+
+
+def _full(route_id, route):
+    return {"route_id": route_id, "route": route, "destinations": [], "driver_name": route_id,
+            "vehicle_type": "car", "duration": 60, "distance": 600, "pickup_time": "2026-01-01T08:00:00"}
+
+
+def test_snapshot_then_contiguous_deltas():
+    route = [[121.0 + i * 1e-3, 14.5] for i in range(4)]
+    (kind, snap), = tracker.ingest(_full("t-1", route))
+    assert kind == "snapshot" and snap["route"] == route and snap["index"] == 0
+
+    (kind, d1), = tracker.ingest(_full("t-1", route[1:]))          # old body: remaining route
+    (kind, d2), = tracker.ingest({"route_id": "t-1", "index": 3, "position": route[3]})
+    assert kind == "delta" and set(d2) == {"seq", "index", "position", "timestamp"}
+    assert (d1["index"], d2["index"]) == (1, 3)
+    assert (d1["seq"], d2["seq"]) == (snap["seq"] + 1, snap["seq"] + 2)
+    assert tracker.snapshot("t-1")["index"] == 3
+
+
+def test_coalesce_keeps_last_full_and_last_compact_per_route():
+    updates = [
+        {"route_id": "a", "index": 1}, _full("a", [[0, 0], [1, 1]]), {"route_id": "a", "index": 1},
+        {"route_id": "b", "index": 4}, {"route_id": "a", "index": 2}, {"route_id": "b", "index": 5},
+    ]
+    assert tracker.coalesce(updates) == [updates[1], updates[4], updates[5]]
+
+
+class FailingPipe:
+    def __init__(self, sent):
+        self.sent = sent
+
+    def publish(self, channel, message):
+        self.sent.append(channel)
+
+    def execute(self):
+        raise ConnectionError("redis went away")
+
+
+def test_failed_batch_publish_keeps_state_and_seq(monkeypatch):
+    route = [[121.0 + i * 1e-3, 14.5] for i in range(4)]
+    (_, snap), = tracker.ingest(_full("t-2", route))
+    sent = []
+    monkeypatch.setattr(tracker, "sse", SimpleNamespace(redis=SimpleNamespace(pipeline=lambda transaction=False: FailingPipe(sent))))
+
+    with pytest.raises(ConnectionError):
+        tracker.publish_batch([{"route_id": "t-2", "index": 2, "position": route[2]}])
+    assert sent == ["t-2"]
+    assert tracker.snapshot("t-2")["index"] == 0 and tracker.snapshot("t-2")["seq"] == snap["seq"]
+
+    (_, delta), = tracker.ingest({"route_id": "t-2", "index": 2, "position": route[2]})
+    assert delta["seq"] == snap["seq"] + 1   # no gap from the failed attempt
+
+
+def test_bad_batch_item_does_not_abort_the_rest(monkeypatch):
+    sent = []
+
+    class Pipe(FailingPipe):
+        def execute(self):
+            pass
+
+    monkeypatch.setattr(tracker, "sse", SimpleNamespace(redis=SimpleNamespace(pipeline=lambda transaction=False: Pipe(sent))))
+    tracker.ingest(_full("t-4", [[0, 0], [1, 1]]))
+    counts = tracker.publish_batch([
+        _full("t-3", [[0, 0], [1, 1]]),
+        {"route_id": "t-4", "route": 7},            # not a list: TypeError, not ValueError
+        {"route_id": "t-5", "index": 1},            # unknown route
+        _full("t-6", [[0, 0], [2, 2]]),
+    ])
+    assert (counts["accepted"], counts["rejected"], counts["published"]) == (2, 2, 2)
+    assert sent == ["t-3", "t-6"]
+    assert tracker.snapshot("t-3") is not None and tracker.snapshot("t-4")["seq"] == 1
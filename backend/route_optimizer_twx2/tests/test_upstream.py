@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from Flaskr import upstream as up
+
+
+def test_breaker_opens_fails_fast_and_recovers(monkeypatch):
+    client = up.Upstream("test", timeout=1, retries=1, pool_size=2)
+    client.breaker = up.CircuitBreaker(failures=2, reset_s=60)
+    calls = []
+
+    def boom(method, url, **kw):
+        calls.append(url)
+        raise requests.ConnectionError("down")
+    monkeypatch.setattr(client.session, "request", boom)
+
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.get("http://upstream.invalid/x")
+    with pytest.raises(up.CircuitOpen):       # open: no network call at all
+        client.get("http://upstream.invalid/x")
+    assert len(calls) == 2 and client.breaker.state == "open"
+    assert issubclass(up.CircuitOpen, requests.RequestException)
+
+    client.breaker.opened_at -= 61            # reset window elapsed -> one trial call
+    ok = requests.Response()
+    ok.status_code = 200
+    monkeypatch.setattr(client.session, "request", lambda method, url, **kw: ok)
+    assert client.get("http://upstream.invalid/x").status_code == 200
+    assert client.breaker.state == "closed"
+
+
+def test_probes_bypass_the_breaker(monkeypatch):
+    client = up.Upstream("test", timeout=1, retries=1, pool_size=2)
+    client.breaker = up.CircuitBreaker(failures=1, reset_s=60)
+
+    def boom(method, url, **kw):
+        raise requests.ConnectionError("down")
+    monkeypatch.setattr(client.session, "request", boom)
+    for _ in range(3):
+        with pytest.raises(requests.ConnectionError):
+            client.head("http://upstream.invalid/", breaker=False)
+    assert client.breaker.state == "closed"      # failing probes do not trip it
+
+    with pytest.raises(requests.ConnectionError):
+        client.get("http://upstream.invalid/x")  # real traffic does
+    assert client.breaker.state == "open"
+    ok = requests.Response()
+    ok.status_code = 200
+    monkeypatch.setattr(client.session, "request", lambda method, url, **kw: ok)
+    assert client.head("http://upstream.invalid/", breaker=False).status_code == 200   # sees recovery
+    assert client.breaker.state == "open"        # and leaves the breaker to real calls
+
+
+def test_stats_are_exact_under_concurrency(monkeypatch):
+    client = up.Upstream("test", timeout=1, retries=1, pool_size=2)
+    ok = requests.Response()
+    ok.status_code = 200
+    monkeypatch.setattr(client.session, "request", lambda method, url, **kw: ok)
+    monkeypatch.setattr(up, "observe_upstream", lambda *args: None)
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: client.get("http://upstream.invalid/x"), range(4000)))
+    assert client.describe()["requests"] == 4000
@@ -602,48 +602,92 @@ export default function Page() {
       es.onopen = () => {
         setConnStatus('connected');
         setRetries(0);
+        resync();  // late join / reconnect: start from the current snapshot
         setToast?.({ type: 'info', message: `SSE connected: ${desiredChannelRef.current}` });
       };
 
-      es.onmessage = (ev) => {
+      // Tracker protocol: one "snapshot" (whole route) then small "delta" events
+      // {seq, index, position}. A seq gap means we missed something -> refetch the snapshot.
+      const tracker = { snap: null, seq: -1 };
+
+      const renderTracker = (position, remainingCount, route) => {
         setLastSseAt(Date.now());
-        try {
-          const payload = JSON.parse(ev.data);
+        const map = mapRef.current;
 
-          // --- marker update
-          const next = (payload.remaining_routes && payload.remaining_routes[0]) || null;
-          const latlng = lonlatToLatLng(next);
-          const map = mapRef.current;
-          if (map && latlng) {
-            const L = require('leaflet');
-            if (!trackerMarkerRef.current) {
-              trackerMarkerRef.current = L.circleMarker(latlng, { radius: 6, opacity: 0.95 })
-                .addTo(map)
-                .bindTooltip('Live tracker', { direction: 'top', offset: [0, -8] });
-            } else {
-              trackerMarkerRef.current.setLatLng(latlng);
-            }
+        // --- marker update
+        const latlng = lonlatToLatLng(position);
+        if (map && latlng) {
+          const L = require('leaflet');
+          if (!trackerMarkerRef.current) {
+            trackerMarkerRef.current = L.circleMarker(latlng, { radius: 6, opacity: 0.95 })
+              .addTo(map)
+              .bindTooltip('Live tracker', { direction: 'top', offset: [0, -8] });
+          } else {
+            trackerMarkerRef.current.setLatLng(latlng);
           }
+        }
 
-          // --- progress lines
-          const feature = lastFeatureRef.current;
-          const all = feature?.geometry?.coordinates || [];
-          const rem = payload.remaining_routes || [];
-          if (map && all.length > 0) {
-            const { done, remaining } = splitProgressByRemaining(all, rem);
-            const L = require('leaflet');
-
-            if (!progressDoneRef.current) {
-              progressDoneRef.current  = L.polyline(done, { weight: 6, opacity: 0.9, color: '#16a34a' }).addTo(map);
-            } else {
-              progressDoneRef.current.setLatLngs(done);
-            }
-            if (!progressRemainRef.current) {
-              progressRemainRef.current = L.polyline(remaining, { weight: 6, opacity: 0.4, dashArray: '6,6', color: '#334155' }).addTo(map);
-            } else {
-              progressRemainRef.current.setLatLngs(remaining);
-            }
+        // --- progress lines
+        const all = route || lastFeatureRef.current?.geometry?.coordinates || [];
+        if (map && all.length > 0) {
+          const { done, remaining } = splitProgressByRemaining(all, remainingCount);
+          const L = require('leaflet');
+
+          if (!progressDoneRef.current) {
+            progressDoneRef.current  = L.polyline(done, { weight: 6, opacity: 0.9, color: '#16a34a' }).addTo(map);
+          } else {
+            progressDoneRef.current.setLatLngs(done);
           }
+          if (!progressRemainRef.current) {
+            progressRemainRef.current = L.polyline(remaining, { weight: 6, opacity: 0.4, dashArray: '6,6', color: '#334155' }).addTo(map);
+          } else {
+            progressRemainRef.current.setLatLngs(remaining);
+          }
+        }
+      };
+
+      const applySnapshot = (snap) => {
+        if (!snap || snap.seq < tracker.seq) return;
+        tracker.snap = snap;
+        tracker.seq = snap.seq;
+        const route = snap.route || [];
+        renderTracker(snap.position, route.length - snap.index, route);
+      };
+
+      const resync = async () => {
+        const channel = desiredChannelRef.current;
+        if (!channel) return;
+        try {
+          const res = await fetch(`${ROUTE_API_BASE}/tracker/${encodeURIComponent(channel)}/snapshot`);
+          if (res.ok) applySnapshot(await res.json());
+        } catch (e) {
+          console.warn('tracker resync failed:', e);
+        }
+      };
+
+      es.addEventListener('snapshot', (ev) => {
+        try { applySnapshot(JSON.parse(ev.data)); } catch (e) { console.warn('SSE parse error:', e); }
+      });
+
+      es.addEventListener('delta', (ev) => {
+        try {
+          const d = JSON.parse(ev.data);
+          if (!tracker.snap || d.seq <= tracker.seq) return;   // not synced yet / already seen
+          if (d.seq !== tracker.seq + 1) { resync(); return; } // gap
+          tracker.seq = d.seq;
+          const route = tracker.snap.route || [];
+          renderTracker(d.position, route.length - d.index, route);
+        } catch (e) {
+          console.warn('SSE parse error:', e);
+        }
+      });
+
+      // legacy full-route messages (backend TRACKER_PROTOCOL=full)
+      es.onmessage = (ev) => {
+        try {
+          const payload = JSON.parse(ev.data);
+          const rem = payload.remaining_routes || [];
+          renderTracker(rem[0] || null, rem.length);
         } catch (e) {
           console.warn('SSE parse error:', e);
         }
@@ -1539,9 +1583,8 @@ function getSelectedValues(selectEl) {
   return Array.from(selectEl.selectedOptions).map(o => o.value);
 }
 
-function splitProgressByRemaining(allLonLat = [], remainingLonLat = []) {
-  // We assume remaining is a suffix of the full path from simulate_route.
-  const remLen = remainingLonLat.length;
+function splitProgressByRemaining(allLonLat = [], remLen = 0) {
+  // The remaining part is a suffix of the full path, so its length is enough.
   const doneLen = Math.max(0, allLonLat.length - remLen);
   const done = allLonLat.slice(0, doneLen).map(([lon, lat]) => [lat, lon]);
   const remaining = allLonLat.slice(doneLen).map(([lon, lat]) => [lat, lon]);